@@ -1,24 +1,235 @@
 import sys
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton, QFileDialog, QMessageBox, QStatusBar, QLabel,
-    QListWidget, QAbstractItemView, QHBoxLayout, QDialog, QSlider, QGridLayout
+    QListWidget, QAbstractItemView, QHBoxLayout, QDialog, QSlider, QGridLayout, QProgressBar, QShortcut, QSpinBox,
+    QComboBox
 )
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QFont
+from PyQt5.QtCore import Qt, QThread, QTimer, QObject, QEvent, pyqtSignal
+from PyQt5.QtGui import QFont, QKeySequence
 import os
 import pyqtgraph.opengl as gl
 import pyqtgraph as pg
 import numpy as np
 
 # Import new classes
-from gcode_models import GCodeDocument, Move, GCodeLayer
+from gcode_models import GCodeDocument, Move, GCodeLayer, LayerMoveColumns, ItemMoveIndex, ItemPieceTable, MOVE_TYPES
 from gcode_parser import GCodeParser
-from gcode_file_handler import GCodeFileHandler
+from gcode_file_handler import GCodeFileHandler, SaveCancelled
+from gcode_cache import ParseCache
+from gcode_journal import EditJournal
+from gcode_undo import UndoStack, InsertItemsCommand, DeleteItemsCommand, ReplaceItemsCommand
+from gcode_render import (MoveDisplayBuffer, LayerRenderCache, prepare_layer_render,
+                          prepare_layer_render_from_columns, StackLevelOfDetail, forward_filled_positions,
+                          decimate_path, build_stack_chunk, level_for_pixel_size)
 
 
 viewer_open_count = 0
 
+
+class GCodeLoadThread(QThread):
+    """
+    Loads a G-code file off the GUI thread, then parses its layers one by one in the background.
+    The document is handed over (document_loaded) as soon as its layers are indexed; after that the thread
+    only reads from it and sends each layer's parsed columns back through layer_parsed, so all changes
+    to the document happen on the GUI thread.
+    """
+    document_loaded = pyqtSignal(object) # GCodeDocument
+    layer_parsed = pyqtSignal(int, object) # Document layer index, LayerMoveColumns (None if it was already parsed)
+    progress = pyqtSignal(int, int) # Layers parsed, total layers
+    failed = pyqtSignal(str)
+    canceled = pyqtSignal(bool) # True if the document had already been handed over
+
+    def __init__(self, file_handler, file_path, parent=None):
+        super().__init__(parent)
+        self.file_handler = file_handler
+        self.file_path = file_path
+        self.was_canceled = False # isInterruptionRequested() no longer tells once the thread has stopped
+
+    def run(self):
+        try:
+            document = self.file_handler.load_gcode_file(self.file_path)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        if self.isInterruptionRequested():
+            document.close()
+            self.was_canceled = True
+            self.canceled.emit(False)
+            return
+        self.document_loaded.emit(document)
+
+        layers = list(document.layers)
+        self.progress.emit(0, len(layers))
+        for i, layer_obj in enumerate(layers):
+            if self.isInterruptionRequested():
+                self.was_canceled = True
+                self.canceled.emit(True)
+                return
+            columns = None
+            if not layer_obj.is_parsed:
+                try:
+                    columns = self.file_handler.parser.parse_lines_to_columns(layer_obj.read_original_lines())
+                except Exception: # The layer is parsed again (and the error reported) when it is viewed
+                    columns = None
+            self.layer_parsed.emit(i, columns)
+            self.progress.emit(i + 1, len(layers))
+
+class GCodeSaveThread(QThread):
+    """
+    Writes a document to disk off the GUI thread. The edited layers' items must already be snapshots that
+    the GUI no longer changes; the rest of the document is only read.
+    """
+    progress = pyqtSignal(int, int) # Layers written, total layers
+    saved = pyqtSignal(str) # Output file path
+    failed = pyqtSignal(str)
+    canceled = pyqtSignal()
+
+    def __init__(self, file_handler, document, file_path, edited_layer_indices, parent=None):
+        super().__init__(parent)
+        self.file_handler = file_handler
+        self.document = document
+        self.file_path = file_path
+        self.edited_layer_indices = edited_layer_indices
+
+    def run(self):
+        try:
+            self.file_handler.save_gcode_document(self.document, self.file_path, self.edited_layer_indices,
+                                                  progress_callback=self.progress.emit,
+                                                  is_canceled=self.isInterruptionRequested)
+        except SaveCancelled:
+            self.canceled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.saved.emit(self.file_path)
+
+
+class ParseCacheStoreThread(QThread):
+    """Writes a document's parse results (a snapshot from GCodeFileHandler.cache_snapshot) to the parse cache."""
+    def __init__(self, file_handler, snapshot, parent=None):
+        super().__init__(parent)
+        self.file_handler = file_handler
+        self.snapshot = snapshot
+
+    def run(self):
+        try:
+            self.file_handler.store_cache_snapshot(self.snapshot)
+        except Exception: # The cache is an optimization only
+            pass
+
+
+class LayerPrefetchThread(QThread):
+    """
+    Prepares the layers the viewer is likely to show next (e.g. the neighbors of the layer being viewed),
+    off the GUI thread: their render data and, for layers whose items were not built yet, their items
+    (kept in the render data's `items` until the layer is opened). Layers are only read; the results are
+    handed to the GUI thread through `prepared`.
+    """
+    prepared = pyqtSignal(int, object) # Document layer index, LayerRenderData
+
+    def __init__(self, parser, document, layer_indices, style_for_type, parent=None):
+        super().__init__(parent)
+        self.parser = parser
+        self.document = document
+        self.layer_indices = layer_indices
+        self.style_for_type = style_for_type
+
+    def run(self):
+        for idx in self.layer_indices:
+            if self.isInterruptionRequested():
+                return
+            layer_obj = self.document.get_layer_by_document_index(idx)
+            if layer_obj is None:
+                continue
+            try:
+                items = None
+                if layer_obj.has_items:
+                    columns = layer_obj.get_moves(as_columns=True)
+                else:
+                    lines = layer_obj.read_original_lines()
+                    if layer_obj.is_parsed:
+                        columns = layer_obj.get_moves(as_columns=True)
+                    else:
+                        columns = self.parser.parse_lines_to_columns(lines)
+                    items = columns.to_items(lines)
+                data = prepare_layer_render_from_columns(columns, self.style_for_type)
+                data.items = items
+                data.build_levels()
+            except Exception: # Prefetching is only a speed-up; the layer is prepared again when viewed
+                continue
+            self.prepared.emit(idx, data)
+
+
+class StackPreviewBuildThread(QThread):
+    """
+    Builds the combined line buffers of a stacked multi-layer preview off the GUI thread, one chunk of
+    `chunk_layers` layers at a time, in layer order (each layer's path starts where the previous one ended).
+    Layers are only read; layers with pending edits are drawn from their edited items.
+    """
+    chunk_built = pyqtSignal(int, object) # Chunk number, list of SegmentBatch
+    progress = pyqtSignal(int, int) # Layers done, total layers
+
+    def __init__(self, parser, document, layer_indices, edited_items, level_of_detail, style_for_type,
+                 chunk_layers=32, parent=None):
+        super().__init__(parent)
+        self.parser = parser
+        self.document = document
+        self.layer_indices = layer_indices
+        self.edited_items = edited_items # Document layer index -> pending edited items
+        self.level_of_detail = level_of_detail
+        self.style_for_type = style_for_type
+        self.chunk_layers = chunk_layers
+
+    def _layer_columns(self, idx):
+        """A layer's move columns and the Z height its lines set before the first move (or None)."""
+        layer_obj = self.document.get_layer_by_document_index(idx)
+        items = self.edited_items.get(idx)
+        if items is None and layer_obj.has_items:
+            items = layer_obj.items
+        if items is not None:
+            columns = LayerMoveColumns.from_items(items)
+            first_move = columns.move_item_positions()[0] if columns.move_count else len(items)
+            return columns, self.parser.start_z_of_lines([items[i] for i in range(first_move)])
+        lines = layer_obj.read_original_lines()
+        if layer_obj.is_parsed:
+            columns = layer_obj.get_moves(as_columns=True)
+        else:
+            columns = self.parser.parse_lines_to_columns(lines)
+        first_move = int(columns.line_index[0]) if columns.move_count else len(lines)
+        return columns, self.parser.start_z_of_lines(lines[:first_move])
+
+    def run(self):
+        last_position = None
+        layers_done = 0
+        for chunk_no, chunk_start in enumerate(range(0, len(self.layer_indices), self.chunk_layers)):
+            layer_paths = []
+            for idx in self.layer_indices[chunk_start:chunk_start + self.chunk_layers]:
+                if self.isInterruptionRequested():
+                    return
+                try:
+                    columns, start_z = self._layer_columns(idx)
+                except Exception: # Left out of the preview; the viewer reports the error when the layer is opened
+                    columns = None
+                if columns is not None:
+                    # Moves carry on from where the previous layer ended, at the height the layer starts at
+                    start_position = np.full(3, np.nan) if last_position is None else np.copy(last_position)
+                    if start_z is not None:
+                        start_position[2] = start_z
+                    positions = forward_filled_positions(columns.positions(), start_position)
+                    valid_mask = ~np.isnan(positions).any(axis=1)
+                    points, type_codes = positions[valid_mask], columns.type_code[valid_mask]
+                    if len(points):
+                        last_position = points[-1]
+                    keep = decimate_path(type_codes, self.level_of_detail.max_points(idx))
+                    layer_paths.append((points[keep], type_codes[keep]))
+                layers_done += 1
+            self.chunk_built.emit(chunk_no, build_stack_chunk(layer_paths, self.style_for_type))
+            self.progress.emit(layers_done, len(self.layer_indices))
+
+
 class GCodeEditor(QMainWindow):
+    CACHE_STORE_CLOSE_WAIT_MS = 500 # How long closing the window waits for the parse cache to be written
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("3D Printing Toolpath (G-code) Editor (Refactored)")
@@ -38,7 +249,22 @@ class GCodeEditor(QMainWindow):
 
         # Instantiate parser and handler
         self.gcode_parser = GCodeParser()
-        self.gcode_file_handler = GCodeFileHandler(self.gcode_parser)
+        self.gcode_file_handler = GCodeFileHandler(self.gcode_parser, parse_cache=ParseCache())
+        # Every edit is also appended to a per-file journal, so edits survive a crash and come back on reopen
+        self.edit_journal = EditJournal()
+
+        # Background loading: the running GCodeLoadThread (if any) and the layer selector shown while it runs
+        self.load_thread = None
+        self.layer_selector_dialog = None
+        # Background saving: the running GCodeSaveThread (if any)
+        self.save_thread = None
+        # Parse results of a closed (or closing) document being written to the parse cache (ParseCacheStoreThread)
+        self.cache_store_thread = None
+        # Prepared viewer data of recently viewed layers, and the thread preparing the viewed layer's neighbors
+        self.render_cache = LayerRenderCache()
+        self.prefetch_thread = None
+        # Stacked multi-layer preview (StackedLayerPreviewDialog), if opened
+        self.stack_preview_dialog = None
 
         self.init_ui()
 
@@ -83,38 +309,156 @@ class GCodeEditor(QMainWindow):
         self.view_layer_button.setEnabled(False)
         btn_layout.addWidget(self.view_layer_button)
 
+        self.stack_preview_button = QPushButton("Stacked Preview")
+        self.stack_preview_button.setMinimumHeight(32)
+        self.stack_preview_button.setFont(QFont('Arial', 11))
+        self.stack_preview_button.clicked.connect(self.view_stacked_layers_action)
+        self.stack_preview_button.setEnabled(False)
+        btn_layout.addWidget(self.stack_preview_button)
+
         main_layout.addLayout(btn_layout)
         central_widget.setLayout(main_layout)
         self.setCentralWidget(central_widget)
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
 
+        self.load_progress_bar = QProgressBar()
+        self.load_progress_bar.setMaximumWidth(200)
+        self.load_progress_bar.setVisible(False)
+        self.status_bar.addPermanentWidget(self.load_progress_bar)
+        self.cancel_load_button = QPushButton("Cancel")
+        self.cancel_load_button.clicked.connect(self.cancel_loading_action)
+        self.cancel_load_button.setVisible(False)
+        self.status_bar.addPermanentWidget(self.cancel_load_button)
+
+        self.save_progress_bar = QProgressBar()
+        self.save_progress_bar.setMaximumWidth(200)
+        self.save_progress_bar.setVisible(False)
+        self.status_bar.addPermanentWidget(self.save_progress_bar)
+        self.cancel_save_button = QPushButton("Cancel Save")
+        self.cancel_save_button.clicked.connect(self.cancel_saving_action)
+        self.cancel_save_button.setVisible(False)
+        self.status_bar.addPermanentWidget(self.cancel_save_button)
+
     def open_gcode_file_action(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Select G-code File", "", "G-code Files (*.gcode *.nc *.txt);;All Files (*)")
+        file_path, _ = QFileDialog.getOpenFileName(self, "Select G-code File", "", "G-code Files (*.gcode *.nc *.txt *.gcode.gz *.gcode.xz);;All Files (*)")
         if file_path:
-            try:
-                self.gcode_document = self.gcode_file_handler.load_gcode_file(file_path)
-                filename = os.path.basename(file_path)
-                self.info_label.setText(f"Selected: {filename}")
-                self.save_button.setEnabled(True)
-                self.status_bar.showMessage(f"Selected: {filename}")
-
-                self.layer_button.setEnabled(bool(self.gcode_document and self.gcode_document.layer_count > 0))
-                self.selected_doc_layer_indices = set()
-                self.view_layer_button.setEnabled(False)
-                self.pending_layer_item_edits = {} # Clear pending edits from previous file
-
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to load or parse file: {e}")
-                self.gcode_document = None
-                self.save_button.setEnabled(False)
-                self.layer_button.setEnabled(False)
-                self.view_layer_button.setEnabled(False)
-                self.info_label.setText("Error loading file.")
-                self.status_bar.showMessage(f"Error: {e}")
+            self.stop_loading() # A new file replaces whatever is still loading
+
+            # Loading and parsing run on a worker thread; the document arrives in on_document_loaded
+            self.load_thread = GCodeLoadThread(self.gcode_file_handler, file_path, self)
+            self.load_thread.document_loaded.connect(self.on_document_loaded)
+            self.load_thread.layer_parsed.connect(self.on_layer_parsed)
+            self.load_thread.progress.connect(self.on_load_progress)
+            self.load_thread.failed.connect(self.on_load_failed)
+            self.load_thread.canceled.connect(self.on_load_canceled)
+            self.load_thread.finished.connect(self.on_load_thread_finished)
+            self.load_thread.finished.connect(self.load_thread.deleteLater)
+
+            self.load_progress_bar.setRange(0, 0) # Busy indicator until the layer count is known
+            self.load_progress_bar.setVisible(True)
+            self.cancel_load_button.setVisible(True)
+            self.status_bar.showMessage(f"Loading {os.path.basename(file_path)}...")
+            self.load_thread.start()
         else:
             self.status_bar.showMessage("No file selected.")
 
+    def stop_loading(self):
+        """Cancels a running load and waits for the worker thread, so the document is no longer read from it."""
+        if self.load_thread is not None:
+            self.load_thread.requestInterruption()
+            self.load_thread.wait()
+            self.load_thread = None
+        self.load_progress_bar.setVisible(False)
+        self.cancel_load_button.setVisible(False)
+
+    def cancel_loading_action(self):
+        if self.load_thread is not None:
+            self.load_thread.requestInterruption() # The thread reports back through on_load_canceled
+
+    def on_document_loaded(self, new_document):
+        if self.sender() is not self.load_thread: # Queued signal from a load that was replaced
+            new_document.close()
+            return
+        self.stop_prefetch()
+        self.render_cache.clear()
+        if self.stack_preview_dialog is not None:
+            self.stack_preview_dialog.close() # Stops its build, which reads the previous document
+            self.stack_preview_dialog = None
+        if self.gcode_document is not None:
+            self.wait_for_save() # A save started while this file was loading still reads the previous document
+            self.store_parse_cache() # Keep layers parsed while it was open
+            self.edit_journal.close()
+            self.gcode_document.close() # Release the previous file's memory map
+        self.gcode_document = new_document
+        filename = os.path.basename(new_document.file_path)
+        self.info_label.setText(f"Selected: {filename}")
+        self.save_button.setEnabled(self.save_thread is None)
+        self.status_bar.showMessage(f"Selected: {filename} (parsing layers...)")
+
+        self.layer_button.setEnabled(bool(self.gcode_document and self.gcode_document.layer_count > 0))
+        self.stack_preview_button.setEnabled(self.layer_button.isEnabled())
+        self.selected_doc_layer_indices = set()
+        self.view_layer_button.setEnabled(False)
+        self.pending_layer_item_edits = {} # Clear pending edits from previous file
+
+        # Re-apply edits journaled in an earlier session of this file (which was not saved over since)
+        try:
+            self.pending_layer_item_edits = self.edit_journal.open(new_document)
+        except Exception as e: # Recovery is best effort; the file itself loaded fine
+            self.pending_layer_item_edits = {}
+            self.status_bar.showMessage(f"Could not read the edit journal: {e}")
+        if self.pending_layer_item_edits:
+            self.status_bar.showMessage(f"Selected: {filename} (re-applied unsaved edits to "
+                                        f"{len(self.pending_layer_item_edits)} layer(s); parsing layers...)")
+
+    def on_layer_parsed(self, doc_layer_idx, columns):
+        if self.sender() is not self.load_thread or self.gcode_document is None:
+            return
+        gcode_layer_obj = self.gcode_document.get_layer_by_document_index(doc_layer_idx)
+        if columns is not None and gcode_layer_obj is not None and not gcode_layer_obj.is_parsed:
+            gcode_layer_obj.columns = columns # Unless the layer was opened (and parsed) in the meantime
+        if self.layer_selector_dialog is not None:
+            self.layer_selector_dialog.set_layer_available(doc_layer_idx)
+
+    def on_load_progress(self, layers_done, layer_total):
+        if self.sender() is not self.load_thread:
+            return
+        self.load_progress_bar.setRange(0, max(layer_total, 1))
+        self.load_progress_bar.setValue(layers_done)
+
+    def on_load_failed(self, error_message):
+        if self.sender() is not self.load_thread:
+            return
+        QMessageBox.critical(self, "Error", f"Failed to load or parse file: {error_message}")
+        self.gcode_document = None
+        self.save_button.setEnabled(False)
+        self.layer_button.setEnabled(False)
+        self.view_layer_button.setEnabled(False)
+        self.stack_preview_button.setEnabled(False)
+        self.info_label.setText("Error loading file.")
+        self.status_bar.showMessage(f"Error: {error_message}")
+
+    def on_load_canceled(self, document_loaded):
+        if self.sender() is not self.load_thread:
+            return
+        if document_loaded: # Remaining layers are parsed when they are opened
+            self.status_bar.showMessage("Background parsing cancelled.")
+        else:
+            self.status_bar.showMessage("Loading cancelled.")
+
+    def on_load_thread_finished(self):
+        if self.sender() is not self.load_thread:
+            return
+        completed = not self.load_thread.was_canceled
+        self.load_thread = None
+        self.load_progress_bar.setVisible(False)
+        self.cancel_load_button.setVisible(False)
+        if self.layer_selector_dialog is not None:
+            self.layer_selector_dialog.set_all_layers_available()
+        if completed and self.gcode_document is not None:
+            self.status_bar.showMessage(f"Selected: {os.path.basename(self.gcode_document.file_path)}")
+
     def show_layer_selector_action(self):
         if not self.gcode_document or self.gcode_document.layer_count == 0:
             QMessageBox.warning(self, "Warning", "No layers found in the G-code file.")
@@ -125,9 +469,20 @@ class GCodeEditor(QMainWindow):
         layer_labels = [f"Layer {idx} (File Layer {layer.layer_index_in_document})"
                         for idx, layer in enumerate(self.gcode_document.layers)]
 
+        # While layers are still being parsed in the background, only the parsed ones can be selected;
+        # the rest become selectable as on_layer_parsed reports them
+        available_doc_indices = None
+        if self.load_thread is not None:
+            available_doc_indices = {idx for idx, layer in enumerate(self.gcode_document.layers) if layer.is_parsed}
+
         # Pass current selection (indices into the document.layers list)
-        dlg = LayerSelectorDialog(layer_labels, self.selected_doc_layer_indices, self)
-        if dlg.exec_():
+        dlg = LayerSelectorDialog(layer_labels, self.selected_doc_layer_indices, self, available_doc_indices)
+        self.layer_selector_dialog = dlg
+        try:
+            accepted = dlg.exec_()
+        finally:
+            self.layer_selector_dialog = None
+        if accepted:
             self.selected_doc_layer_indices = dlg.get_selected_layers() # These are indices for document.layers
 
             if not self.selected_doc_layer_indices:
@@ -139,7 +494,7 @@ class GCodeEditor(QMainWindow):
                 self.status_bar.showMessage(f"Selected layer: Document Index {doc_idx}")
             else: # Multiple layers selected
                 self.view_layer_button.setEnabled(False) # Viewer only shows one layer
-                self.status_bar.showMessage(f"Selected {len(self.selected_doc_layer_indices)} layers (for potential future multi-layer ops).")
+                self.status_bar.showMessage(f"Selected {len(self.selected_doc_layer_indices)} layers (Stacked Preview shows their range).")
         else: # Dialog cancelled
             pass
 
@@ -148,64 +503,155 @@ class GCodeEditor(QMainWindow):
         if not self.gcode_document:
             QMessageBox.warning(self, "Warning", "No G-code document loaded.")
             return
+        if self.save_thread is not None:
+            return # Save is disabled while a save runs
+
+        suggested_path = self.gcode_document.file_path if self.gcode_document.file_path else ""
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save G-code File As", suggested_path, "G-code Files (*.gcode *.nc *.txt *.gcode.gz *.gcode.xz);;All Files (*)")
+        if not file_path:
+            self.status_bar.showMessage("Save operation cancelled.")
+            return
 
-        # Apply any pending edits from self.pending_layer_item_edits to the self.gcode_document.layers[*].items
+        # Apply any pending edits from self.pending_layer_item_edits to the self.gcode_document.layers[*].items.
+        # Each layer gets its own copy of the list, so edits recorded while the save runs (which replace the
+        # lists in pending_layer_item_edits) cannot change what is being written.
         edited_layer_indices_for_save = set()
         for doc_layer_idx, edited_items_list in self.pending_layer_item_edits.items():
             if 0 <= doc_layer_idx < self.gcode_document.layer_count:
                 gcode_layer_obj = self.gcode_document.get_layer_by_document_index(doc_layer_idx)
                 if gcode_layer_obj:
-                    gcode_layer_obj.items = edited_items_list # Replace items with edited version
+                    gcode_layer_obj.items = ItemPieceTable.of(edited_items_list) # Replace items with edited version
                     edited_layer_indices_for_save.add(doc_layer_idx)
 
-        suggested_path = self.gcode_document.file_path if self.gcode_document.file_path else ""
-        file_path, _ = QFileDialog.getSaveFileName(self, "Save G-code File As", suggested_path, "G-code Files (*.gcode *.nc *.txt);;All Files (*)")
+        # Writing runs on a worker thread; it reports back through on_save_* below
+        self.save_thread = GCodeSaveThread(self.gcode_file_handler, self.gcode_document, file_path,
+                                           edited_layer_indices_for_save, self)
+        self.save_thread.progress.connect(self.on_save_progress)
+        self.save_thread.saved.connect(self.on_save_finished)
+        self.save_thread.failed.connect(self.on_save_failed)
+        self.save_thread.canceled.connect(self.on_save_canceled)
+        self.save_thread.finished.connect(self.on_save_thread_finished)
+        self.save_thread.finished.connect(self.save_thread.deleteLater)
+
+        # The document must stay open until the save is done, so no other file can be opened meanwhile
+        self.save_button.setEnabled(False)
+        self.open_button.setEnabled(False)
+        self.save_progress_bar.setRange(0, max(self.gcode_document.layer_count, 1))
+        self.save_progress_bar.setValue(0)
+        self.save_progress_bar.setVisible(True)
+        self.cancel_save_button.setVisible(True)
+        self.status_bar.showMessage(f"Saving {os.path.basename(file_path)}...")
+        self.save_thread.start()
+
+    def cancel_saving_action(self):
+        if self.save_thread is not None:
+            self.save_thread.requestInterruption() # The thread reports back through on_save_canceled
+
+    def on_save_progress(self, layers_written, layer_total):
+        if self.sender() is not self.save_thread:
+            return
+        self.save_progress_bar.setRange(0, max(layer_total, 1))
+        self.save_progress_bar.setValue(layers_written)
 
-        if file_path:
-            try:
-                # Pass the set of indices for layers whose .items should be used by the saver
-                self.gcode_file_handler.save_gcode_document(self.gcode_document, file_path, edited_layer_indices_for_save)
-                self.status_bar.showMessage(f"Saved: {file_path}")
-                QMessageBox.information(self, "Saved", f"G-code saved to {file_path}")
-                # Optionally, clear pending edits after successful save to prevent re-applying them if save is called again
-                # self.pending_layer_item_edits = {}
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to save file: {e}")
-                self.status_bar.showMessage(f"Error saving file: {e}")
-        else:
-            self.status_bar.showMessage("Save operation cancelled.")
+    def on_save_finished(self, file_path):
+        if self.sender() is not self.save_thread:
+            return
+        self.status_bar.showMessage(f"Saved: {file_path}")
+        if self.gcode_document is not None and \
+                os.path.abspath(file_path) == os.path.abspath(self.gcode_document.file_path):
+            self.edit_journal.rebase() # The edits are in the file now
+        # Pending edits are kept: the document still reads unedited text from the file as it was loaded,
+        # so the next save has to write the edited layers again
+
+    def on_save_failed(self, error_message):
+        if self.sender() is not self.save_thread:
+            return
+        QMessageBox.critical(self, "Error", f"Failed to save file: {error_message}")
+        self.status_bar.showMessage(f"Error saving file: {error_message}")
 
+    def on_save_canceled(self):
+        if self.sender() is not self.save_thread:
+            return
+        self.status_bar.showMessage("Save cancelled; the file was left unchanged.")
+
+    def on_save_thread_finished(self):
+        if self.sender() is not self.save_thread:
+            return
+        self.save_thread = None
+        self.save_progress_bar.setVisible(False)
+        self.cancel_save_button.setVisible(False)
+        self.open_button.setEnabled(True)
+        self.save_button.setEnabled(self.gcode_document is not None)
+
+    def wait_for_save(self):
+        """Blocks until a running save has finished writing (used when the window is closed)."""
+        if self.save_thread is not None:
+            self.status_bar.showMessage("Finishing save...")
+            self.save_thread.wait()
 
     def view_selected_layer_action(self):
         if len(self.selected_doc_layer_indices) != 1:
             QMessageBox.warning(self, "Warning", "Please select exactly one layer to view/edit.")
             return
 
-        doc_layer_idx = list(self.selected_doc_layer_indices)[0]
+        self.view_layer(list(self.selected_doc_layer_indices)[0])
+
+    def view_stacked_layers_action(self):
+        """Opens the stacked preview of the selected layers' range, or of the full part if none are selected."""
+        if not self.gcode_document or self.gcode_document.layer_count == 0:
+            QMessageBox.warning(self, "Warning", "No layers found in the G-code file.")
+            return
+        if self.selected_doc_layer_indices:
+            first_idx, last_idx = min(self.selected_doc_layer_indices), max(self.selected_doc_layer_indices)
+        else:
+            first_idx, last_idx = 0, self.gcode_document.layer_count - 1
+        if self.stack_preview_dialog is None:
+            self.stack_preview_dialog = StackedLayerPreviewDialog(self)
+        self.stack_preview_dialog.show_layer_range(first_idx, last_idx)
+        self.stack_preview_dialog.show()
+        self.stack_preview_dialog.raise_()
+        self.stack_preview_dialog.activateWindow()
+
+    def view_layer(self, doc_layer_idx):
+        """
+        Shows a document layer in the 3D viewer (opening it if needed). Returns False if the layer was not shown,
+        e.g. because the user chose to stay on a layer with unapplied edits.
+        """
         gcode_layer_obj = self.gcode_document.get_layer_by_document_index(doc_layer_idx)
 
         if not gcode_layer_obj:
             QMessageBox.critical(self, "Error", f"Could not retrieve layer at document index {doc_layer_idx}.")
-            return
+            return False
+
+        # Showing a layer replaces the viewer's items, undo history and journal draft
+        if self.viewer_dialog is not None and not self.viewer_dialog.confirm_leave_layer():
+            return False
+
+        # Layers are parsed lazily; the first access to `.items` below turns the layer's lines into items.
+        parsing_layer_now = doc_layer_idx not in self.pending_layer_item_edits and not gcode_layer_obj.is_parsed
+        if parsing_layer_now:
+            self.status_bar.showMessage(f"Parsing layer {gcode_layer_obj.layer_index_in_document}...")
 
         # Determine the items to pass to the viewer:
         # If there are pending edits for this layer, use those. Otherwise, use items from the parsed GCodeLayer.
-        layer_items_for_viewer = self.pending_layer_item_edits.get(doc_layer_idx, gcode_layer_obj.items)
-
-        # The viewer expects a list of move dictionaries for its `moves_override`
-        # and a map of non-move lines (which is not directly used by current viewer but good to have).
-        # Convert GCodeLayer.items (Move objects and strings) to list of move dicts for viewer.
-        # Non-move strings from items are implicitly handled by their presence in the item list.
-
-        moves_for_viewer_dicts = []
-        # The Layer3DViewerDialog's `parse_moves` (which we are removing) used to create these dicts.
-        # Now, we extract them from our Move objects.
-        for item in layer_items_for_viewer:
-            if isinstance(item, Move):
-                moves_for_viewer_dicts.append(item.to_dict())
-            # String items (non-moves) are not directly passed as a separate list to current viewer,
-            # but their effect is included if the viewer reconstructs paths from the full item list.
-            # For simplicity, the current viewer primarily visualizes the sequence of X,Y,Z from moves.
+        # The viewer plots from the layer's render data, cached per layer (and keyed by the pending edits,
+        # if any). For an unedited layer it is prepared from the parsed move arrays (taken before `.items`
+        # is accessed, since materializing the items hands ownership of the layer over to them).
+        edited_items = self.pending_layer_item_edits.get(doc_layer_idx)
+        render_data = self.render_cache.get(doc_layer_idx, edited_items)
+        if render_data is None:
+            if edited_items is not None:
+                layer_columns = LayerMoveColumns.from_items(edited_items)
+            else:
+                layer_columns = gcode_layer_obj.get_moves(as_columns=True)
+            render_data = prepare_layer_render_from_columns(layer_columns, Layer3DViewerDialog._get_segment_style_for_type)
+            self.render_cache.put(doc_layer_idx, render_data, edited_items)
+        if render_data.items is not None:
+            if edited_items is None and not gcode_layer_obj.has_items:
+                # Built by the prefetch from the same lines and columns as the render data, as `.items` would
+                gcode_layer_obj.items = ItemPieceTable(render_data.items, lines_backed=True)
+            render_data.items = None
+        layer_items_for_viewer = edited_items if edited_items is not None else gcode_layer_obj.items
 
         actual_layer_display_number = gcode_layer_obj.layer_index_in_document # The "Layer N" from parsing for display title
 
@@ -214,18 +660,66 @@ class GCodeEditor(QMainWindow):
                 mainwin=self,
                 layer_idx_in_doc=doc_layer_idx,
                 actual_layer_display_number=actual_layer_display_number,
-                initial_layer_items=list(layer_items_for_viewer) # Pass the full current items list
+                initial_layer_items=layer_items_for_viewer, # The viewer edits its own copy
+                render_data=render_data
             )
         else:
             self.viewer_dialog.set_layer_data(
                 layer_idx_in_doc=doc_layer_idx,
                 actual_layer_display_number=actual_layer_display_number,
-                initial_layer_items=list(layer_items_for_viewer)
+                initial_layer_items=layer_items_for_viewer,
+                render_data=render_data
             )
 
+        self.edit_journal.record_open(doc_layer_idx) # The viewer's D-pad edits are journaled against these items
+        if parsing_layer_now:
+            self.status_bar.clearMessage()
         self.viewer_dialog.show()
         self.viewer_dialog.raise_()
         self.viewer_dialog.activateWindow()
+        self.prefetch_layers_around(doc_layer_idx)
+        return True
+
+    def view_adjacent_layer(self, step):
+        """Pages the viewer `step` layers up or down (e.g. +1 for the next layer)."""
+        if self.gcode_document is None or self.viewer_dialog is None:
+            return
+        doc_layer_idx = self.viewer_dialog.layer_idx_in_doc + step
+        if 0 <= doc_layer_idx < self.gcode_document.layer_count and self.view_layer(doc_layer_idx):
+            self.selected_doc_layer_indices = {doc_layer_idx}
+
+    def prefetch_layers_around(self, doc_layer_idx, radius=1):
+        """Prepares the render data of the layers within `radius` of the viewed one in the background."""
+        self.stop_prefetch()
+        layer_indices = [idx for distance in range(1, radius + 1) for idx in (doc_layer_idx + distance, doc_layer_idx - distance)
+                         if 0 <= idx < self.gcode_document.layer_count and idx not in self.pending_layer_item_edits
+                         and self.render_cache.get(idx) is None]
+        if not layer_indices:
+            return
+        self.prefetch_thread = LayerPrefetchThread(self.gcode_parser, self.gcode_document, layer_indices,
+                                                   Layer3DViewerDialog._get_segment_style_for_type, self)
+        self.prefetch_thread.prepared.connect(self.on_layer_prefetched)
+        self.prefetch_thread.start()
+
+    def on_layer_prefetched(self, doc_layer_idx, render_data):
+        if self.sender() is not self.prefetch_thread or doc_layer_idx in self.pending_layer_item_edits:
+            return
+        gcode_layer_obj = self.gcode_document.get_layer_by_document_index(doc_layer_idx)
+        if gcode_layer_obj is None:
+            return
+        if gcode_layer_obj.has_items:
+            render_data.items = None # The layer was opened in the meantime
+        elif not gcode_layer_obj.is_parsed:
+            # Parsed by the prefetch; the layer keeps them as columns (which the parse cache stores) until opened
+            gcode_layer_obj.columns = render_data.columns
+        self.render_cache.put(doc_layer_idx, render_data)
+
+    def stop_prefetch(self):
+        """Cancels a running prefetch and waits for its thread, so the document is no longer read from it."""
+        if self.prefetch_thread is not None:
+            self.prefetch_thread.requestInterruption()
+            self.prefetch_thread.wait()
+            self.prefetch_thread = None
 
     def record_layer_edits(self, layer_idx_in_doc, edited_items_list_from_viewer):
         """
@@ -234,6 +728,7 @@ class GCodeEditor(QMainWindow):
         `edited_items_list_from_viewer` is the list of items (Move objects or strings) from the viewer.
         """
         self.pending_layer_item_edits[layer_idx_in_doc] = edited_items_list_from_viewer
+        self.edit_journal.record_layer_items(layer_idx_in_doc, edited_items_list_from_viewer)
 
         display_layer_num = -1
         if self.gcode_document and 0 <= layer_idx_in_doc < self.gcode_document.layer_count:
@@ -241,6 +736,41 @@ class GCodeEditor(QMainWindow):
 
         self.status_bar.showMessage(f"Edits for Layer {display_layer_num} (Doc idx: {layer_idx_in_doc}) recorded. Save document to make permanent.")
 
+    def store_parse_cache(self):
+        """Writes the current document's parsed layers to the parse cache on a worker thread."""
+        snapshot = self.gcode_file_handler.cache_snapshot(self.gcode_document)
+        if snapshot is None:
+            return
+        if self.cache_store_thread is not None:
+            self.cache_store_thread.wait() # One store at a time; the previous one was started a file ago
+        self.cache_store_thread = ParseCacheStoreThread(self.gcode_file_handler, snapshot, self)
+        self.cache_store_thread.finished.connect(self.on_cache_store_finished)
+        self.cache_store_thread.start()
+
+    def on_cache_store_finished(self):
+        thread = self.sender()
+        if thread is self.cache_store_thread:
+            self.cache_store_thread = None
+        thread.deleteLater()
+
+    def closeEvent(self, event):
+        self.stop_loading()
+        self.stop_prefetch()
+        if self.stack_preview_dialog is not None:
+            self.stack_preview_dialog.stop_build()
+        self.wait_for_save() # Closing does not cancel a save the user started
+        if self.gcode_document is not None:
+            self.store_parse_cache()
+        self.edit_journal.close()
+        if self.cache_store_thread is not None and not self.cache_store_thread.wait(self.CACHE_STORE_CLOSE_WAIT_MS):
+            # The window closes anyway; the application quits once the cache entry is written
+            app = QApplication.instance()
+            app.setQuitOnLastWindowClosed(False)
+            self.cache_store_thread.finished.connect(app.quit)
+            if self.cache_store_thread.isFinished(): # Finished before the connection was made
+                QTimer.singleShot(0, app.quit)
+        super().closeEvent(event)
+
     # remove_all_thumbnails - moved to GCodeParser
     # parse_layers - logic moved to GCodeParser.parse_document_to_layers
     # moves_to_gcode - logic moved to GCodeParser.gcode_layer_to_lines
@@ -251,16 +781,28 @@ class GCodeEditor(QMainWindow):
     #                          If needed, similar logic might exist in parser or viewer based on item indices.
 
 class LayerSelectorDialog(QDialog): # Mostly unchanged
-    def __init__(self, layer_labels, initially_selected_doc_indices, parent=None):
+    def __init__(self, layer_labels, initially_selected_doc_indices, parent=None, available_doc_indices=None):
+        """
+        :param available_doc_indices: Layers that can be selected right away (None for all). The others are
+                                      shown disabled until set_layer_available() is called for them.
+        """
         super().__init__(parent)
         self.setWindowTitle("Select Layers")
         self.setMinimumWidth(300) # Can be wider if labels are long
         layout = QVBoxLayout(self)
         self.list_widget = QListWidget()
         self.list_widget.setSelectionMode(QAbstractItemView.ExtendedSelection) # Allow multi-select
+        self.layer_labels = layer_labels
+        self.pending_doc_indices = set()
 
         for idx, label in enumerate(layer_labels): # idx here is the index in the list_widget
             self.list_widget.addItem(label)
+            if available_doc_indices is not None and idx not in available_doc_indices:
+                item = self.list_widget.item(idx)
+                item.setText(f"{label} (parsing...)")
+                item.setFlags(item.flags() & ~(Qt.ItemIsEnabled | Qt.ItemIsSelectable))
+                self.pending_doc_indices.add(idx)
+                continue
             # `initially_selected_doc_indices` are indices for `document.layers`
             # The `layer_labels` are generated in order of `document.layers`, so indices match.
             if idx in initially_selected_doc_indices:
@@ -276,15 +818,208 @@ class LayerSelectorDialog(QDialog): # Mostly unchanged
         btn_box.addWidget(cancel_btn)
         layout.addLayout(btn_box)
 
+    def set_layer_available(self, idx):
+        """Makes a layer that was still being parsed selectable."""
+        if idx not in self.pending_doc_indices:
+            return
+        self.pending_doc_indices.discard(idx)
+        item = self.list_widget.item(idx)
+        item.setText(self.layer_labels[idx])
+        item.setFlags(item.flags() | Qt.ItemIsEnabled | Qt.ItemIsSelectable)
+
+    def set_all_layers_available(self):
+        for idx in list(self.pending_doc_indices):
+            self.set_layer_available(idx)
+
     def get_selected_layers(self):
         # Returns a set of indices corresponding to items in document.layers
         return set([self.list_widget.row(item) for item in self.list_widget.selectedItems()])
 
 
+class RedrawScheduler(QObject):
+    """
+    Coalesces redraw requests: request() only marks the view dirty, and `redraw` runs at most once per
+    `interval_ms` (one display frame by default), showing whatever the latest state is by then. Requests
+    arriving faster than that (e.g. a held arrow key) skip the intermediate states.
+    """
+    DEFAULT_INTERVAL_MS = 16 # ~60 fps
+
+    def __init__(self, redraw, interval_ms=DEFAULT_INTERVAL_MS, parent=None):
+        super().__init__(parent)
+        self.redraw = redraw
+        self.pending = False
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.flush)
+
+    @property
+    def interval_ms(self):
+        return self.timer.interval()
+
+    @interval_ms.setter
+    def interval_ms(self, value):
+        self.timer.setInterval(value)
+
+    def request(self):
+        self.pending = True
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        """Redraws now if a redraw is pending."""
+        self.timer.stop()
+        if self.pending:
+            self.pending = False
+            self.redraw()
+
+
+class ScrubLinePlotItem(gl.GLLinePlotItem):
+    """
+    GLLinePlotItem that draws only the first `vertex_count` vertices of its vertex buffer. The buffer is
+    uploaded to the GPU once; changing the count afterwards (e.g. while scrubbing) uploads nothing.
+    """
+    def setData(self, **kwds):
+        super().setData(**kwds)
+        if 'pos' in kwds:
+            self._vertices = self.pos
+
+    def set_vertex_count(self, count):
+        if self._uploads_through_vbo():
+            self.pos = self._vertices[:count] # paint() draws len(self.pos) vertices
+            self.update()
+        else: # pyqtgraph without the buffer internals relied on here: set (and upload) the vertices shown
+            super().setData(pos=self._vertices[:count])
+
+    def _uploads_through_vbo(self):
+        return hasattr(self, 'm_vbo_position') and hasattr(gl.GLLinePlotItem, 'upload_vbo')
+
+    def upload_vbo(self, vbo, arr):
+        if vbo is getattr(self, 'm_vbo_position', None):
+            arr = self._vertices
+        super().upload_vbo(vbo, arr)
+
+
+class StackedLayerPreviewDialog(QDialog):
+    """
+    Read-only 3D preview of a range of layers stacked on each other (or of the whole part), without travel.
+    Layers near the top of the range are drawn in full and the others decimated (see StackLevelOfDetail);
+    the line buffers are built in the background and drawn with one GL item per chunk of layers and style.
+    """
+    CHUNK_LAYERS = 32
+
+    def __init__(self, mainwin, parent=None):
+        super().__init__(parent)
+        self.mainwin = mainwin
+        self.build_thread = None
+        self.line_items = []
+        self.bounds = None # (min, max) of the drawn vertices so far
+        self.setWindowTitle("Stacked Layer Preview")
+        self.setMinimumSize(900, 700)
+
+        layout = QVBoxLayout(self)
+        self.gl_widget = gl.GLViewWidget()
+        self.gl_widget.setBackgroundColor('w')
+        layout.addWidget(self.gl_widget, stretch=1)
+
+        range_bar = QHBoxLayout()
+        range_bar.addWidget(QLabel("Layers"))
+        self.first_layer_spin = QSpinBox()
+        range_bar.addWidget(self.first_layer_spin)
+        range_bar.addWidget(QLabel("to"))
+        self.last_layer_spin = QSpinBox()
+        range_bar.addWidget(self.last_layer_spin)
+        show_button = QPushButton("Show")
+        show_button.clicked.connect(lambda: self.show_layer_range(self.first_layer_spin.value(), self.last_layer_spin.value()))
+        range_bar.addWidget(show_button)
+        full_part_button = QPushButton("Full Part")
+        full_part_button.clicked.connect(self.show_full_part_action)
+        range_bar.addWidget(full_part_button)
+        range_bar.addStretch(1)
+        self.status_label = QLabel()
+        range_bar.addWidget(self.status_label)
+        layout.addLayout(range_bar)
+
+    def show_full_part_action(self):
+        self.show_layer_range(0, self.mainwin.gcode_document.layer_count - 1)
+
+    def show_layer_range(self, first_idx, last_idx):
+        """Rebuilds the preview for document layers first_idx..last_idx (inclusive)."""
+        document = self.mainwin.gcode_document
+        if document is None or document.layer_count == 0:
+            return
+        self.stop_build()
+        first_idx, last_idx = sorted((max(0, first_idx), min(last_idx, document.layer_count - 1)))
+        for spin in (self.first_layer_spin, self.last_layer_spin):
+            spin.setRange(0, document.layer_count - 1)
+        self.first_layer_spin.setValue(first_idx)
+        self.last_layer_spin.setValue(last_idx)
+
+        self.gl_widget.clear()
+        self.line_items = []
+        self.bounds = None
+        layer_indices = list(range(first_idx, last_idx + 1))
+        level_of_detail = StackLevelOfDetail(last_idx, len(layer_indices))
+        self.build_thread = StackPreviewBuildThread(self.mainwin.gcode_parser, document, layer_indices,
+                                                    dict(self.mainwin.pending_layer_item_edits), level_of_detail,
+                                                    Layer3DViewerDialog._get_segment_style_for_type,
+                                                    self.CHUNK_LAYERS, self)
+        self.build_thread.chunk_built.connect(self.on_chunk_built)
+        self.build_thread.progress.connect(self.on_build_progress)
+        self.build_thread.start()
+        self.status_label.setText(f"Building layers {first_idx}-{last_idx}...")
+
+    def on_chunk_built(self, chunk_no, batches):
+        if self.sender() is not self.build_thread:
+            return
+        for batch in batches:
+            line_item = gl.GLLinePlotItem(pos=batch.positions, color=batch.colors, width=batch.width,
+                                          antialias=batch.antialias, mode='lines')
+            self.gl_widget.addItem(line_item)
+            self.line_items.append(line_item)
+            chunk_min, chunk_max = batch.positions.min(axis=0), batch.positions.max(axis=0)
+            if self.bounds is None:
+                self.bounds = (chunk_min, chunk_max)
+                self._setup_camera() # Frame the part as soon as something is drawn
+            else:
+                self.bounds = (np.minimum(self.bounds[0], chunk_min), np.maximum(self.bounds[1], chunk_max))
+
+    def on_build_progress(self, layers_done, layer_total):
+        if self.sender() is not self.build_thread:
+            return
+        if layers_done < layer_total:
+            self.status_label.setText(f"Building... {layers_done} / {layer_total} layers")
+            return
+        segment_count = sum(len(item.pos) // 2 for item in self.line_items)
+        self.status_label.setText(f"{layer_total} layers, {segment_count:,} lines in {len(self.line_items)} buffers")
+        self._setup_camera()
+
+    def _setup_camera(self):
+        if self.bounds is None:
+            return
+        min_coords, max_coords = self.bounds
+        center_coords = (min_coords + max_coords) / 2
+        distance = max(float(np.max(max_coords - min_coords)), 20) * 1.5
+        self.gl_widget.setCameraPosition(pos=pg.Vector(center_coords[0], center_coords[1], center_coords[2]),
+                                         distance=distance, elevation=30, azimuth=45)
+
+    def stop_build(self):
+        """Cancels a running build and waits for its thread, so the document is no longer read from it."""
+        if self.build_thread is not None:
+            self.build_thread.requestInterruption()
+            self.build_thread.wait()
+            self.build_thread = None
+
+    def closeEvent(self, event):
+        self.stop_build()
+        super().closeEvent(event)
+
+
 class Layer3DViewerDialog(QDialog):
     # `layer_lines` and `moves_override` are replaced by `initial_layer_items`
     def __init__(self, initial_layer_items=None, mainwin=None,
-                 layer_idx_in_doc=None, actual_layer_display_number=None, parent=None):
+                 layer_idx_in_doc=None, actual_layer_display_number=None, parent=None, initial_layer_columns=None,
+                 render_data=None):
         super().__init__(parent)
         self.mainwin = mainwin
         self.layer_idx_in_doc = layer_idx_in_doc if layer_idx_in_doc is not None else -1
@@ -298,40 +1033,63 @@ class Layer3DViewerDialog(QDialog):
         self.setMinimumSize(900, 700)
 
         # `self.items` will be the working copy of the layer's content (Move objects and strings)
-        # It's initialized from `initial_layer_items`. Edits modify this list.
-        self.items = list(initial_layer_items) if initial_layer_items else []
+        # It's initialized from `initial_layer_items`. Edits modify this ItemPieceTable.
+        self.items = ItemPieceTable.of(initial_layer_items if initial_layer_items else [])
+        self.applied_items = self.items.copy() # The items as last received from or applied to the main window
 
-        # `self.current_display_moves` is a list of move *dictionaries* derived from `self.items`, for plotting.
-        # This needs to be updated whenever `self.items` changes.
-        self.current_display_moves = self._get_move_dicts_from_items()
+        # `self.display_buffer` holds the moves of `self.items` as position/type arrays, for plotting, and
+        # `self.move_index` maps move numbers to positions in self.items. Both are patched on every edit.
+        self._init_display_buffers(initial_layer_columns, render_data)
 
         self.edit_sessions = []
+        # Undo/redo history of the edits made to self.items in this viewer (per layer)
+        self.undo_stack = UndoStack()
         self.session_colors = [
             (1,0,0,1), (1,0.5,0,1), (1,1,0,1), (0,1,0,1),
             (0,0,1,1), (0.5,0,1,1), (1,0,1,1), (0,1,1,1),
         ]
         self.editor_active = False
-        # Slider now refers to index in `self.current_display_moves`
-        self.current_slider_index = len(self.current_display_moves) if self.current_display_moves else 0
+        # Slider now refers to index in `self.display_buffer`
+        self.current_slider_index = self.display_buffer.move_count
+
+        # Slider moves, D-pad steps and edits ask for a redraw; the scheduler draws at most once per frame
+        self.redraw_scheduler = RedrawScheduler(self.update_plot_and_slider_status, parent=self)
 
         self.init_ui_elements() # Renamed from init_ui to avoid conflict
-        self.update_plot_and_slider_status() # Renamed
+        self.redraw_scheduler.request()
+        self.redraw_scheduler.flush() # Draw the layer right away
 
-    def _get_move_dicts_from_items(self):
-        """Extracts move dictionaries from self.items for visualization."""
-        move_dicts = []
-        for item in self.items:
-            if isinstance(item, Move):
-                move_dicts.append(item.to_dict())
-        return move_dicts
+    def _init_display_buffers(self, layer_columns=None, render_data=None):
+        """
+        Builds the plotted move arrays and the move index for a newly shown layer. `render_data` is the
+        layer's prepared LayerRenderData (from the main window's render cache), drawn until the first edit.
+        """
+        self.render_data = render_data
+        if layer_columns is None and render_data is not None:
+            layer_columns = render_data.columns
+        if layer_columns is None:
+            layer_columns = LayerMoveColumns.from_items(self.items)
+        self.display_buffer = MoveDisplayBuffer(layer_columns)
+        self.move_index = ItemMoveIndex.from_columns(layer_columns)
+        self._scene = None # The GL scene is rebuilt for the new layer on the next update
 
     def init_ui_elements(self): # Was init_ui
         layout = QVBoxLayout(self)
         self.gl_widget = gl.GLViewWidget()
         self.gl_widget.setBackgroundColor('w')
+        self.gl_widget.installEventFilter(self)
         layout.addWidget(self.gl_widget, stretch=1)
 
         top_bar = QHBoxLayout()
+        # Paging through layers; the neighbors of the shown layer are prepared in the background
+        self.prev_layer_button = QPushButton("◀ Layer")
+        self.prev_layer_button.clicked.connect(lambda: self.page_layer_action(-1))
+        self.next_layer_button = QPushButton("Layer ▶")
+        self.next_layer_button.clicked.connect(lambda: self.page_layer_action(1))
+        top_bar.addWidget(self.prev_layer_button)
+        top_bar.addWidget(self.next_layer_button)
+        QShortcut(QKeySequence(Qt.Key_PageDown), self, activated=lambda: self.page_layer_action(-1))
+        QShortcut(QKeySequence(Qt.Key_PageUp), self, activated=lambda: self.page_layer_action(1))
         top_bar.addStretch(1)
         self.editor_button = QPushButton("Enable Toolpath Editor")
         self.editor_button.setFixedWidth(270)
@@ -382,7 +1140,24 @@ class Layer3DViewerDialog(QDialog):
                     btn.clicked.connect(lambda checked, g=diag_map[direction]: self.handle_dpad_move_grid(g))
             self.dpad_buttons[direction] = btn
             dpad_layout.addWidget(btn, row, col)
-        self.dpad_widget.setLayout(dpad_layout)
+        # What a D-pad step does: insert a travel at the session tip, or move the point (or the run of
+        # same-type moves) at the slider
+        edit_tools_layout = QVBoxLayout()
+        self.dpad_mode_combo = QComboBox()
+        self.dpad_mode_combo.addItem("D-pad: insert travel", 'insert')
+        self.dpad_mode_combo.addItem("D-pad: move point", 'point')
+        self.dpad_mode_combo.addItem("D-pad: move type run", 'run')
+        edit_tools_layout.addWidget(self.dpad_mode_combo)
+        self.delete_move_button = QPushButton("Delete Move")
+        self.delete_move_button.clicked.connect(self.delete_move_action)
+        edit_tools_layout.addWidget(self.delete_move_button)
+        edit_tools_layout.addStretch(1)
+        QShortcut(QKeySequence(Qt.Key_Delete), self, activated=self.delete_move_action)
+        editor_layout = QHBoxLayout()
+        editor_layout.setContentsMargins(0,0,0,0)
+        editor_layout.addLayout(edit_tools_layout)
+        editor_layout.addLayout(dpad_layout)
+        self.dpad_widget.setLayout(editor_layout)
         self.dpad_widget.setVisible(False)
 
         dpad_bar = QHBoxLayout()
@@ -394,7 +1169,7 @@ class Layer3DViewerDialog(QDialog):
         self.slider = QSlider(Qt.Horizontal)
         self.slider.setMinimum(1)
         # Max is based on number of moves derived from items
-        self.slider.setMaximum(len(self.current_display_moves) if self.current_display_moves else 1)
+        self.slider.setMaximum(self.display_buffer.move_count or 1)
         self.slider.setValue(self.current_slider_index if self.current_slider_index > 0 else 1)
         self.slider.valueChanged.connect(self.slider_value_changed_action) # Renamed
         slider_layout.addWidget(self.slider)
@@ -419,6 +1194,16 @@ class Layer3DViewerDialog(QDialog):
         save_bar.addWidget(self.apply_edits_button)
         layout.insertLayout(1, save_bar)
 
+        self.undo_button = QPushButton("Undo")
+        self.undo_button.clicked.connect(self.undo_edit_action)
+        self.redo_button = QPushButton("Redo")
+        self.redo_button.clicked.connect(self.redo_edit_action)
+        save_bar.insertWidget(1, self.undo_button)
+        save_bar.insertWidget(2, self.redo_button)
+        QShortcut(QKeySequence.Undo, self, activated=self.undo_edit_action)
+        QShortcut(QKeySequence.Redo, self, activated=self.redo_edit_action)
+        self._update_undo_buttons()
+
         self._is_custom_maximized = False
         self._has_been_shown = False
         # self.update_plot_and_slider_status() # Called from constructor after init_ui_elements
@@ -436,122 +1221,241 @@ class Layer3DViewerDialog(QDialog):
         # self.arrow_forward = arrow_forward
 
     # Replaces original set_layer and parts of __init__
-    def set_layer_data(self, layer_idx_in_doc=None, actual_layer_display_number=None, initial_layer_items=None):
+    def set_layer_data(self, layer_idx_in_doc=None, actual_layer_display_number=None, initial_layer_items=None,
+                       initial_layer_columns=None, render_data=None):
 
         self.layer_idx_in_doc = layer_idx_in_doc if layer_idx_in_doc is not None else self.layer_idx_in_doc
         self.actual_layer_display_number = actual_layer_display_number if actual_layer_display_number is not None else self.actual_layer_display_number
 
-        self.items = list(initial_layer_items) if initial_layer_items is not None else []
-        self.current_display_moves = self._get_move_dicts_from_items()
+        self.items = ItemPieceTable.of(initial_layer_items if initial_layer_items is not None else [])
+        self.applied_items = self.items.copy()
+        self._init_display_buffers(initial_layer_columns, render_data)
 
         self.setWindowTitle(f"3D Layer Viewer - Layer {self.actual_layer_display_number} (Doc idx: {self.layer_idx_in_doc})")
 
-        num_moves = len(self.current_display_moves)
+        num_moves = self.display_buffer.move_count
         self.current_slider_index = num_moves if num_moves > 0 else 0 # Slider position (1-based for UI if num_moves > 0)
         self.slider.setMaximum(num_moves if num_moves > 0 else 1)
         self.slider.setValue(self.current_slider_index if self.current_slider_index > 0 else 1)
 
         self.edit_sessions = []
+        self.undo_stack.clear()
+        self._update_undo_buttons()
         self.editor_active = False
         self.dpad_widget.setVisible(False)
         self.editor_button.setText("Enable Toolpath Editor")
         self.editor_button.setStyleSheet("")
 
-        self.update_plot_and_slider_status()
+        self.redraw_scheduler.request()
 
     # Original parse_moves is removed, as items/moves are now passed in.
 
+    def page_layer_action(self, step):
+        if self.mainwin and hasattr(self.mainwin, 'view_adjacent_layer'):
+            self.mainwin.view_adjacent_layer(step)
+
     def slider_value_changed_action(self, value):
         self.current_slider_index = value
-        self.update_plot_and_slider_status()
+        self.redraw_scheduler.request()
 
     def update_plot_and_slider_status(self): # Was update_plot
-        self.gl_widget.clear()
-
-        num_render_points = self.current_slider_index # This is 1-based from slider, meaning number of points to consider
-
-        if not self.current_display_moves or num_render_points == 0:
+        # The layer's scene (grid, toolpath buffers, extruder head, camera) is built once per layer, and its
+        # toolpath buffers are patched after edits. Moving the slider only changes how many vertices are drawn
+        # and where the head is.
+        if self._scene is None:
+            self._build_layer_scene()
+        elif self._scene['version'] != self.display_buffer.version:
+            self._patch_toolpath_items()
+        scene = self._scene
+        # Dense toolpaths are drawn simplified when zoomed out (see LEVEL_TOLERANCES)
+        level_no = level_for_pixel_size(self._camera_pixel_size())
+        if scene['data'].bounds is not None and level_no != scene['level_no']:
+            self._set_toolpath_level(level_no)
+
+        num_render_points = min(self.current_slider_index, self.display_buffer.move_count) # Number of moves to show
+        if self.display_buffer.move_count == 0 or num_render_points <= 0:
+            self._show_path_up_to(0)
             self.status_label.setText("No moves to display.")
-            # Setup camera for empty grid if needed
-            # self._setup_camera_for_plot(np.array([]))
             return
 
-        # Filter out moves with None for x, y, or z
-        filtered_moves = [m for m in self.current_display_moves[:num_render_points] if m['x'] is not None and m['y'] is not None and m['z'] is not None]
-        if not filtered_moves:
+        # Moves with no x, y, or z (NaN in the move arrays) are not plotted
+        valid_points_shown = int(scene['data'].valid_points_before[num_render_points])
+        self._show_path_up_to(valid_points_shown)
+        self._update_session_lines()
+        if valid_points_shown == 0:
             self.status_label.setText("No valid moves to display.")
             return
+        self.status_label.setText(f"Move {valid_points_shown} / {self.display_buffer.move_count}")
 
-        points_to_render_np = np.array([[m['x'], m['y'], m['z']] for m in filtered_moves])
+    def _build_layer_scene(self):
+        """Clears the view and builds the static scene of a newly shown layer."""
+        self.gl_widget.clear()
+        self._scene = {'grid': None, 'line_items': [], 'session_items': [], 'session_key': None, 'head': None,
+                       'tail': None}
+        self.gl_widget.setBackgroundColor('w')
+        self._rebuild_toolpath_items()
+        # Setup camera based on all points in the layer for consistent framing
+        self._setup_camera_for_plot(self._scene['data'].bounds)
+
+    def _rebuild_toolpath_items(self):
+        """(Re)builds the grid, the toolpath vertex buffers and the extruder head from the display buffer."""
+        scene = self._scene
+        for item in [scene['grid'], scene['head'], scene['tail']] + scene['line_items']:
+            if item is not None:
+                self.gl_widget.removeItem(item)
+        scene['grid'] = scene['head'] = scene['tail'] = None
+        scene['line_items'] = []
+        scene['level'] = scene['level_no'] = None
+
+        # The prepared render data shows the layer as it was handed in; once edited, it is prepared again
+        if self.render_data is not None and self.display_buffer.version == 0:
+            data = self.render_data
+        else:
+            data = prepare_layer_render(self.display_buffer.positions(), self.display_buffer.type_code,
+                                        self._get_segment_style_for_type)
+        scene['version'] = self.display_buffer.version
+        scene['data'] = data
+        if data.bounds is None:
+            return
+
+        self._add_grid(data)
 
+        # The toolpath's line items are added for the level of detail the camera calls for (_set_toolpath_level).
+        # At a simplified level, the tail joins the last point of the level that is shown to the head.
+        scene['tail'] = gl.GLLinePlotItem(pos=np.zeros((2, 3)), mode='lines')
+        scene['tail'].setVisible(False)
+        self.gl_widget.addItem(scene['tail'])
+        scene['head'] = self._create_extruder_head()
+        self.gl_widget.addItem(scene['head'])
+
+    def _add_grid(self, data):
         grid = gl.GLGridItem()
         # Dynamic grid sizing based on all points in the layer for consistent view
-        all_points_for_grid = np.array([[m['x'], m['y'], m['z']] for m in self.current_display_moves if m['x'] is not None and m['y'] is not None and m['z'] is not None])
-        if all_points_for_grid.size >0:
-            x_span = np.ptp(all_points_for_grid[:,0]) if all_points_for_grid.shape[0] > 0 else 100
-            y_span = np.ptp(all_points_for_grid[:,1]) if all_points_for_grid.shape[0] > 0 else 100
-            grid_size = max(x_span, y_span, 20) # Ensure grid is at least 20x20
-            grid.setSize(x=grid_size, y=grid_size)
-            grid.setSpacing(x=grid_size/10, y=grid_size/10) # 10 grid lines
-            # Center grid based on all points
-            center_x = np.mean(all_points_for_grid[:,0]) if all_points_for_grid.shape[0] > 0 else 0
-            center_y = np.mean(all_points_for_grid[:,1]) if all_points_for_grid.shape[0] > 0 else 0
-            grid.translate(center_x, center_y, 0) # Assuming Z=0 for grid plane
+        min_coords, max_coords = data.bounds
+        grid_size = max(max_coords[0] - min_coords[0], max_coords[1] - min_coords[1], 20) # Ensure grid is at least 20x20
+        grid.setSize(x=grid_size, y=grid_size)
+        grid.setSpacing(x=grid_size/10, y=grid_size/10) # 10 grid lines
+        # Center grid based on all points
+        grid.translate(data.center[0], data.center[1], 0) # Assuming Z=0 for grid plane
         self.gl_widget.addItem(grid)
+        self._scene['grid'] = grid
 
-        # Draw toolpath segments. A segment exists from point i-1 to point i.
-        # This segment corresponds to the properties of move i (the end point of the segment).
-        for i in range(1, len(filtered_moves)):
-            segment_coords_np = np.array([points_to_render_np[i-1], points_to_render_np[i]])
-            move_properties_dict = filtered_moves[i]
-
-            color, width, antialias, is_dotted = self._get_segment_style_from_move(move_properties_dict)
-
-            if is_dotted:
-                # Create dotted line effect (simplified)
-                num_dots = 10
-                for j in range(0, num_dots -1, 2): # Draw every other segment
-                    start_frac = j / num_dots
-                    end_frac = (j+1) / num_dots
-                    dot_start_pt = segment_coords_np[0] + (segment_coords_np[1] - segment_coords_np[0]) * start_frac
-                    dot_end_pt = segment_coords_np[0] + (segment_coords_np[1] - segment_coords_np[0]) * end_frac
-                    dot_line_item = gl.GLLinePlotItem(pos=np.array([dot_start_pt, dot_end_pt]),
-                                                      color=color, width=width, antialias=antialias, mode='lines')
-                    dot_line_item.setGLOptions('translucent')
-                    self.gl_widget.addItem(dot_line_item)
-            else:
-                line_item = gl.GLLinePlotItem(pos=segment_coords_np, color=color, width=width, antialias=antialias, mode='lines')
-                self.gl_widget.addItem(line_item)
-
-        # Draw edit session lines (if editor active and sessions exist)
-        if self.editor_active and self.edit_sessions:
+    def _patch_toolpath_items(self):
+        """
+        Brings the toolpath up to date with the display buffer after edits: the render data is patched around
+        the edited moves (LayerRenderData.spliced) and only the line items whose vertices changed are uploaded
+        again, instead of preparing the whole layer and rebuilding every item (_rebuild_toolpath_items).
+        """
+        scene = self._scene
+        data = scene['data']
+        edited = self.display_buffer.edited_range(scene['version'])
+        if edited is None or data.bounds is None or scene['level'] is None:
+            self._rebuild_toolpath_items()
+            return
+        start, old_stop, new_stop = edited
+        new_data = data.spliced(start, old_stop, self.display_buffer.positions()[start:new_stop],
+                                self.display_buffer.type_code[start:new_stop])
+        if new_data.bounds is None:
+            self._rebuild_toolpath_items()
+            return
+        scene['version'] = self.display_buffer.version
+        scene['data'] = new_data
+        if not all(np.array_equal(old, new) for old, new in zip(data.bounds, new_data.bounds)):
+            self.gl_widget.removeItem(scene['grid'])
+            self._add_grid(new_data)
+
+        # The level of detail shown was patched along with the data, so it is not simplified again here
+        level_no = scene['level_no']
+        old_batches = scene['level'].batches
+        new_batches = new_data.level(level_no).batches
+        style_key = lambda batch: (batch.width, batch.antialias, batch.translucent)
+        if list(map(style_key, old_batches)) != list(map(style_key, new_batches)):
+            self._set_toolpath_level(level_no)
+            return
+        for old_batch, new_batch, line_item in zip(old_batches, new_batches, scene['line_items']):
+            if new_batch.positions is not old_batch.positions:
+                line_item.setData(pos=new_batch.positions, color=new_batch.colors)
+        scene['level'] = new_data.level(level_no)
+
+    def _set_toolpath_level(self, level_no):
+        """Replaces the toolpath's line items with those of another level of detail."""
+        scene = self._scene
+        for line_item in scene['line_items']:
+            self.gl_widget.removeItem(line_item)
+        scene['line_items'] = []
+        scene['level'] = scene['data'].level(level_no) # Simplified on first use, then kept with the render data
+        scene['level_no'] = level_no
+        # Toolpath segments of the whole layer, batched by line style: one GL item per style instead of one
+        # per segment (see build_segment_batches). Scrubbing only changes how much of each batch is drawn.
+        for batch in scene['level'].batches:
+            line_item = ScrubLinePlotItem(pos=batch.positions, color=batch.colors, width=batch.width,
+                                          antialias=batch.antialias, mode='lines')
+            if batch.translucent:
+                line_item.setGLOptions('translucent')
+            self.gl_widget.addItem(line_item)
+            scene['line_items'].append(line_item)
+
+    def _show_path_up_to(self, point_count):
+        """Draws the toolpath through its first `point_count` plotted points, with the extruder head at the last."""
+        scene = self._scene
+        level = scene.get('level')
+        if level is None:
+            return
+        level_points_shown = level.points_shown(point_count)
+        for batch, line_item in zip(level.batches, scene['line_items']):
+            line_item.set_vertex_count(batch.vertex_count(max(level_points_shown - 1, 0)))
+
+        data = scene['data']
+        last_level_point = level.kept[level_points_shown - 1] if level.kept is not None and level_points_shown else None
+        show_tail = last_level_point is not None and last_level_point != point_count - 1
+        if show_tail:
+            color, width, antialias, _ = self._get_segment_style_for_type(MOVE_TYPES.name(data.type_codes[point_count - 1]))
+            scene['tail'].setData(pos=data.points[[last_level_point, point_count - 1]], color=color, width=width,
+                                  antialias=antialias)
+        scene['tail'].setVisible(show_tail)
+
+        head = scene['head']
+        head.setVisible(point_count > 0)
+        if point_count > 0:
+            self._move_extruder_head(head, data.points[point_count - 1])
+
+    def _camera_pixel_size(self):
+        """Size of a pixel, in mm, at the camera's focus point."""
+        opts = self.gl_widget.opts
+        view_height = 2 * opts['distance'] * np.tan(np.radians(opts['fov']) / 2)
+        return view_height / max(self.gl_widget.height(), 1)
+
+    def eventFilter(self, watched, event):
+        # Zooming (or resizing the view) may call for another level of detail
+        if watched is self.gl_widget and event.type() in (QEvent.Wheel, QEvent.Resize):
+            self.redraw_scheduler.request()
+        return super().eventFilter(watched, event)
+
+    def _update_session_lines(self):
+        """Draws the edit session lines (if editor active and sessions exist), when they changed."""
+        scene = self._scene
+        # Session stores `origin_coords_np` and `current_tip_coords_np`.
+        segments = []
+        if self.editor_active:
             for session in self.edit_sessions:
-                # `origin_move_idx_in_items` and `current_tip_move_idx_in_items` refer to indices in `self.items`
-                # We need to map these to `self.current_display_moves` or use stored coordinates.
-                # Session stores `origin_coords_np` and `current_tip_coords_np`.
-                if session.get('origin_coords_np') is not None and session.get('current_tip_coords_np') is not None:
-                    origin_np = session['origin_coords_np']
-                    current_tip_np = session['current_tip_coords_np']
-                    if not np.allclose(origin_np, current_tip_np):
-                        seg_np = np.array([origin_np, current_tip_np])
-                        edit_line = gl.GLLinePlotItem(pos=seg_np, color=session['color'], width=7, antialias=True, mode='lines')
-                        self.gl_widget.addItem(edit_line)
-
-        # Draw extruder head at the current position (the last point in points_to_render_np)
-        if len(points_to_render_np) > 0:
-            extruder_pos_np = points_to_render_np[-1]  # Use last valid point, not num_render_points-1
-            self._draw_extruder_head_at(extruder_pos_np)
-
-        self.status_label.setText(f"Move {len(filtered_moves)} / {len(self.current_display_moves)}")
-
-        # Setup camera based on all points in the layer for consistent framing
-        if all_points_for_grid.size > 0:
-            self._setup_camera_for_plot(all_points_for_grid)
-        self.gl_widget.setBackgroundColor('w')
-
-
-    def _get_segment_style_from_move(self, move_dict):
-        move_type = move_dict.get('type')
+                origin_np = session.get('origin_coords_np')
+                current_tip_np = session.get('current_tip_coords_np')
+                if origin_np is not None and current_tip_np is not None and not np.allclose(origin_np, current_tip_np):
+                    segments.append((np.array([origin_np, current_tip_np]), session['color']))
+        key = [(tuple(seg_np.ravel()), color) for seg_np, color in segments]
+        if key == scene['session_key']:
+            return
+        for item in scene['session_items']:
+            self.gl_widget.removeItem(item)
+        scene['session_items'] = []
+        for seg_np, color in segments:
+            edit_line = gl.GLLinePlotItem(pos=seg_np, color=color, width=7, antialias=True, mode='lines')
+            self.gl_widget.addItem(edit_line)
+            scene['session_items'].append(edit_line)
+        scene['session_key'] = key
+
+    @staticmethod
+    def _get_segment_style_for_type(move_type):
         color = (0.5, 0.5, 0.5, 1)  # Default: gray
         width = 3; antialias = True; is_dotted = False
 
@@ -561,30 +1465,35 @@ class Layer3DViewerDialog(QDialog):
             color = (0, 1, 0, 1); width = 2; antialias = False; is_dotted = True
         return color, width, antialias, is_dotted
 
-    def _draw_extruder_head_at(self, position_np):
+    def _create_extruder_head(self):
         style = self.extruder_head_style
         if style == 'sphere':
             try:
                 mesh_data = gl.MeshData.sphere(rows=10, cols=10, radius=0.625)
                 head_item = gl.GLMeshItem(meshdata=mesh_data, color=(1,0,0,1), smooth=True, shader='balloon', drawEdges=False)
-                head_item.translate(position_np[0], position_np[1], position_np[2])
                 head_item.setGLOptions('opaque')
-                self.gl_widget.addItem(head_item)
+                return head_item
             except Exception: # Fallback
                 style = 'square' # Force fallback to scatter plot
-        if style == 'square': # Fallback or chosen style
-            scatter_item = gl.GLScatterPlotItem(pos=np.array([position_np]), color=(1,0,0,1), size=15, pxMode=True)
-            scatter_item.setGLOptions('opaque')
-            self.gl_widget.addItem(scatter_item)
+        # Fallback or chosen style
+        scatter_item = gl.GLScatterPlotItem(pos=np.zeros((1, 3)), color=(1,0,0,1), size=15, pxMode=True)
+        scatter_item.setGLOptions('opaque')
+        return scatter_item
+
+    def _move_extruder_head(self, head_item, position_np):
+        if isinstance(head_item, gl.GLScatterPlotItem):
+            head_item.setData(pos=np.array([position_np]))
+        else:
+            head_item.resetTransform()
+            head_item.translate(position_np[0], position_np[1], position_np[2])
 
-    def _setup_camera_for_plot(self, points_np_array): # Was _setup_camera
-        if points_np_array.shape[0] == 0:
+    def _setup_camera_for_plot(self, bounds): # Was _setup_camera
+        if bounds is None:
             # Default camera for empty plot
             self.gl_widget.setCameraPosition(distance=100, elevation=90, azimuth=0)  # Top-down
             return
 
-        min_coords = points_np_array.min(axis=0)
-        max_coords = points_np_array.max(axis=0)
+        min_coords, max_coords = bounds
         center_coords = (min_coords + max_coords) / 2
         center_vec = pg.Vector(center_coords[0], center_coords[1], center_coords[2])
 
@@ -606,34 +1515,22 @@ class Layer3DViewerDialog(QDialog):
 
     def toggle_editor_mode(self): # Was toggle_editor
         if not self.dpad_widget.isVisible(): # To enable editor
-            if not self.current_display_moves:
+            if self.display_buffer.move_count == 0:
                 QMessageBox.warning(self, "Cannot Edit", "No moves loaded to edit.")
                 return
 
             # Determine the item index in self.items corresponding to current slider position
-            # Slider index is 1-based for current_display_moves.
-            # current_display_moves[slider_idx - 1] is the target move dict.
+            # Slider index is 1-based for display_buffer.
+            # Move number (slider_idx - 1) in display_buffer is the target move.
             # We need to find this Move object in self.items.
 
             current_move_dict_idx = self.current_slider_index -1
-            if not (0 <= current_move_dict_idx < len(self.current_display_moves)):
+            if not (0 <= current_move_dict_idx < self.display_buffer.move_count):
                 QMessageBox.warning(self, "Error", "Slider position invalid for starting edit.")
                 return
 
-            target_move_dict = self.current_display_moves[current_move_dict_idx]
-
-            # Find the corresponding Move object in self.items
-            # This is tricky if Move objects don't have unique IDs. Assume sequence for now.
-            # A more robust way: store (item_index, move_dict_index) map or search by coords.
-            # Simplified: assume current_move_dict_idx maps to the Nth Move object in self.items
-            count_moves_in_items = 0
-            origin_item_idx = -1 # Index in self.items of the Move object we are starting from
-            for i, item in enumerate(self.items):
-                if isinstance(item, Move):
-                    if count_moves_in_items == current_move_dict_idx:
-                        origin_item_idx = i
-                        break
-                    count_moves_in_items +=1
+            # Index in self.items of the Move object we are starting from
+            origin_item_idx = self.move_index.item_index_of_move(current_move_dict_idx)
 
             if origin_item_idx == -1:
                 QMessageBox.critical(self, "Error", "Could not find starting move in internal items list.")
@@ -665,20 +1562,11 @@ class Layer3DViewerDialog(QDialog):
             # Finalize path patching if any complex logic was needed (e.g., connect back to next original move)
             # For now, edits are directly inserted into self.items.
 
-        self.update_plot_and_slider_status()
+        self.redraw_scheduler.request()
 
 
     def handle_dpad_move(self, direction_key):
         # Only used for fallback/diagonals
-        if not self.editor_active or not self.edit_sessions or not self.items:
-            return
-        current_session = self.edit_sessions[-1]
-        idx_of_item_to_insert_after = current_session['current_tip_item_idx_in_items']
-        if not (0 <= idx_of_item_to_insert_after < len(self.items)): return
-        last_coords_np = current_session['current_tip_coords_np']
-        last_e_value = 0.0 # Default E
-        if isinstance(self.items[idx_of_item_to_insert_after], Move):
-            last_e_value = self.items[idx_of_item_to_insert_after].e or 0.0
         d = 2.0
         d_diag = d * (2 ** 0.5) / 2
         # Only fallback for diagonals
@@ -691,49 +1579,7 @@ class Layer3DViewerDialog(QDialog):
         delta_xy = dir_vectors_xy.get(direction_key)
         if delta_xy is None:
             return
-        # Basic undo: if move is opposite to last dpad delta in session
-        if current_session['dpad_deltas_this_session']:
-            last_delta = current_session['dpad_deltas_this_session'][-1]
-            if np.allclose(delta_xy, -last_delta):
-                if 0 <= idx_of_item_to_insert_after < len(self.items) and \
-                   isinstance(self.items[idx_of_item_to_insert_after], Move) and \
-                   self.items[idx_of_item_to_insert_after].type == 'travel_edit':
-                    self.items.pop(idx_of_item_to_insert_after)
-                    current_session['dpad_deltas_this_session'].pop()
-                    current_session['current_tip_item_idx_in_items'] = idx_of_item_to_insert_after -1
-                    if isinstance(self.items[current_session['current_tip_item_idx_in_items']], Move):
-                        prev_move_obj = self.items[current_session['current_tip_item_idx_in_items']]
-                        current_session['current_tip_coords_np'] = np.array([prev_move_obj.x, prev_move_obj.y, prev_move_obj.z])
-                    self.current_display_moves = self._get_move_dicts_from_items()
-                    self.slider.setMaximum(len(self.current_display_moves) if self.current_display_moves else 1)
-                    if self.slider.value() > 1 : self.slider.setValue(self.slider.value() -1)
-                    self.update_plot_and_slider_status()
-                    return
-        new_x = last_coords_np[0] + delta_xy[0]
-        new_y = last_coords_np[1] + delta_xy[1]
-        lift_height = 1.0
-        new_z = last_coords_np[2] + lift_height
-        new_move_obj = Move(x=new_x, y=new_y, z=new_z, e=last_e_value, move_type='travel_edit', original_line_index=None)
-        insert_at_item_idx = idx_of_item_to_insert_after + 1
-        self.items.insert(insert_at_item_idx, new_move_obj)
-        current_session['dpad_deltas_this_session'].append(delta_xy)
-        current_session['current_tip_item_idx_in_items'] = insert_at_item_idx
-        current_session['current_tip_coords_np'] = np.array([new_x, new_y, new_z])
-        self.current_display_moves = self._get_move_dicts_from_items()
-        self.slider.setMaximum(len(self.current_display_moves) if self.current_display_moves else 1)
-        newly_inserted_move_display_idx = -1
-        move_count = 0
-        for item_idx, item_val in enumerate(self.items):
-            if item_val is new_move_obj:
-                newly_inserted_move_display_idx = move_count
-                break
-            if isinstance(item_val, Move):
-                move_count += 1
-        if newly_inserted_move_display_idx != -1:
-            self.slider.setValue(newly_inserted_move_display_idx + 1)
-        else:
-            if self.slider.value() < self.slider.maximum(): self.slider.setValue(self.slider.value()+1)
-        self.update_plot_and_slider_status()
+        self._apply_dpad_delta(delta_xy)
 
     def handle_dpad_move_grid(self, grid_pos):
         # Map grid_pos to movement vector
@@ -749,13 +1595,19 @@ class Layer3DViewerDialog(QDialog):
             (2,0): np.array([-d_diag, d_diag]),     # down_left
             (2,2): np.array([-d_diag, -d_diag]),    # down_right
         }
-        direction_key = None # Not used in this handler
         delta_xy = grid_to_delta.get(grid_pos)
         if delta_xy is None:
             return
-        # The rest of this function is the same as handle_dpad_move, but uses delta_xy
+        self._apply_dpad_delta(delta_xy)
+
+    def _apply_dpad_delta(self, delta_xy):
+        """Inserts a lifted travel_edit move at the session tip, offset by delta_xy (undoable)."""
         if not self.editor_active or not self.edit_sessions or not self.items:
             return
+        mode = self.dpad_mode_combo.currentData()
+        if mode != 'insert':
+            self._translate_moves_at_slider(delta_xy, whole_run=mode == 'run')
+            return
         current_session = self.edit_sessions[-1]
         idx_of_item_to_insert_after = current_session['current_tip_item_idx_in_items']
         if not (0 <= idx_of_item_to_insert_after < len(self.items)): return
@@ -763,58 +1615,165 @@ class Layer3DViewerDialog(QDialog):
         last_e_value = 0.0 # Default E
         if isinstance(self.items[idx_of_item_to_insert_after], Move):
             last_e_value = self.items[idx_of_item_to_insert_after].e or 0.0
-        # Basic undo: if move is opposite to last dpad delta in session
-        if current_session['dpad_deltas_this_session']:
-            last_delta = current_session['dpad_deltas_this_session'][-1]
-            if np.allclose(delta_xy, -last_delta):
-                if 0 <= idx_of_item_to_insert_after < len(self.items) and \
-                   isinstance(self.items[idx_of_item_to_insert_after], Move) and \
-                   self.items[idx_of_item_to_insert_after].type == 'travel_edit':
-                    self.items.pop(idx_of_item_to_insert_after)
-                    current_session['dpad_deltas_this_session'].pop()
-                    current_session['current_tip_item_idx_in_items'] = idx_of_item_to_insert_after -1
-                    if isinstance(self.items[current_session['current_tip_item_idx_in_items']], Move):
-                        prev_move_obj = self.items[current_session['current_tip_item_idx_in_items']]
-                        current_session['current_tip_coords_np'] = np.array([prev_move_obj.x, prev_move_obj.y, prev_move_obj.z])
-                    self.current_display_moves = self._get_move_dicts_from_items()
-                    self.slider.setMaximum(len(self.current_display_moves) if self.current_display_moves else 1)
-                    if self.slider.value() > 1 : self.slider.setValue(self.slider.value() -1)
-                    self.update_plot_and_slider_status()
-                    return
+        # Moving back the way the last D-pad step of this session came undoes that step
+        last_command = self.undo_stack.last_command
+        if last_command is not None and last_command.context is not None and \
+                last_command.context['session'] is current_session and \
+                np.allclose(delta_xy, -last_command.context['delta']):
+            self.undo_edit_action()
+            return
         new_x = last_coords_np[0] + delta_xy[0]
         new_y = last_coords_np[1] + delta_xy[1]
         lift_height = 1.0
         new_z = last_coords_np[2] + lift_height
         new_move_obj = Move(x=new_x, y=new_y, z=new_z, e=last_e_value, move_type='travel_edit', original_line_index=None)
         insert_at_item_idx = idx_of_item_to_insert_after + 1
-        self.items.insert(insert_at_item_idx, new_move_obj)
-        current_session['dpad_deltas_this_session'].append(delta_xy)
-        current_session['current_tip_item_idx_in_items'] = insert_at_item_idx
-        current_session['current_tip_coords_np'] = np.array([new_x, new_y, new_z])
-        self.current_display_moves = self._get_move_dicts_from_items()
-        self.slider.setMaximum(len(self.current_display_moves) if self.current_display_moves else 1)
-        newly_inserted_move_display_idx = -1
-        move_count = 0
-        for item_idx, item_val in enumerate(self.items):
-            if item_val is new_move_obj:
-                newly_inserted_move_display_idx = move_count
-                break
-            if isinstance(item_val, Move):
-                move_count += 1
-        if newly_inserted_move_display_idx != -1:
-            self.slider.setValue(newly_inserted_move_display_idx + 1)
-        else:
-            if self.slider.value() < self.slider.maximum(): self.slider.setValue(self.slider.value()+1)
-        self.update_plot_and_slider_status()
+        command = InsertItemsCommand(insert_at_item_idx, [new_move_obj])
+        command.context = {
+            'session': current_session,
+            'delta': delta_xy,
+            'tip_before': (idx_of_item_to_insert_after, np.copy(last_coords_np)),
+            'tip_after': (insert_at_item_idx, np.array([new_x, new_y, new_z])),
+        }
+        self.run_edit_command(command)
+
+    def _slider_item_index(self):
+        """Item index in self.items of the move at the slider, or -1."""
+        return self.move_index.item_index_of_move(self.current_slider_index - 1)
+
+    def _translate_moves_at_slider(self, delta_xy, whole_run=False):
+        """Shifts the move at the slider (or the run of same-type moves around it) by delta_xy (undoable)."""
+        move_number = self.current_slider_index - 1
+        if not 0 <= move_number < self.display_buffer.move_count:
+            return
+        move_numbers = [move_number]
+        if whole_run:
+            type_codes = self.display_buffer.type_code
+            other_before = np.flatnonzero(type_codes[:move_number] != type_codes[move_number])
+            other_after = np.flatnonzero(type_codes[move_number:] != type_codes[move_number])
+            first = other_before[-1] + 1 if len(other_before) else 0
+            end = move_number + other_after[0] if len(other_after) else len(type_codes)
+            move_numbers = range(first, end)
+        item_indices = [self.move_index.item_index_of_move(n) for n in move_numbers]
+        command = ReplaceItemsCommand.translate_moves(self.items, item_indices, dx=delta_xy[0], dy=delta_xy[1])
+        if command.replacements:
+            self.run_edit_command(command)
+
+    def delete_move_action(self):
+        """Deletes the move at the slider (undoable)."""
+        if not self.editor_active:
+            return
+        item_idx = self._slider_item_index()
+        if item_idx != -1:
+            self.run_edit_command(DeleteItemsCommand(item_idx, 1))
+
+    def run_edit_command(self, command):
+        """Applies an EditCommand to self.items through the undo stack (insert, delete, move, transform...)."""
+        changes = self.undo_stack.push(command, self.items)
+        self._after_edit(command, changes, redo=True)
+
+    def undo_edit_action(self):
+        command, changes = self.undo_stack.undo(self.items)
+        if command is not None:
+            self._after_edit(command, changes, redo=False)
+
+    def redo_edit_action(self):
+        command, changes = self.undo_stack.redo(self.items)
+        if command is not None:
+            self._after_edit(command, changes, redo=True)
+
+    def _after_edit(self, command, changes, redo):
+        """Journals the changes, restores the D-pad session tip for D-pad steps and redraws."""
+        self.display_buffer.apply_item_changes(changes, self.move_index)
+        for op, index, item in changes:
+            if op == 'insert':
+                self._journal_edit('record_insert', index, item)
+            else:
+                self._journal_edit('record_delete', index)
+
+        focus_item_idx = changes[-1][1] if changes else None
+        context = command.context
+        if context is None and not isinstance(command, ReplaceItemsCommand):
+            # Items were inserted or deleted elsewhere: keep the D-pad sessions on the items they refer to
+            for session in self.edit_sessions:
+                for key in ('origin_item_idx_in_items', 'current_tip_item_idx_in_items'):
+                    session[key] = self._shifted_item_index(session[key], changes)
+        if context is not None:
+            session = context['session']
+            if redo:
+                session['dpad_deltas_this_session'].append(context['delta'])
+                tip_item_idx, tip_coords = context['tip_after']
+            else:
+                if session['dpad_deltas_this_session']:
+                    session['dpad_deltas_this_session'].pop()
+                tip_item_idx, tip_coords = context['tip_before']
+            session['current_tip_item_idx_in_items'] = tip_item_idx
+            session['current_tip_coords_np'] = np.copy(tip_coords)
+            focus_item_idx = tip_item_idx
+
+        self.slider.setMaximum(self.display_buffer.move_count or 1)
+        if focus_item_idx is not None:
+            # Show the path up to the edited spot: the moves among items[:focus_item_idx + 1]
+            moves_up_to_focus = self.move_index.moves_before(focus_item_idx + 1)
+            self.slider.setValue(max(moves_up_to_focus, 1))
+        self._update_undo_buttons()
+        self.redraw_scheduler.request()
+
+    @staticmethod
+    def _shifted_item_index(item_idx, changes):
+        """Where the item at `item_idx` is after the changes (the item before it, if it was deleted)."""
+        for op, index, _ in changes:
+            if op == 'insert' and index <= item_idx:
+                item_idx += 1
+            elif op == 'delete' and index <= item_idx:
+                item_idx = max(item_idx - 1, 0)
+        return item_idx
+
+    def _update_undo_buttons(self):
+        self.undo_button.setEnabled(self.undo_stack.can_undo)
+        self.redo_button.setEnabled(self.undo_stack.can_redo)
+
+    def _journal_edit(self, method_name, *args):
+        """Mirrors an edit of self.items into the main window's edit journal."""
+        journal = getattr(self.mainwin, 'edit_journal', None)
+        if journal is not None:
+            getattr(journal, method_name)(*args)
+
+    def apply_edits_to_mainwin(self):
+        """Sends the current items to the main window as the layer's edits. Returns False if there is no main window."""
+        if not (self.mainwin and hasattr(self.mainwin, 'record_layer_edits')):
+            return False
+        # Pass the current state of self.items (which includes Move objects and strings)
+        self.mainwin.record_layer_edits(self.layer_idx_in_doc, self.items.copy()) # Pass a copy (shares unchanged pieces)
+        self.applied_items = self.items.copy()
+        return True
 
     def trigger_apply_edits_to_mainwin(self): # Was save_edits
-        if self.mainwin and hasattr(self.mainwin, 'record_layer_edits'):
-            # Pass the current state of self.items (which includes Move objects and strings)
-            self.mainwin.record_layer_edits(self.layer_idx_in_doc, list(self.items)) # Pass a copy
+        if self.apply_edits_to_mainwin():
             QMessageBox.information(self, "Edits Applied", f"Edits for layer {self.actual_layer_display_number} sent to main window. Save the document to make them permanent.")
         else:
             QMessageBox.warning(self, "Error", "Cannot apply edits: Main window link is broken.")
 
+    def has_unapplied_edits(self):
+        """True if the items differ from the ones last received from or applied to the main window."""
+        return self.items != self.applied_items
+
+    def confirm_leave_layer(self):
+        """
+        Called before the viewer is given another layer. If the current layer has unapplied edits, asks whether
+        to apply them to the main window first, discard them, or stay. Returns False to stay on this layer.
+        """
+        if not self.has_unapplied_edits():
+            return True
+        answer = QMessageBox.question(
+            self, "Unapplied Edits",
+            f"Layer {self.actual_layer_display_number} has edits that were not applied to the main window. "
+            "Apply them before switching layers?",
+            QMessageBox.Apply | QMessageBox.Discard | QMessageBox.Cancel, QMessageBox.Apply)
+        if answer == QMessageBox.Apply:
+            return self.apply_edits_to_mainwin()
+        return answer == QMessageBox.Discard
+
 
     def showEvent(self, event):
         if not self._has_been_shown:
@@ -844,7 +1803,7 @@ class Layer3DViewerDialog(QDialog):
         self.hide()
         event.ignore()
 
-    # move_index_to_gcode_line - Removed. Mapping is now based on self.items and its relation to self.current_display_moves.
+    # move_index_to_gcode_line - Removed. Mapping is now based on self.items and its relation to self.display_buffer.
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = GCodeEditor()
@@ -0,0 +1,73 @@
+"""
+Benchmark for GCodeParser's layer tokenizers: the line-by-line loop vs. the vectorized batch tokenizer.
+
+Usage:
+    python benchmarks/bench_layer_parse.py                 # synthetic layers
+    python benchmarks/bench_layer_parse.py path/to/file.gcode
+
+Prints lines/second for both tokenizers over every layer of the input and the speedup of the batch path.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcode_file_handler import GCodeFileHandler
+from gcode_parser import GCodeParser
+
+
+def synthetic_layers(layer_count=20, moves_per_layer=20000, seed=0):
+    """Builds PrusaSlicer-like layers: type comments, extrusion moves, travels and retractions."""
+    rng = random.Random(seed)
+    e = 0.0
+    layers = []
+    for layer_idx in range(layer_count):
+        z = 0.2 * (layer_idx + 1)
+        lines = [';LAYER_CHANGE\n', f';Z:{z:.2f}\n', ';HEIGHT:0.2\n', f'G1 Z{z:.3f} F720\n']
+        for move_idx in range(moves_per_layer):
+            if move_idx % 500 == 0:
+                lines.append(';TYPE:Solid infill\n')
+                lines.append('G1 F1800\n')
+            if rng.random() < 0.1:
+                lines.append(f'G1 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} F9000\n')
+            else:
+                e += rng.uniform(0.01, 0.2)
+                lines.append(f'G1 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} E{e:.5f}\n')
+        lines.append('G1 E-0.8 F2100\n')
+        layers.append(lines)
+    return layers
+
+
+def file_layers(file_path):
+    document = GCodeFileHandler(GCodeParser()).load_gcode_file(file_path)
+    return [layer.original_lines for layer in document.layers]
+
+
+def time_tokenizer(parse, layers, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for lines in layers:
+            parse(lines)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    layers = file_layers(sys.argv[1]) if len(sys.argv) > 1 else synthetic_layers()
+    line_count = sum(len(lines) for lines in layers)
+    parser = GCodeParser()
+
+    loop_time = time_tokenizer(parser._parse_lines_to_columns_loop, layers)
+    batch_time = time_tokenizer(parser._parse_lines_to_columns_batch, layers)
+
+    print(f"{len(layers)} layers, {line_count} lines")
+    print(f"loop tokenizer:  {line_count / loop_time:12,.0f} lines/s ({loop_time:.3f} s)")
+    print(f"batch tokenizer: {line_count / batch_time:12,.0f} lines/s ({batch_time:.3f} s)")
+    print(f"speedup: {loop_time / batch_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Benchmark for GCodeParser.gcode_layer_to_lines: the move-by-move loop vs. the vectorized batch serializer.
+
+Usage:
+    python benchmarks/bench_layer_serialize.py                 # synthetic layers
+    python benchmarks/bench_layer_serialize.py path/to/file.gcode
+
+Prints lines/second for both serializers over every layer of the input, once for layers whose items
+have been built (e.g. edited layers) and once for layers that were only parsed into move columns.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_layer_parse import file_layers, synthetic_layers
+from gcode_models import GCodeLayer
+from gcode_parser import GCodeParser
+
+
+def time_serializer(serialize, layers, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for layer in layers:
+            serialize(layer)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    layer_lines = file_layers(sys.argv[1]) if len(sys.argv) > 1 else synthetic_layers()
+    parser = GCodeParser()
+    column_layers = []
+    item_layers = []
+    for lines in layer_lines:
+        layer = GCodeLayer(len(column_layers), original_lines=lines)
+        layer.columns = parser.parse_lines_to_columns(lines)
+        column_layers.append(layer)
+        layer = GCodeLayer(len(item_layers), original_lines=lines)
+        layer.columns = parser.parse_lines_to_columns(lines)
+        layer.items # Build the items, as for an edited layer
+        item_layers.append(layer)
+    line_count = sum(len(lines) for lines in layer_lines)
+
+    print(f"{len(layer_lines)} layers, {line_count} lines")
+    # The loop always works on items, so it is timed on the layers that already have them
+    loop_time = time_serializer(parser._gcode_layer_to_lines_loop, item_layers)
+    print(f"loop serializer:           {line_count / loop_time:12,.0f} lines/s ({loop_time:.3f} s)")
+    for label, layers in (("items", item_layers), ("columns", column_layers)):
+        batch_time = time_serializer(parser._gcode_layer_to_lines_batch, layers)
+        print(f"batch serializer ({label + '):':9}{line_count / batch_time:12,.0f} lines/s ({batch_time:.3f} s), "
+              f"speedup {loop_time / batch_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmark for gcode_render.LayerRenderData levels of detail: the simplified toolpaths the 3D viewer
+switches to when zoomed out (see LEVEL_TOLERANCES).
+
+Usage:
+    python benchmarks/bench_levels_of_detail.py              # 200,000 synthetic points
+    python benchmarks/bench_levels_of_detail.py 1000000
+
+Prints the time to build every level of a dense layer, and the points and GL vertices each level keeps.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcode_models import MOVE_TYPES
+from gcode_render import LEVEL_TOLERANCES, prepare_layer_render
+
+from bench_render_batches import segment_style
+
+
+def infill_like_path(point_count, seed=0):
+    """Densely sampled arcs and zigzags, like the arc-fitted perimeters and gyroid infill of a sliced part."""
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0.0, 400.0 * np.pi, point_count)
+    radius = 40.0 + 5.0 * np.sin(t / 7.0)
+    positions = np.column_stack((100.0 + radius * np.cos(t), 100.0 + radius * np.sin(t), np.full(point_count, 0.2)))
+    positions[:, :2] += rng.normal(0.0, 0.005, (point_count, 2)) # Slicer rounding noise
+    type_codes = np.full(point_count, MOVE_TYPES.code('perimeter'), dtype=np.int16)
+    type_codes[(np.arange(point_count) // 5000) % 4 == 3] = MOVE_TYPES.code('external_perimeter')
+    return positions, type_codes
+
+
+def main():
+    point_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    positions, type_codes = infill_like_path(point_count)
+    best = float('inf')
+    for _ in range(3):
+        data = prepare_layer_render(positions, type_codes, segment_style)
+        start = time.perf_counter()
+        data.build_levels()
+        best = min(best, time.perf_counter() - start)
+
+    print(f"{point_count:,} points: levels built in {best * 1000:.1f} ms")
+    for level_no, tolerance in enumerate(LEVEL_TOLERANCES):
+        level = data.level(level_no)
+        kept = point_count if level.kept is None else len(level.kept)
+        vertices = sum(len(batch.positions) for batch in level.batches)
+        print(f"  level {level_no} (tolerance {tolerance} mm): {kept:,} points, {vertices:,} vertices")
+
+
+if __name__ == '__main__':
+    main()
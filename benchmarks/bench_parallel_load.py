@@ -0,0 +1,44 @@
+"""
+Benchmark for loading a G-code file with every layer parsed up front, in this process vs. a process pool.
+
+Usage:
+    python benchmarks/bench_parallel_load.py path/to/file.gcode [workers]
+
+Workers default to one per CPU. The file must be at least GCodeFileHandler.PARALLEL_MIN_BYTES for the pool to be used.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcode_file_handler import GCodeFileHandler
+from gcode_parser import GCodeParser
+
+
+def time_load(file_path, parallel_workers):
+    handler = GCodeFileHandler(GCodeParser(), lazy_layers=False, parallel_workers=parallel_workers)
+    start = time.perf_counter()
+    document = handler.load_gcode_file(file_path)
+    elapsed = time.perf_counter() - start
+    document.close()
+    return elapsed
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    file_path = sys.argv[1]
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    serial_time = time_load(file_path, 0)
+    parallel_time = time_load(file_path, workers)
+
+    print(f"{os.path.getsize(file_path) / 1e6:.1f} MB")
+    print(f"serial:              {serial_time:.2f} s")
+    print(f"parallel ({workers} workers): {parallel_time:.2f} s")
+    print(f"speedup: {serial_time / parallel_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
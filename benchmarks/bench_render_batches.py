@@ -0,0 +1,64 @@
+"""
+Benchmark for gcode_render.build_segment_batches: the vertex and color buffers the 3D viewer draws a layer from.
+
+Usage:
+    python benchmarks/bench_render_batches.py              # 1,000,000 synthetic segments
+    python benchmarks/bench_render_batches.py 200000
+
+Prints the time to build the style batches, next to the number of GL items the viewer used to create
+(one per solid segment, five per dotted travel segment).
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcode_models import MOVE_TYPES
+from gcode_render import DASH_STARTS, build_segment_batches
+
+
+def segment_style(move_type):
+    """Same styles as Layer3DViewerDialog._get_segment_style_for_type (without importing the Qt app)."""
+    if move_type == 'external_perimeter':
+        return (0.5, 0.0, 0.5, 1.0), 3, True, False
+    if move_type == 'perimeter':
+        return (0.0, 0.0, 1.0, 1.0), 3, True, False
+    if move_type == 'travel':
+        return (0.0, 1.0, 0.0, 1.0), 2, False, True
+    return (0.5, 0.5, 0.5, 1.0), 3, True, False
+
+
+def synthetic_path(segment_count, seed=0):
+    rng = np.random.default_rng(seed)
+    type_codes = np.array([MOVE_TYPES.code(name) for name in ('external_perimeter', 'perimeter', 'travel')] + [-1],
+                          dtype=np.int16)
+    points = np.cumsum(rng.normal(0.0, 1.0, (segment_count + 1, 3)), axis=0)
+    points[:, 2] = 0.2
+    # Mostly extrusion, with a travel every few moves
+    codes = type_codes[rng.choice(len(type_codes), segment_count + 1, p=[0.3, 0.5, 0.15, 0.05])]
+    return points, codes
+
+
+def main():
+    segment_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    points, codes = synthetic_path(segment_count)
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        batches = build_segment_batches(points, codes, segment_style)
+        best = min(best, time.perf_counter() - start)
+
+    travel_segments = int(np.count_nonzero(codes[1:] == MOVE_TYPES.code('travel')))
+    old_items = segment_count - travel_segments + travel_segments * len(DASH_STARTS)
+    print(f"{segment_count:,} segments ({travel_segments:,} travel)")
+    print(f"batches built in {best * 1000:.1f} ms: {len(batches)} GL items instead of {old_items:,}")
+    for batch in batches:
+        print(f"  width {batch.width}, antialias {batch.antialias}, translucent {batch.translucent}: "
+              f"{batch.segment_count:,} lines, {(batch.positions.nbytes + batch.colors.nbytes) / 2**20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from gcode_models import LayerMoveColumns, MOVE_TYPES
+
+
+def default_cache_dir():
+    """Per-user cache directory for the editor (XDG_CACHE_HOME / LOCALAPPDATA, falling back to ~/.cache)."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') or \
+           os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'gcode-editor')
+
+
+def sampled_file_key(file_path, sample_count=16, sample_bytes=64 * 1024):
+    """
+    Returns (size, mtime_ns, content digest) identifying a file's contents. The digest hashes `sample_count`
+    blocks at evenly spaced offsets (the whole file if it is smaller than that), so it is cheap for big files.
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        if stat.st_size <= sample_count * sample_bytes:
+            digest.update(file.read())
+        else:
+            step = (stat.st_size - sample_bytes) // (sample_count - 1)
+            for i in range(sample_count):
+                file.seek(i * step)
+                digest.update(file.read(sample_bytes))
+    return (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+
+
+class CachedParse:
+    """What a ParseCache entry restores: the byte-offset index and the columns of the layers that had been parsed."""
+    def __init__(self, layer_byte_ranges, thumbnail_byte_ranges, layer_columns):
+        self.layer_byte_ranges = layer_byte_ranges
+        self.thumbnail_byte_ranges = thumbnail_byte_ranges
+        self.layer_columns = layer_columns # One LayerMoveColumns per layer, None for layers that were never parsed
+
+
+class CacheSnapshot:
+    """A memory-mapped document's parse results as ParseCache.snapshot took them, ready to be written out."""
+    def __init__(self, file_path, cache_key, layer_byte_ranges, thumbnail_byte_ranges, layer_columns,
+                 type_names):
+        self.file_path = file_path
+        self.cache_key = cache_key
+        self.layer_byte_ranges = layer_byte_ranges
+        self.thumbnail_byte_ranges = thumbnail_byte_ranges
+        self.layer_columns = layer_columns # One LayerMoveColumns per layer, None for layers not to store
+        self.type_names = type_names
+
+
+class ParseCache:
+    """
+    On-disk cache of memory-mapped documents' parse results (layer/thumbnail byte offsets and per-layer move columns).
+    There is one .npz entry per file path, which is only used while the file's size, mtime and a sampled content
+    hash still match. Entries are evicted once they are older than `max_age_days` or, oldest first, when the
+    cache grows beyond `max_total_bytes`.
+    """
+    FORMAT_VERSION = 2 # 2: int16 type codes, no type comment lines
+    HASH_SAMPLE_COUNT = 16 # Blocks hashed at evenly spaced offsets (the whole file if it is smaller than that)
+    HASH_SAMPLE_BYTES = 64 * 1024
+
+    _COLUMN_FIELDS = ('x', 'y', 'z', 'e', 'type_code', 'line_index')
+    _TEXT_FIELDS = ('text_positions', 'text_line_indices')
+
+    def __init__(self, cache_dir=None, max_total_bytes=1024 * 1024 * 1024, max_age_days=30):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_total_bytes = max_total_bytes
+        self.max_age_days = max_age_days
+
+    def file_key(self, file_path):
+        """Returns (size, mtime_ns, content digest) for a file. The digest covers sampled blocks, not every byte."""
+        return sampled_file_key(file_path, self.HASH_SAMPLE_COUNT, self.HASH_SAMPLE_BYTES)
+
+    def _entry_path(self, file_path):
+        name = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name + '.npz')
+
+    def load(self, file_path, file_key):
+        """Returns the CachedParse stored for `file_path` if it was made from the same file contents, else None."""
+        entry_path = self._entry_path(file_path)
+        if not os.path.exists(entry_path):
+            return None
+        try:
+            with np.load(entry_path) as entry:
+                if int(entry['version']) != self.FORMAT_VERSION or \
+                        (int(entry['size']), int(entry['mtime_ns']), str(entry['digest'])) != tuple(file_key):
+                    return None
+                arrays = {name: entry[name] for name in entry.files}
+        except Exception: # Unreadable or truncated entry: drop it and parse again
+            self._remove(entry_path)
+            return None
+
+        code_map = MOVE_TYPES.merge(json.loads(str(arrays['type_names'])))
+        type_code = code_map[arrays['type_code']]
+        move_offsets, text_offsets = arrays['move_offsets'], arrays['text_offsets']
+        layer_columns = []
+        for i, parsed in enumerate(arrays['layer_parsed']):
+            if not parsed:
+                layer_columns.append(None)
+                continue
+            moves = slice(move_offsets[i], move_offsets[i + 1])
+            texts = slice(text_offsets[i], text_offsets[i + 1])
+            layer_columns.append(LayerMoveColumns(
+                arrays['x'][moves], arrays['y'][moves], arrays['z'][moves], arrays['e'][moves],
+                type_code[moves], arrays['line_index'][moves],
+                arrays['text_positions'][texts], arrays['text_line_indices'][texts]))
+
+        try:
+            os.utime(entry_path) # Recently used entries are evicted last
+        except OSError: # E.g. a read-only cache; the entry is still usable
+            pass
+        return CachedParse([tuple(r) for r in arrays['layer_byte_ranges'].tolist()],
+                           [tuple(r) for r in arrays['thumbnail_byte_ranges'].tolist()],
+                           layer_columns)
+
+    def store(self, document):
+        """
+        Writes the byte offsets and the parsed layers of a memory-mapped document to the cache.
+        Layers whose items were built (and so may have been edited) are stored as unparsed.
+        Returns False if nothing was stored, e.g. because the file has changed since it was indexed.
+        """
+        return self.store_snapshot(self.snapshot(document))
+
+    def snapshot(self, document):
+        """
+        Takes what store() writes from a document (None if it is not memory-mapped), without copying any arrays.
+        It is taken on the thread that owns the document; store_snapshot can then run on another thread.
+        """
+        if document.source is None or document.cache_key is None:
+            return None
+        layer_columns = [layer.columns if layer.is_parsed and not layer.has_items else None
+                         for layer in document.layers]
+        return CacheSnapshot(document.file_path, tuple(document.cache_key), list(document.layer_byte_ranges),
+                             list(document.thumbnail_byte_ranges), layer_columns,
+                             MOVE_TYPES.names)
+
+    def store_snapshot(self, snapshot):
+        """Writes a snapshot taken by snapshot() to the cache. Returns True if stored (see store())."""
+        if snapshot is None:
+            return False
+        try:
+            if tuple(self.file_key(snapshot.file_path)) != snapshot.cache_key:
+                return False
+        except OSError:
+            return False
+
+        layer_columns = snapshot.layer_columns
+        parsed = [columns for columns in layer_columns if columns is not None]
+        arrays = {
+            'version': np.array(self.FORMAT_VERSION),
+            'size': np.array(snapshot.cache_key[0], dtype=np.int64),
+            'mtime_ns': np.array(snapshot.cache_key[1], dtype=np.int64),
+            'digest': np.array(snapshot.cache_key[2]),
+            'layer_byte_ranges': np.array(snapshot.layer_byte_ranges, dtype=np.int64).reshape(-1, 2),
+            'thumbnail_byte_ranges': np.array(snapshot.thumbnail_byte_ranges, dtype=np.int64).reshape(-1, 2),
+            'layer_parsed': np.array([columns is not None for columns in layer_columns], dtype=bool),
+            'move_offsets': np.cumsum([0] + [columns.move_count if columns is not None else 0
+                                             for columns in layer_columns]).astype(np.int64),
+            'text_offsets': np.cumsum([0] + [len(columns.text_positions) if columns is not None else 0
+                                             for columns in layer_columns]).astype(np.int64),
+            'type_names': np.array(json.dumps(snapshot.type_names)),
+        }
+        empty = LayerMoveColumns([], [], [], [], [], [], [], []) # Gives the field dtypes when no layer is parsed
+        for field in self._COLUMN_FIELDS + self._TEXT_FIELDS:
+            arrays[field] = np.concatenate([getattr(columns, field) for columns in parsed + [empty]])
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.', suffix='.tmp')
+            try:
+                with open(fd, 'wb') as file:
+                    np.savez(file, **arrays)
+                os.replace(temp_path, self._entry_path(snapshot.file_path))
+            except BaseException:
+                self._remove(temp_path)
+                raise
+        except OSError:
+            return False # The cache is an optimization only; a read-only or full disk must not break saving work
+        self.evict()
+        return True
+
+    def evict(self):
+        """Removes entries older than max_age_days, then the least recently used ones until under max_total_bytes."""
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.npz'):
+                    path = os.path.join(self.cache_dir, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            return
+
+        oldest_allowed = time.time() - self.max_age_days * 24 * 3600
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if mtime >= oldest_allowed and total_bytes <= self.max_total_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+
+    def clear(self):
+        """Removes every cache entry."""
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith('.npz'):
+                self._remove(os.path.join(self.cache_dir, name))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
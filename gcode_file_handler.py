@@ -1,92 +1,504 @@
-from gcode_models import GCodeDocument
+import bisect
+import gzip
+import io
+import lzma
+import mmap
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+from gcode_models import GCodeDocument, MOVE_TYPES
 # GCodeParser will be imported by the main application and passed to the handler.
 
+# Compressed formats, chosen by file extension (e.g. 'part.gcode.gz'), for both loading and saving
+COMPRESSED_FILE_OPENERS = {
+    '.gz': gzip.open,
+    '.xz': lzma.open,
+}
+
+
+def compressed_file_opener(file_path):
+    """Returns the open function for a compressed file path (gzip.open, lzma.open), or None if it is not compressed."""
+    return COMPRESSED_FILE_OPENERS.get(os.path.splitext(file_path)[1].lower())
+
+
+class SaveCancelled(Exception):
+    """Raised by save_gcode_document when its is_canceled callback asks it to stop; the target file is left untouched."""
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class MappedGCodeSource:
+    """
+    Read-only, memory-mapped view of a G-code file.
+    Only the byte ranges that are actually requested get decoded, with `excluded_byte_ranges`
+    (the thumbnail blocks) cut out, so the file itself never has to be held in memory as text.
+
+    Compressed files (see COMPRESSED_FILE_OPENERS) are decompressed once, streaming, into a local temporary file
+    that is mapped instead (`mapped_path`), so byte offsets always refer to the decompressed G-code.
+    """
+    SCAN_BLOCK_BYTES = 16 * 1024 * 1024 # Block size when counting line endings
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.mapped_path = file_path
+        opener = compressed_file_opener(file_path)
+        if opener is not None:
+            self.mapped_path = self._decompress_to_temp_file(file_path, opener)
+            # Removed on close(), or when the source is garbage collected without being closed
+            self._remove_temp_file = weakref.finalize(self, _remove_file, self.mapped_path)
+        self._file = open(self.mapped_path, 'rb')
+        try:
+            if os.fstat(self._file.fileno()).st_size > 0:
+                self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            else: # Only compressed files get here (empty files are not mapped); they cannot be mapped either
+                self.buffer = b''
+        except Exception:
+            self._file.close()
+            raise
+        self.size = len(self.buffer)
+        self.excluded_byte_ranges = [] # Sorted, non-overlapping (start, end) ranges skipped when reading
+        self._has_carriage_returns = None
+        self._newline = None
+
+    @staticmethod
+    def _decompress_to_temp_file(file_path, opener):
+        fd, temp_path = tempfile.mkstemp(prefix='gcode-', suffix='.gcode')
+        try:
+            with open(fd, 'wb') as temp_file, opener(file_path, 'rb') as compressed_file:
+                shutil.copyfileobj(compressed_file, temp_file, 1024 * 1024)
+        except BaseException:
+            _remove_file(temp_path)
+            raise
+        return temp_path
+
+    def iter_byte_ranges(self, start, end):
+        """Yields the (start, end) sub-ranges between `start` and `end` that are not excluded."""
+        idx = bisect.bisect_right(self.excluded_byte_ranges, (start, float('inf'))) - 1
+        idx = max(idx, 0)
+        pos = start
+        while pos < end:
+            while idx < len(self.excluded_byte_ranges) and self.excluded_byte_ranges[idx][1] <= pos:
+                idx += 1
+            if idx < len(self.excluded_byte_ranges) and self.excluded_byte_ranges[idx][0] < end:
+                excl_start, excl_end = self.excluded_byte_ranges[idx]
+                if excl_start > pos:
+                    yield pos, excl_start
+                pos = max(pos, excl_end)
+            else:
+                yield pos, end
+                pos = end
+
+    def iter_byte_chunks(self, start, end):
+        """Yields the bytes between `start` and `end`, minus any excluded ranges, as contiguous chunks."""
+        for chunk_start, chunk_end in self.iter_byte_ranges(start, end):
+            yield self.buffer[chunk_start:chunk_end]
+
+    def read_lines(self, start, end):
+        """
+        Decodes the given byte range into a list of lines, matching what text-mode readlines() returns.
+        Layers are decoded long after the file was loaded, so invalid UTF-8 does not raise here: those bytes
+        decode as lone surrogates ('surrogateescape'), which saving encodes back to the same bytes.
+        """
+        text = b''.join(self.iter_byte_chunks(start, end)).decode('utf-8', 'surrogateescape')
+        if '\r' in text: # Universal newlines, as when reading the file in text mode
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return io.StringIO(text).readlines()
+
+    @property
+    def has_carriage_returns(self):
+        """True if the file contains carriage returns, i.e. decoding it changes line endings (checked once, on first use)."""
+        if self._has_carriage_returns is None:
+            self._has_carriage_returns = self.buffer.find(b'\r') != -1
+        return self._has_carriage_returns
+
+    @property
+    def newline(self):
+        """'\\r\\n' if every line of the file ends with CRLF, else '\\n' (the line ending of the decoded lines)."""
+        if self._newline is None:
+            self._newline = '\n'
+            if self.has_carriage_returns:
+                lf_count = cr_count = crlf_count = 0
+                for start in range(0, self.size, self.SCAN_BLOCK_BYTES):
+                    block = self.buffer[start:start + self.SCAN_BLOCK_BYTES + 1] # Also counts a CRLF across blocks
+                    lf_count += block.count(b'\n', 0, self.SCAN_BLOCK_BYTES)
+                    cr_count += block.count(b'\r', 0, self.SCAN_BLOCK_BYTES)
+                    crlf_count += block.count(b'\r\n')
+                if crlf_count == lf_count == cr_count:
+                    self._newline = '\r\n'
+        return self._newline
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def is_same_file(self, file_path):
+        try:
+            return os.path.samefile(self.file_path, file_path)
+        except OSError:
+            return False
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap) and not self.buffer.closed:
+            self.buffer.close()
+        self._file.close()
+        if self.mapped_path != self.file_path:
+            self._remove_temp_file()
+
+
+def _parse_mapped_layer_chunk(parser, file_path, excluded_byte_ranges, byte_ranges):
+    """
+    Process pool worker: maps the (uncompressed) file itself and parses the given layer byte ranges.
+    Returns each layer's LayerMoveColumns (plain arrays, cheap to pickle) together with this
+    process's move type table, since the type codes in the columns refer to that table.
+    """
+    source = MappedGCodeSource(file_path)
+    try:
+        source.excluded_byte_ranges = excluded_byte_ranges
+        layer_columns = [parser.parse_lines_to_columns(source.read_lines(start, end)) for start, end in byte_ranges]
+    finally:
+        source.close()
+    return layer_columns, MOVE_TYPES.names
+
+
 class GCodeFileHandler:
-    def __init__(self, parser):
+    WRITE_BUFFER_BYTES = 1024 * 1024
+    COPY_BLOCK_BYTES = 8 * 1024 * 1024 # Block size when byte ranges cannot be copied by the kernel
+    MAX_PASSTHROUGH_CHUNK_BYTES = 64 * 1024 * 1024 # Keeps progress and cancellation responsive during long copies
+    CHUNKS_PER_WORKER = 4 # More chunks than workers keeps the pool busy when layer sizes vary
+    PARALLEL_MIN_BYTES = 16 * 1024 * 1024 # Below this, starting the worker processes costs more than it saves
+
+    def __init__(self, parser, lazy_layers=True, use_mmap=True, parallel_workers=0, parse_cache=None):
         """
         Initializes the GCodeFileHandler with a GCodeParser instance.
         :param parser: An instance of GCodeParser.
+        :param lazy_layers: If True, loading only records layer boundaries and each layer's
+                            items are parsed on first access (e.g. when the layer is viewed or saved).
+        :param use_mmap: If True, files are memory-mapped and indexed by byte offset instead of being
+                         read into line lists; a layer's text is decoded only when the layer is opened.
+        :param parallel_workers: Number of worker processes used to parse layers when they are parsed up front
+                                 (lazy_layers=False) for a memory-mapped file of at least
+                                 PARALLEL_MIN_BYTES. 0 or 1 parses in this process,
+                                 None uses one worker per CPU. This is for scripts that parse whole
+                                 files; the app loads lazily and parses layers as they are opened.
+        :param parse_cache: Optional ParseCache. Memory-mapped files found in it reuse the stored byte-offset index
+                            and parsed layers instead of being indexed and parsed again.
         """
         self.parser = parser
+        self.lazy_layers = lazy_layers
+        self.use_mmap = use_mmap
+        self.parallel_workers = parallel_workers
+        self.parse_cache = parse_cache
 
     def load_gcode_file(self, file_path):
         """
         Loads a G-code file, processes it, and returns a GCodeDocument object.
         """
         doc = GCodeDocument(file_path=file_path)
+
+        if self.use_mmap:
+            try:
+                can_map = os.path.getsize(file_path) > 0 # Empty files cannot be mapped
+            except OSError as e:
+                raise IOError(f"Failed to read file: {file_path}. Error: {e}")
+            if can_map:
+                return self._load_mapped_gcode_file(doc)
+
+        # The parser streams the file once, skipping thumbnails and building the header and layers as it goes.
+        # Compressed files are decompressed on the fly.
+        opener = compressed_file_opener(file_path) or open
         try:
-            with open(file_path, 'r', encoding='utf-8') as file: # Specify encoding
-                doc.raw_lines = file.readlines()
-        except Exception as e:
+            with opener(file_path, 'rt', encoding='utf-8') as file: # Specify encoding
+                self.parser.parse_line_stream_to_layers(file, doc, lazy=self.lazy_layers)
+                doc.newline = '\r\n' if file.newlines == '\r\n' else '\n' # The line endings the file had
+        except (OSError, EOFError, lzma.LZMAError, UnicodeDecodeError) as e:
             raise IOError(f"Failed to read file: {file_path}. Error: {e}")
 
-        doc.cleaned_lines = self.parser.remove_thumbnails(doc.raw_lines)
+        return doc
+
+    def _load_mapped_gcode_file(self, doc):
+        cached = None
+        if self.parse_cache is not None:
+            try:
+                doc.cache_key = self.parse_cache.file_key(doc.file_path)
+            except OSError as e:
+                raise IOError(f"Failed to read file: {doc.file_path}. Error: {e}")
+            cached = self.parse_cache.load(doc.file_path, doc.cache_key)
+
+        try:
+            doc.source = MappedGCodeSource(doc.file_path)
+            doc.newline = doc.source.newline
+        except Exception as e:
+            raise IOError(f"Failed to read file: {doc.file_path}. Error: {e}")
 
-        # The parser will populate the document's layers and layer_indices
-        self.parser.parse_document_to_layers(doc.cleaned_lines, doc)
+        if cached is not None:
+            doc.thumbnail_byte_ranges = cached.thumbnail_byte_ranges
+            doc.source.excluded_byte_ranges = cached.thumbnail_byte_ranges
+            doc.layer_byte_ranges = cached.layer_byte_ranges
+            self.parser.build_mapped_layers(doc, lazy=True)
+            for layer_obj, columns in zip(doc.layers, cached.layer_columns):
+                if columns is not None:
+                    layer_obj.columns = columns
+        else:
+            # The parser builds the byte-offset index (layers and thumbnail blocks) and the layers on top of it
+            self.parser.parse_mapped_document_to_layers(doc, lazy=True)
 
+        parsed_now = False
+        if not self.lazy_layers:
+            parsed_now = self._parse_pending_layers(doc)
+        if cached is None or parsed_now:
+            self.save_to_cache(doc)
         return doc
 
-    def save_gcode_document(self, document, output_file_path, edited_layer_indices=None):
+    def save_to_cache(self, document):
         """
-        Saves the GCodeDocument to a specified file path.
-        If edited_layer_indices is provided, it indicates which layers in document.layers
-        contain edits (their .items list is the source of truth). Otherwise, original lines are used.
-
-        :param document: The GCodeDocument object to save.
-        :param output_file_path: Path to save the G-code file.
-        :param edited_layer_indices: A set or list of document layer indices that have been edited.
-                                     The GCodeLayer.items for these layers will be serialized.
+        Stores a memory-mapped document's index and parsed layers in the parse cache, so layers parsed while
+        the document was open are not parsed again the next time the file is loaded. Returns True if stored.
         """
-        if edited_layer_indices is None:
-            edited_layer_indices = set()
+        return self.store_cache_snapshot(self.cache_snapshot(document))
 
-        final_gcode_to_write = []
+    def cache_snapshot(self, document):
+        """
+        What save_to_cache would store for a document (None if nothing), taken on the thread that owns it,
+        so that store_cache_snapshot can write it from a worker thread.
+        """
+        if self.parse_cache is None:
+            return None
+        return self.parse_cache.snapshot(document)
 
-        # This saving logic needs to correctly interleave header, layer content (original or edited),
-        # lines between layers, and footer.
-        # It uses `document.cleaned_lines` as the backbone and substitutes layer content.
+    def store_cache_snapshot(self, snapshot):
+        """Writes a snapshot from cache_snapshot to the parse cache. Returns True if stored."""
+        if self.parse_cache is None or snapshot is None:
+            return False
+        return self.parse_cache.store_snapshot(snapshot)
 
-        current_cleaned_line_idx = 0
-        num_layers_in_doc = document.layer_count
+    def _parse_pending_layers(self, doc):
+        """Parses every layer of a memory-mapped document that is not parsed yet. Returns True if any were."""
+        pending = [layer_obj for layer_obj in doc.layers if not layer_obj.is_parsed]
+        workers = os.cpu_count() if self.parallel_workers is None else self.parallel_workers
+        pending_bytes = sum(end - start for start, end in (layer_obj.byte_range for layer_obj in pending))
+        if workers > 1 and len(pending) > 1 and pending_bytes >= self.PARALLEL_MIN_BYTES:
+            self._parse_layers_in_pool(doc, pending, workers)
+        else:
+            for layer_obj in pending:
+                layer_obj.columns # Runs the layer's pending parse
+        return bool(pending)
 
-        for i in range(num_layers_in_doc):
-            layer_obj = document.get_layer_by_document_index(i)
-            if not layer_obj:
-                # This should not happen if document is consistent
-                continue
+    def _layer_chunks(self, layers, chunk_count):
+        """Splits layers into up to `chunk_count` runs of consecutive layers with similar byte size."""
+        total_bytes = sum(end - start for start, end in (layer_obj.byte_range for layer_obj in layers))
+        target_bytes = max(total_bytes // chunk_count, 1)
+        chunks = []
+        chunk_start, chunk_bytes = 0, 0
+        for i, layer_obj in enumerate(layers):
+            chunk_bytes += layer_obj.byte_range[1] - layer_obj.byte_range[0]
+            if chunk_bytes >= target_bytes or i == len(layers) - 1:
+                chunks.append(layers[chunk_start:i + 1])
+                chunk_start, chunk_bytes = i + 1, 0
+        return chunks
 
-            layer_start_in_cleaned = document.layer_indices_in_cleaned_lines[i]
+    def _parse_layers_in_pool(self, doc, layers, workers):
+        """
+        Parses the given layers of a memory-mapped document in worker processes.
+        Layers are parsed independently, so each worker only needs the file path and its layers' byte ranges;
+        the resulting columns have their type codes remapped onto this process's MOVE_TYPES.
+        """
+        chunks = self._layer_chunks(layers, workers * self.CHUNKS_PER_WORKER)
+        # 'spawn' rather than fork: the GUI process has Qt and other threads running
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context) as pool:
+            futures = [pool.submit(_parse_mapped_layer_chunk, self.parser, doc.source.mapped_path,
+                                   doc.source.excluded_byte_ranges, [layer_obj.byte_range for layer_obj in chunk])
+                       for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                layer_columns, type_names = future.result()
+                code_map = MOVE_TYPES.merge(type_names)
+                for layer_obj, columns in zip(chunk, layer_columns):
+                    columns.type_code = code_map[columns.type_code]
+                    layer_obj.columns = columns
 
-            # Add lines from cleaned_lines that are before this layer's official start
-            if current_cleaned_line_idx < layer_start_in_cleaned:
-                final_gcode_to_write.extend(document.cleaned_lines[current_cleaned_line_idx:layer_start_in_cleaned])
+    def _iter_document_chunks(self, document, edited_layer_indices):
+        """
+        Yields the output of a document one piece at a time: the header, then each layer (original or edited),
+        each paired with the number of layers written once that piece is.
+        Pieces are text, except that unedited parts of a memory-mapped document come as (start, end) byte ranges
+        of the source when its bytes can be written out unchanged (see _can_pass_through); consecutive unedited
+        layers are merged into one range of up to MAX_PASSTHROUGH_CHUNK_BYTES.
+        Original layer text is read without being cached on the layer, so only one layer is held at a time.
+        """
+        if document.source is not None and self._can_pass_through(document.source):
+            range_start, range_end = document.header_byte_range
+            for i, layer_obj in enumerate(document.layers):
+                if i in edited_layer_indices:
+                    if range_end > range_start:
+                        yield (range_start, range_end), i
+                    yield ''.join(self.parser.gcode_layer_to_lines(layer_obj)), i + 1
+                    range_start = layer_obj.byte_range[1]
+                elif range_end - range_start >= self.MAX_PASSTHROUGH_CHUNK_BYTES:
+                    yield (range_start, range_end), i
+                    range_start = range_end
+                range_end = layer_obj.byte_range[1]
+            if range_end > range_start:
+                yield (range_start, range_end), document.layer_count
+            return
 
-            # Now process the layer itself
+        if document.source is not None:
+            header_start, header_end = document.header_byte_range
+            if header_end > header_start:
+                yield ''.join(document.source.read_lines(header_start, header_end)), 0
+        elif document.header_lines:
+            yield ''.join(document.header_lines), 0
+        for i, layer_obj in enumerate(document.layers):
             if i in edited_layer_indices:
-                # This layer was edited, so serialize its .items list
-                layer_lines = self.parser.gcode_layer_to_lines(layer_obj)
-                final_gcode_to_write.extend(layer_lines)
+                yield ''.join(self.parser.gcode_layer_to_lines(layer_obj)), i + 1
             else:
-                # Layer was not edited, use its original_lines from GCodeLayer object
-                # (which should be a segment of cleaned_lines including its ;LAYER_CHANGE)
-                final_gcode_to_write.extend(layer_obj.original_lines)
+                yield ''.join(layer_obj.read_original_lines()), i + 1
 
-            # Update current_cleaned_line_idx to point to the line after this layer's original segment
-            # The length of the original layer segment is len(layer_obj.original_lines)
-            current_cleaned_line_idx = layer_start_in_cleaned + len(layer_obj.original_lines)
+    def _can_pass_through(self, source):
+        """
+        True if the source's bytes are exactly what writing its decoded lines would produce: no carriage
+        returns, or CRLF line endings throughout, which writing with the file's newline puts back.
+        """
+        return not source.has_carriage_returns or source.newline == '\r\n'
 
-        # Add any remaining lines from cleaned_lines (footer or content after the last processed layer)
-        if current_cleaned_line_idx < len(document.cleaned_lines):
-            final_gcode_to_write.extend(document.cleaned_lines[current_cleaned_line_idx:])
+    def save_gcode_document(self, document, output_file_path, edited_layer_indices=None,
+                            progress_callback=None, is_canceled=None):
+        """
+        Saves the GCodeDocument to a specified file path.
+        If edited_layer_indices is provided, it indicates which layers in document.layers
+        contain edits (their .items list is the source of truth). Otherwise, original lines are used.
+        The file is written to a temporary file first and renamed into place once complete.
 
-        # If no layers were defined (e.g. empty file or file without ;LAYER_CHANGE and parser treated as no layers)
-        if num_layers_in_doc == 0 and document.cleaned_lines:
-             final_gcode_to_write.extend(document.cleaned_lines)
+        :param document: The GCodeDocument object to save.
+        :param output_file_path: Path to save the G-code file.
+        :param edited_layer_indices: A set or list of document layer indices that have been edited.
+                                     The GCodeLayer.items for these layers will be serialized.
+        :param progress_callback: Optional callable(layers_written, layer_count), called as the file is written.
+        :param is_canceled: Optional callable checked between pieces of output; when it returns True the save
+                            stops with SaveCancelled and output_file_path is left as it was.
+        """
+        if edited_layer_indices is None:
+            edited_layer_indices = set()
 
+        # Layers are contiguous and the footer belongs to the last layer, so the header followed by
+        # the layers reproduces the whole (thumbnail-free) file
+        chunks = self._iter_document_chunks(document, edited_layer_indices)
+        self._write_chunks(chunks, output_file_path, document.source, document.layer_count,
+                           progress_callback, is_canceled, document.newline)
 
+    def _write_chunks(self, chunks, output_file_path, source=None, layer_count=0,
+                      progress_callback=None, is_canceled=None, newline='\n'):
+        """
+        Writes (chunk, layers_written) pairs, where a chunk is text (its lines written ending with `newline`)
+        or a (start, end) byte range of `source`, to a
+        temporary file next to output_file_path, flushes it to disk and renames it into place once complete.
+        An interrupted save never leaves a truncated file behind, and overwriting the file a document is
+        memory-mapped from is safe: the mapping keeps the old contents.
+        """
         try:
-            with open(output_file_path, 'w', encoding='utf-8') as file: # Specify encoding
-                file.writelines(final_gcode_to_write)
+            out_dir = os.path.dirname(os.path.abspath(output_file_path))
+            file_mode = self._output_file_mode(output_file_path)
+            fd, temp_path = tempfile.mkstemp(dir=out_dir, prefix='.', suffix='.tmp')
+            try:
+                with open(fd, 'wb', buffering=self.WRITE_BUFFER_BYTES) as raw_file:
+                    self._write_output(raw_file, self._report_chunks(chunks, layer_count, progress_callback, is_canceled),
+                                       output_file_path, source, newline)
+                    raw_file.flush()
+                    os.fsync(raw_file.fileno())
+                os.chmod(temp_path, file_mode)
+                os.replace(temp_path, output_file_path)
+            except BaseException:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass # Keep the original error rather than one from cleaning up
+                raise
+        except SaveCancelled:
+            raise
         except Exception as e:
             raise IOError(f"Failed to write file: {output_file_path}. Error: {e}")
+
+    @staticmethod
+    def _report_chunks(chunks, layer_count, progress_callback, is_canceled):
+        """Passes chunks through, checking for cancellation before each one and reporting progress after it."""
+        for chunk, layers_written in chunks:
+            if is_canceled is not None and is_canceled():
+                raise SaveCancelled()
+            yield chunk
+            if progress_callback is not None:
+                progress_callback(layers_written, layer_count)
+
+    @staticmethod
+    def _output_file_mode(output_file_path):
+        """Permissions for the saved file: those of the file being replaced, else what open() would have created."""
+        try:
+            return stat.S_IMODE(os.stat(output_file_path).st_mode)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            return 0o666 & ~umask
+
+    def _write_output(self, raw_file, chunks, output_file_path, source, newline='\n'):
+        """
+        Writes chunks to an open binary file, compressed if output_file_path asks for it (.gz, .xz).
+        Text is encoded as UTF-8 with its '\\n' line endings written as `newline`; byte ranges are copied
+        from the source file.
+        """
+        opener = compressed_file_opener(output_file_path)
+        if opener is not None:
+            with opener(raw_file, 'wb') as compressed_file:
+                self._write_chunks_to(compressed_file, chunks, source, None, newline)
+        else:
+            self._write_chunks_to(raw_file, chunks, source, raw_file, newline)
+
+    def _write_chunks_to(self, out, chunks, source, raw_file, newline='\n'):
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                if newline != '\n':
+                    chunk = chunk.replace('\n', newline)
+                out.write(chunk.encode('utf-8', 'surrogateescape')) # Undecodable bytes of mapped layers are written back as read
+                continue
+            for start, end in source.iter_byte_ranges(*chunk): # Skips the thumbnail blocks
+                if raw_file is not None:
+                    self._copy_file_range(source, start, end, raw_file)
+                else:
+                    for block_start in range(start, end, self.COPY_BLOCK_BYTES):
+                        out.write(source.buffer[block_start:min(block_start + self.COPY_BLOCK_BYTES, end)])
+
+    def _copy_file_range(self, source, start, end, raw_file):
+        """
+        Appends source bytes [start, end) to raw_file, inside the kernel where possible (copy_file_range,
+        then sendfile), falling back to block copies from the memory map.
+        """
+        raw_file.flush() # The copy goes straight to the file descriptor, after what was buffered
+        src_fd, dst_fd = source.fileno(), raw_file.fileno()
+        pos = start
+        for kernel_copy in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+            if kernel_copy is None:
+                continue
+            try:
+                while pos < end:
+                    if kernel_copy is os.sendfile:
+                        copied = os.sendfile(dst_fd, src_fd, pos, end - pos)
+                    else:
+                        copied = kernel_copy(src_fd, dst_fd, end - pos, pos)
+                    if copied == 0:
+                        break
+                    pos += copied
+            except OSError: # Not supported for these files (e.g. across filesystems on old kernels)
+                continue
+            if pos >= end:
+                break
+        while pos < end:
+            block_end = min(pos + self.COPY_BLOCK_BYTES, end)
+            raw_file.write(source.buffer[pos:block_end])
+            pos = block_end
+        raw_file.seek(0, os.SEEK_END) # Resync the buffered file's position after writes to its descriptor
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from gcode_cache import default_cache_dir, sampled_file_key
+from gcode_models import ItemPieceTable, Move
+
+
+class EditJournal:
+    """
+    Append-only JSON-lines log of the edits made to one document, kept per source file in the cache directory.
+    Edits survive a crash (or closing without saving) and are re-applied when the file is opened again, by
+    replaying the records, which takes time proportional to the edits rather than the file.
+
+    Records (one JSON object per line):
+      header   file contents key; the journal is only replayed against the same file contents
+      open     the viewer starts editing a layer (the draft starts from the layer's current items)
+      insert   an item is inserted into the draft at an item index
+      delete   the item at an item index is removed from the draft
+      commit   the draft becomes the layer's edited items (edits applied to the main window)
+      replace  a layer's edited items, written out in full (by compaction, or for edits made outside a draft)
+      draft    the draft's items written out in full (by compaction)
+    Items written out in full refer to unchanged runs of the layer's parsed items as {"span": [start, end]}.
+
+    The journal mirrors the committed layers and the draft, so after `compact_after_records` records it
+    rewrites itself as one replace record per edited layer.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, journal_dir=None, compact_after_records=1000):
+        self.journal_dir = journal_dir or os.path.join(default_cache_dir(), 'journals')
+        self.compact_after_records = compact_after_records
+        self._reset(None, None)
+
+    def _reset(self, document, file_key):
+        self.document = document
+        self.file_key = file_key
+        self.layer_items = {} # Document layer index -> committed edited items list
+        self.draft_layer = None
+        self.draft_items = None
+        self._file = None
+        self._records_since_compact = 0
+        self._spans_valid = True # Whether the file on disk is the one the document's layers were parsed from
+
+    @property
+    def journal_path(self):
+        name = hashlib.sha1(os.path.abspath(self.document.file_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.journal_dir, name + '.jsonl')
+
+    def open(self, document, file_key=None):
+        """
+        Starts journaling edits of `document`, closing the previous one. If the file has a journal from an
+        earlier session, it is replayed and the recovered edits are returned as {document layer index: items}
+        (including an unfinished draft, e.g. after a crash); otherwise returns {}.
+        """
+        self.close()
+        if file_key is None:
+            file_key = document.cache_key or sampled_file_key(document.file_path)
+        self._reset(document, tuple(file_key))
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as file:
+                self._replay(file)
+        except OSError:
+            return {}
+
+        if self.draft_layer is not None: # Unapplied viewer edits from a session that did not close cleanly
+            self.layer_items[self.draft_layer] = self.draft_items
+            self.draft_layer = self.draft_items = None
+        self.compact() # Also drops a journal recorded against different file contents
+        return {layer_idx: ItemPieceTable.of(items) for layer_idx, items in self.layer_items.items()}
+
+    def _replay(self, file):
+        for line_number, line in enumerate(file):
+            try:
+                record = json.loads(line)
+                if line_number == 0:
+                    if record.get('op') != 'header' or record.get('version') != self.FORMAT_VERSION or \
+                            tuple(record.get('key', ())) != self.file_key:
+                        return
+                    continue
+                self._apply(record)
+            except (ValueError, KeyError, IndexError, TypeError): # Torn last write or corrupt tail: keep what came before
+                return
+
+    def _apply(self, record, live_item=None):
+        op = record['op']
+        if op == 'open':
+            self.draft_layer = self._checked_layer(record['layer'])
+            self.draft_items = self._base_items(self.draft_layer)
+        elif op == 'insert':
+            item = live_item if live_item is not None else self._item_from_json(record['item'])
+            self.draft_items.insert(record['index'], item)
+        elif op == 'delete':
+            del self.draft_items[record['index']]
+        elif op == 'commit':
+            if self._checked_layer(record['layer']) != self.draft_layer:
+                raise KeyError(record['layer'])
+            self.layer_items[self.draft_layer] = self.draft_items.copy()
+        elif op == 'replace':
+            layer_idx = self._checked_layer(record['layer'])
+            self.layer_items[layer_idx] = self._items_from_json(layer_idx, record['items'])
+        elif op == 'draft':
+            self.draft_layer = self._checked_layer(record['layer'])
+            self.draft_items = self._items_from_json(self.draft_layer, record['items'])
+        else:
+            raise KeyError(op)
+
+    def _checked_layer(self, layer_idx):
+        if not 0 <= layer_idx < self.document.layer_count:
+            raise IndexError(layer_idx)
+        return layer_idx
+
+    def _base_items(self, layer_idx):
+        """A layer's current items: its committed edits, or the items parsed from the file."""
+        if layer_idx in self.layer_items:
+            return ItemPieceTable.of(self.layer_items[layer_idx])
+        return ItemPieceTable.of(self.document.get_layer_by_document_index(layer_idx).items)
+
+    def _parsed_items(self, layer_idx):
+        """The list of items parsed from a layer's original lines, which spans refer to (None if unavailable)."""
+        if not self._spans_valid:
+            return None
+        items = self.document.get_layer_by_document_index(layer_idx).items
+        if isinstance(items, ItemPieceTable) and items.lines_backed:
+            return items.original
+        return None
+
+    def _items_to_json(self, layer_idx, items):
+        parsed_items = self._parsed_items(layer_idx)
+        if not isinstance(items, ItemPieceTable) or parsed_items is None or items.original is not parsed_items:
+            return [self._item_to_json(i) for i in items]
+        entries = []
+        for buffer, start, end in items.pieces():
+            if buffer is parsed_items:
+                entries.append({'span': [start, end]})
+            else:
+                entries.extend(self._item_to_json(i) for i in buffer[start:end])
+        return entries
+
+    def _items_from_json(self, layer_idx, entries):
+        parsed_items = self._parsed_items(layer_idx)
+        if parsed_items is not None:
+            items = ItemPieceTable(parsed_items, lines_backed=True)
+            del items[:]
+        else:
+            items = ItemPieceTable()
+        for entry in entries:
+            if 'span' in entry:
+                start, end = entry['span']
+                if parsed_items is None or not 0 <= start <= end <= len(parsed_items):
+                    raise IndexError(entry['span'])
+                items.append_original_span(start, end)
+            else:
+                items.append(self._item_from_json(entry))
+        return items
+
+    @staticmethod
+    def _item_to_json(item):
+        if isinstance(item, Move):
+            return {'move': item.to_dict()}
+        return {'text': item}
+
+    @staticmethod
+    def _item_from_json(data):
+        if 'move' in data:
+            return Move.from_dict(data['move'])
+        return data['text']
+
+    # Recording. Each record is applied to the mirror and appended (and flushed) straight away.
+
+    def record_open(self, layer_idx):
+        self._record({'op': 'open', 'layer': layer_idx})
+
+    def record_insert(self, index, item):
+        self._record({'op': 'insert', 'index': index, 'item': self._item_to_json(item)}, live_item=item)
+
+    def record_delete(self, index):
+        self._record({'op': 'delete', 'index': index})
+
+    def record_layer_items(self, layer_idx, items):
+        """Records a layer's new edited items: a commit of the draft when they came from it, else a full replace."""
+        if layer_idx == self.draft_layer and items == self.draft_items:
+            self._record({'op': 'commit', 'layer': layer_idx})
+        else:
+            self._record({'op': 'replace', 'layer': layer_idx, 'items': self._items_to_json(layer_idx, items)})
+
+    def _record(self, record, live_item=None):
+        if self.document is None:
+            return
+        try:
+            self._apply(record, live_item) # The mirror shares the editor's items, so commits can be matched
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return # Out of step with the editor (e.g. no layer opened); better to skip than to journal garbage
+        try:
+            if self._file is None:
+                self._start_file()
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+        except OSError:
+            self._close_file() # The journal is a safety net only; editing goes on without it
+            return
+        self._records_since_compact += 1
+        if self._records_since_compact >= self.compact_after_records:
+            self.compact()
+
+    def _header(self):
+        return json.dumps({'op': 'header', 'version': self.FORMAT_VERSION, 'key': list(self.file_key),
+                           'file': os.path.abspath(self.document.file_path)}) + '\n'
+
+    def _start_file(self):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        exists = os.path.exists(self.journal_path)
+        self._file = open(self.journal_path, 'a', encoding='utf-8')
+        if not exists:
+            self._file.write(self._header())
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def compact(self, keep_draft=True):
+        """
+        Rewrites the journal as one replace record per edited layer (plus the draft, if any and `keep_draft`).
+        A journal without edits is removed.
+        """
+        if self.document is None:
+            return
+        self._close_file()
+        self._records_since_compact = 0
+        lines = [json.dumps({'op': 'replace', 'layer': layer_idx, 'items': self._items_to_json(layer_idx, items)}) + '\n'
+                 for layer_idx, items in sorted(self.layer_items.items())]
+        if keep_draft and self.draft_layer is not None:
+            lines.append(json.dumps({'op': 'draft', 'layer': self.draft_layer,
+                                     'items': self._items_to_json(self.draft_layer, self.draft_items)}) + '\n')
+        try:
+            if not lines:
+                self._remove(self.journal_path)
+                return
+            os.makedirs(self.journal_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.journal_dir, prefix='.', suffix='.tmp')
+            try:
+                with open(fd, 'w', encoding='utf-8') as file:
+                    file.write(self._header())
+                    file.writelines(lines)
+                os.replace(temp_path, self.journal_path)
+            except BaseException:
+                self._remove(temp_path)
+                raise
+        except OSError:
+            pass
+
+    def rebase(self, file_key=None):
+        """
+        Called after the edits were saved over the document's own file: they are now part of the file, so the
+        journal starts over against the new contents (keeping only a draft that is still being edited).
+        """
+        if self.document is None:
+            return
+        self.file_key = tuple(file_key or sampled_file_key(self.document.file_path))
+        self.layer_items = {}
+        self._spans_valid = False # Spans would refer to the old contents; write items out in full instead
+        self.compact()
+
+    def close(self):
+        """Stops journaling the current document. Unapplied viewer edits are dropped, as in the editor."""
+        if self.document is None:
+            return
+        self.compact(keep_draft=False)
+        self._reset(None, None)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
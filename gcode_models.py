@@ -1,12 +1,109 @@
+import random
+import threading
+from collections import deque
+from itertools import chain
+
+import numpy as np
+
+
+class MoveTypeTable:
+    """
+    Interns move type strings (e.g. 'travel', 'external perimeter') as small integer codes,
+    so per-move storage only needs an int16 instead of a string reference.
+    """
+    NO_TYPE = -1 # Code used for moves without a type
+    MAX_TYPES = 32767 # Codes must fit in an int16 (the table is shared by every file opened in the process)
+
+    def __init__(self):
+        self._names = []
+        self._codes = {}
+        self._lock = threading.Lock() # Layers may be parsed from background threads
+
+    def code(self, name):
+        if name is None:
+            return self.NO_TYPE
+        type_code = self._codes.get(name)
+        if type_code is None:
+            with self._lock:
+                type_code = self._codes.get(name)
+                if type_code is None:
+                    if len(self._names) >= self.MAX_TYPES:
+                        raise ValueError(f"Too many distinct move types (max {self.MAX_TYPES}).")
+                    type_code = len(self._names)
+                    self._names.append(name)
+                    self._codes[name] = type_code
+        return type_code
+
+    def code_for_type_comment(self, comment_line):
+        """Returns the code for the type named by a ';TYPE:...' comment line (lowercased, e.g. 'external perimeter')."""
+        return self.code(comment_line.strip()[6:].lower())
+
+    def name(self, type_code):
+        if type_code < 0:
+            return None
+        return self._names[type_code]
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    def merge(self, names):
+        """
+        Adds the types of another table (e.g. one filled in a worker process) to this one.
+        Returns an int16 array mapping the other table's codes to codes in this table; it has one extra
+        trailing entry for NO_TYPE, so indexing it with a type_code column (including -1) remaps the column.
+        """
+        code_map = np.empty(len(names) + 1, dtype=np.int16)
+        for other_code, name in enumerate(names):
+            code_map[other_code] = self.code(name)
+        code_map[-1] = self.NO_TYPE
+        return code_map
+
+
+# Shared type table for all documents. 'travel' is registered first so its code is always 0.
+MOVE_TYPES = MoveTypeTable()
+MOVE_TYPES.code('travel')
+
+
 class Move:
+    """
+    A single G0-G3 move. Uses __slots__ to keep per-move memory small on dense layers; the move type is
+    stored as a MOVE_TYPES code, and the preceding ';TYPE:' comment as a reference to that line of the layer.
+    """
+    __slots__ = ('x', 'y', 'z', 'e', 'type_code', 'original_line_index', 'preceding_comment')
+
     def __init__(self, x=None, y=None, z=None, e=None, move_type=None, original_line_index=None, preceding_comment=None):
         self.x = x
         self.y = y
         self.z = z
         self.e = e
-        self.type = move_type  # e.g., 'travel', 'perimeter', 'external_perimeter' or from ;TYPE comment
+        self.type_code = MOVE_TYPES.code(move_type)  # e.g., 'travel', 'perimeter', 'external_perimeter' or from ;TYPE comment
         self.original_line_index = original_line_index # Original index within its GCodeLayer.original_lines
-        self.preceding_comment = preceding_comment # Stores the ;TYPE comment line if it directly precedes this move
+        self.preceding_comment = preceding_comment # The ;TYPE comment line if it directly precedes this move
+
+    @staticmethod
+    def from_type_code(x, y, z, e, type_code, original_line_index, preceding_comment):
+        """Fast constructor for moves read back from LayerMoveColumns."""
+        move = Move.__new__(Move)
+        move.x = x
+        move.y = y
+        move.z = z
+        move.e = e
+        move.type_code = type_code
+        move.original_line_index = original_line_index
+        move.preceding_comment = preceding_comment
+        return move
+
+    @property
+    def type(self):
+        return MOVE_TYPES.name(self.type_code)
+
+    @type.setter
+    def type(self, move_type):
+        self.type_code = MOVE_TYPES.code(move_type)
+
+    def __repr__(self):
+        return f"Move(x={self.x}, y={self.y}, z={self.z}, e={self.e}, type={self.type!r})"
 
     def to_dict(self):
         return {
@@ -31,23 +128,669 @@ class Move:
             preceding_comment=data.get('preceding_comment')
         )
 
+class LayerMoveColumns:
+    """
+    Struct-of-arrays storage for one layer's parsed content.
+    Moves are kept as parallel NumPy arrays (x/y/z/e as float64 with NaN for "not specified",
+    type codes from MOVE_TYPES as int16, and the index of the source line within the layer's original_lines).
+    Non-move lines are a separate table: their position in the item sequence and their index in
+    original_lines (or, for columns built from edited items, the strings themselves in `text_lines`).
+    """
+    def __init__(self, x, y, z, e, type_code, line_index, text_positions, text_line_indices, text_lines=None):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.z = np.asarray(z, dtype=np.float64)
+        self.e = np.asarray(e, dtype=np.float64)
+        self.type_code = np.asarray(type_code, dtype=np.int16)
+        self.line_index = np.asarray(line_index, dtype=np.int32) # -1 for moves not read from the file
+        self.text_positions = np.asarray(text_positions, dtype=np.int32)
+        self.text_line_indices = np.asarray(text_line_indices, dtype=np.int32)
+        self.text_lines = text_lines
+
+    @property
+    def move_count(self):
+        return len(self.x)
+
+    @property
+    def item_count(self):
+        return len(self.x) + len(self.text_positions)
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr in (self.x, self.y, self.z, self.e, self.type_code, self.line_index,
+                                          self.text_positions, self.text_line_indices))
+
+    def positions(self):
+        """Returns an (N, 3) float64 array of the moves' X, Y, Z (NaN where not specified)."""
+        return np.column_stack((self.x, self.y, self.z))
+
+    def move_item_positions(self):
+        """Returns the position of each move in the item sequence."""
+        is_move = np.ones(self.item_count, dtype=bool)
+        is_move[self.text_positions] = False
+        return np.flatnonzero(is_move)
+
+    @staticmethod
+    def from_items(items):
+        """Builds columns from a list of Move objects and strings (e.g. a layer's edited items)."""
+        x, y, z, e, type_code, line_index = [], [], [], [], [], []
+        text_positions, text_lines = [], []
+        nan = float('nan')
+        for pos, item in enumerate(items):
+            if isinstance(item, Move):
+                x.append(nan if item.x is None else item.x)
+                y.append(nan if item.y is None else item.y)
+                z.append(nan if item.z is None else item.z)
+                e.append(nan if item.e is None else item.e)
+                type_code.append(item.type_code)
+                line_index.append(-1 if item.original_line_index is None else item.original_line_index)
+            else:
+                text_positions.append(pos)
+                text_lines.append(item)
+        return LayerMoveColumns(x, y, z, e, type_code, line_index,
+                                text_positions, [-1] * len(text_positions), text_lines=text_lines)
+
+    def to_items(self, original_lines):
+        """Materializes the layer as a list of Move objects and strings."""
+        if self.text_lines is not None:
+            text_lines = self.text_lines
+        else:
+            text_lines = [original_lines[i] for i in self.text_line_indices.tolist()]
+
+        items = [None] * self.item_count
+        for pos, line in zip(self.text_positions.tolist(), text_lines):
+            items[pos] = line
+
+        # A move whose type came from a ';TYPE:' comment (anything typed other than travel) keeps a
+        # reference to that comment line, which is the closest ';TYPE:' line before it in the item sequence.
+        move_positions = self.move_item_positions()
+        type_line_flags = [line.lstrip().startswith(';TYPE:') for line in text_lines]
+        type_line_positions = self.text_positions[np.asarray(type_line_flags, dtype=bool)]
+        type_line_texts = [line for line, is_type_line in zip(text_lines, type_line_flags) if is_type_line]
+        preceding = np.searchsorted(type_line_positions, move_positions) - 1
+        has_comment_type = (self.type_code >= 0) & (self.type_code != MOVE_TYPES.code('travel')) & (preceding >= 0)
+        comments = [None] * len(move_positions)
+        for move_no in np.flatnonzero(has_comment_type).tolist():
+            comments[move_no] = type_line_texts[preceding[move_no]]
+
+        def to_optional(values):
+            return [None if v != v else v for v in values.tolist()] # NaN -> None
+
+        new_move = Move.from_type_code
+        for pos, mx, my, mz, me, type_code, line_idx, comment in zip(
+                move_positions.tolist(), to_optional(self.x), to_optional(self.y), to_optional(self.z),
+                to_optional(self.e), self.type_code.tolist(), self.line_index.tolist(), comments):
+            items[pos] = new_move(mx, my, mz, me, type_code, None if line_idx < 0 else line_idx, comment)
+        return items
+
+
+class FenwickTree:
+    """Binary indexed tree over integer counts: point updates, prefix sums and prefix searches in O(log n)."""
+    def __init__(self, counts):
+        self._tree = [0] + list(counts)
+        size = len(self._tree)
+        for i in range(1, size):
+            parent = i + (i & -i)
+            if parent < size:
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self):
+        return len(self._tree) - 1
+
+    def add(self, index, delta):
+        """Adds `delta` to the count at `index`."""
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, end):
+        """Sum of the counts at indices [0, end)."""
+        total = 0
+        while end > 0:
+            total += self._tree[end]
+            end -= end & -end
+        return total
+
+    def find(self, target):
+        """
+        Returns (index, sum before it) for the first index whose prefix sum including it exceeds `target`
+        (i.e. the entry holding the target-th unit, 0-based); index == len(self) if there is none.
+        """
+        pos, remaining = 0, target
+        step = 1 << (len(self).bit_length())
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= remaining:
+                pos = nxt
+                remaining -= self._tree[nxt]
+            step >>= 1
+        return pos, target - remaining
+
+
+class ItemMoveIndex:
+    """
+    Maps between move numbers and item positions in a layer's item sequence (Move objects mixed with text lines)
+    without scanning the items: "the n-th move is item i" and "item i has k moves before it".
+    The sequence's is-move flags are kept in blocks of up to 2 * BLOCK_SIZE, with Fenwick trees over the
+    blocks' item and move counts, so lookups take O(log n) and inserting or deleting one item takes
+    O(log n + BLOCK_SIZE) (blocks are split when they grow too big, which rebuilds the trees).
+    """
+    BLOCK_SIZE = 64
+
+    def __init__(self, is_move_flags):
+        flags = bytes(is_move_flags)
+        self._blocks = [bytearray(flags[i:i + self.BLOCK_SIZE]) for i in range(0, len(flags), self.BLOCK_SIZE)]
+        self._rebuild_trees()
+
+    @staticmethod
+    def from_items(items):
+        return ItemMoveIndex(bytes(isinstance(item, Move) for item in items))
+
+    @staticmethod
+    def from_columns(columns):
+        """Builds the index from a layer's LayerMoveColumns in one vectorized step."""
+        is_move = np.ones(columns.item_count, dtype=np.uint8)
+        is_move[columns.text_positions] = 0
+        return ItemMoveIndex(is_move.tobytes())
+
+    def _rebuild_trees(self):
+        if not self._blocks:
+            self._blocks = [bytearray()]
+        self._item_counts = FenwickTree(len(block) for block in self._blocks)
+        self._move_counts = FenwickTree(block.count(1) for block in self._blocks)
+        self.item_count = sum(len(block) for block in self._blocks)
+        self.move_count = sum(block.count(1) for block in self._blocks)
+
+    def _locate_item(self, item_idx):
+        """Returns (block number, offset in the block) of an item position (item_count maps past the end)."""
+        if item_idx >= self.item_count:
+            last = len(self._blocks) - 1
+            return last, len(self._blocks[last]) + item_idx - self.item_count
+        block_no, items_before = self._item_counts.find(item_idx)
+        return block_no, item_idx - items_before
+
+    def item_index_of_move(self, move_number):
+        """Item position of the move_number-th (0-based) move, or -1 if there are not that many moves."""
+        if not 0 <= move_number < self.move_count:
+            return -1
+        block_no, moves_before = self._move_counts.find(move_number)
+        block = self._blocks[block_no]
+        offset = -1
+        for _ in range(move_number - moves_before + 1):
+            offset = block.index(1, offset + 1)
+        return self._item_counts.prefix_sum(block_no) + offset
+
+    def moves_before(self, item_idx):
+        """Number of moves among the first `item_idx` items."""
+        if item_idx <= 0:
+            return 0
+        if item_idx >= self.item_count:
+            return self.move_count
+        block_no, offset = self._locate_item(item_idx)
+        return self._move_counts.prefix_sum(block_no) + self._blocks[block_no].count(1, 0, offset)
+
+    def is_move(self, item_idx):
+        """True if the item at position item_idx is a move."""
+        block_no, offset = self._locate_item(item_idx)
+        return bool(self._blocks[block_no][offset])
+
+    def insert(self, item_idx, is_move):
+        """Records that an item (a move if `is_move`) was inserted at position item_idx."""
+        block_no, offset = self._locate_item(item_idx)
+        self._blocks[block_no].insert(offset, 1 if is_move else 0)
+        self.item_count += 1
+        self.move_count += bool(is_move)
+        if len(self._blocks[block_no]) > 2 * self.BLOCK_SIZE:
+            block = self._blocks[block_no]
+            self._blocks[block_no:block_no + 1] = [block[:self.BLOCK_SIZE], block[self.BLOCK_SIZE:]]
+            self._rebuild_trees()
+        else:
+            self._item_counts.add(block_no, 1)
+            if is_move:
+                self._move_counts.add(block_no, 1)
+
+    def delete(self, item_idx):
+        """Records that the item at position item_idx was removed. Returns True if it was a move."""
+        block_no, offset = self._locate_item(item_idx)
+        block = self._blocks[block_no]
+        was_move = block[offset]
+        del block[offset]
+        self.item_count -= 1
+        self.move_count -= was_move
+        if not block and len(self._blocks) > 1:
+            del self._blocks[block_no]
+            self._rebuild_trees()
+        else:
+            self._item_counts.add(block_no, -1)
+            if was_move:
+                self._move_counts.add(block_no, -1)
+        return bool(was_move)
+
+
+class _Piece:
+    """A node of ItemPieceTable's tree: a range of a buffer, plus the total length of its subtree."""
+    __slots__ = ('buffer', 'start', 'end', 'priority', 'left', 'right', 'size')
+
+    def __init__(self, buffer, start, end, priority=None):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.priority = random.random() if priority is None else priority
+        self.left = None
+        self.right = None
+        self.size = end - start
+
+    def update(self):
+        self.size = (self.end - self.start + (self.left.size if self.left is not None else 0) +
+                     (self.right.size if self.right is not None else 0))
+
+
+def _merge(left, right):
+    """Joins two piece trees, all of `left`'s items first."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.update()
+        return left
+    right.left = _merge(left, right.left)
+    right.update()
+    return right
+
+
+def _split(node, count):
+    """Splits a piece tree into the trees of its first `count` items and of the rest (cutting a piece if needed)."""
+    if node is None:
+        return None, None
+    left_size = node.left.size if node.left is not None else 0
+    if count <= left_size:
+        left, node.left = _split(node.left, count)
+        node.update()
+        return left, node
+    piece_length = node.end - node.start
+    if count >= left_size + piece_length:
+        node.right, right = _split(node.right, count - left_size - piece_length)
+        node.update()
+        return node, right
+    # The split falls inside this piece: it keeps the first part, the rest becomes a new piece
+    cut = node.start + count - left_size
+    rest = _Piece(node.buffer, cut, node.end)
+    rest.right, node.right = node.right, None
+    node.end = cut
+    rest.update()
+    node.update()
+    return node, rest
+
+
+def _build(pieces):
+    """Builds a balanced piece tree over (buffer, start, end) pieces in O(len(pieces))."""
+    pieces = [piece for piece in pieces if piece[2] > piece[1]]
+    if not pieces:
+        return None
+    # Random priorities, highest at the top: the tree is balanced and still a valid treap for later inserts
+    priorities = sorted((random.random() for _ in pieces), reverse=True)
+    nodes = [None] * len(pieces)
+    order = deque([(0, len(pieces), None, False)])
+    root = None
+    next_priority = 0
+    while order: # Breadth first, so parents take higher priorities than their children
+        lo, hi, parent, is_right = order.popleft()
+        mid = (lo + hi) // 2
+        buffer, start, end = pieces[mid]
+        node = nodes[mid] = _Piece(buffer, start, end, priorities[next_priority])
+        next_priority += 1
+        if parent is None:
+            root = node
+        elif is_right:
+            parent.right = node
+        else:
+            parent.left = node
+        if lo < mid:
+            order.append((lo, mid, node, False))
+        if mid + 1 < hi:
+            order.append((mid + 1, hi, node, True))
+    for node in _postorder(root):
+        node.update()
+    return root
+
+
+def _postorder(node):
+    stack, out = [node] if node is not None else [], []
+    while stack:
+        node = stack.pop()
+        out.append(node)
+        if node.left is not None:
+            stack.append(node.left)
+        if node.right is not None:
+            stack.append(node.right)
+    return reversed(out)
+
+
+def _collect_pieces(node, start, stop, before, pieces):
+    """Appends the pieces covering items [start, stop) of a subtree with `before` items ahead of it (clipped)."""
+    if node is None or stop <= before or start >= before + node.size:
+        return
+    _collect_pieces(node.left, start, stop, before, pieces)
+    piece_start = before + (node.left.size if node.left is not None else 0)
+    piece_end = piece_start + node.end - node.start
+    if start < piece_end and stop > piece_start:
+        pieces.append((node.buffer, node.start + max(start - piece_start, 0),
+                       node.start + min(stop, piece_end) - piece_start))
+    _collect_pieces(node.right, start, stop, piece_end, pieces)
+
+
+def _inorder(node):
+    """Yields a piece tree's nodes in item order."""
+    stack = []
+    while stack or node is not None:
+        while node is not None:
+            stack.append(node)
+            node = node.left
+        node = stack.pop()
+        yield node
+        node = node.right
+
+
+class ItemPieceTable:
+    """
+    A layer's items (Move objects and strings) as a piece table: the sequence is made of pieces, each a
+    range of either the `original` items or a buffer of added items. The pieces are kept in a randomized
+    balanced tree (a treap) ordered by position, with each node holding its subtree's item count, so
+    finding, inserting or deleting an item costs O(log p) for p pieces, whatever the number of items,
+    including when a piece has to be cut in two; typing at the end of an inserted run just extends its piece.
+    Buffers are append-only and shared: a copy or slice keeps referring to them and appends to a new
+    `added` buffer of its own, so copies cost O(p) and never see each other's edits.
+    `version` goes up with every edit, so data derived from the items can tell when it is stale.
+
+    With `lines_backed`, original[i] is the item parsed from the layer's original_lines[i], so pieces
+    of `original` can be written back as the original text (see pieces()).
+    """
+    def __init__(self, original_items=(), lines_backed=False):
+        self.original = original_items if isinstance(original_items, list) else list(original_items)
+        self.added = []
+        self.lines_backed = lines_backed
+        self.version = 0
+        self._root = _build([(self.original, 0, len(self.original))])
+
+    @staticmethod
+    def of(items):
+        """A piece table with the same items: a copy of a piece table, or a new table over a list's items."""
+        if isinstance(items, ItemPieceTable):
+            return items.copy()
+        return ItemPieceTable(list(items))
+
+    def _with_pieces(self, pieces):
+        table = ItemPieceTable.__new__(ItemPieceTable)
+        table.original = self.original
+        table.added = []
+        table.lines_backed = self.lines_backed
+        table.version = 0
+        table._root = _build(pieces)
+        return table
+
+    def _piece_list(self):
+        return [(node.buffer, node.start, node.end) for node in _inorder(self._root)]
+
+    def copy(self):
+        return self._with_pieces(self._piece_list())
+
+    def __len__(self):
+        return self._root.size if self._root is not None else 0
+
+    def _locate(self, index, size_delta=0):
+        """
+        Returns (piece node, offset in the piece) of an item position 0 <= index < len(). With `size_delta`,
+        adds it to the item counts on the way down, for a piece whose length changes by that much.
+        """
+        node = self._root
+        while True:
+            node.size += size_delta
+            left_size = node.left.size if node.left is not None else 0
+            if index < left_size:
+                node = node.left
+                continue
+            index -= left_size
+            if index < node.end - node.start:
+                return node, index
+            index -= node.end - node.start
+            node = node.right
+
+    def _normalize_index(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('item index out of range')
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            pieces = []
+            _collect_pieces(self._root, start, max(start, stop), 0, pieces)
+            return self._with_pieces(pieces)
+        node, offset = self._locate(self._normalize_index(index))
+        return node.buffer[node.start + offset]
+
+    def __iter__(self):
+        for node in _inorder(self._root):
+            yield from node.buffer[node.start:node.end]
+
+    def _same_pieces(self, other):
+        return len(self) == len(other) and \
+            all(a[0] is b[0] and a[1:] == b[1:] for a, b in zip(self._piece_list(), other._piece_list()))
+
+    def __eq__(self, other):
+        if isinstance(other, ItemPieceTable) and self._same_pieces(other):
+            return True
+        try:
+            return len(self) == len(other) and all(a is b or a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return f"ItemPieceTable({list(self)!r})"
+
+    def insert(self, index, item):
+        length = len(self)
+        index = max(0, min(index + length if index < 0 else index, length))
+        self.added.append(item)
+        self.version += 1
+        if index > 0:
+            node, offset = self._locate(index - 1)
+            if node.buffer is self.added and offset == node.end - node.start - 1 and node.end == len(self.added) - 1:
+                self._locate(index - 1, size_delta=1) # Continuing the run this piece was typed as
+                node.end += 1
+                return
+        left, right = _split(self._root, index)
+        self._root = _merge(_merge(left, _Piece(self.added, len(self.added) - 1, len(self.added))), right)
+
+    def append(self, item):
+        self.insert(len(self), item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def append_original_span(self, start, end):
+        """Appends original[start:end] as a piece of original items."""
+        if end > start:
+            self._root = _merge(self._root, _Piece(self.original, start, end))
+            self.version += 1
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('extended slices are not supported')
+            if stop <= start:
+                return
+            left, rest = _split(self._root, start)
+            _, right = _split(rest, stop - start)
+            self._root = _merge(left, right)
+            self.version += 1
+            return
+        index = self._normalize_index(index)
+        node, offset = self._locate(index)
+        self.version += 1
+        if node.end - node.start > 1 and offset in (0, node.end - node.start - 1):
+            self._locate(index, size_delta=-1) # Trimming a piece at either end keeps the tree's shape
+            if offset == 0:
+                node.start += 1
+            else:
+                node.end -= 1
+            return
+        del self[index:index + 1]
+
+    def pop(self, index=-1):
+        item = self[index]
+        del self[index]
+        return item
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('extended slices are not supported')
+            del self[start:max(start, stop)]
+            if isinstance(value, ItemPieceTable) and value.original is self.original:
+                # Splicing the pieces back keeps original runs as original text
+                left, right = _split(self._root, start)
+                self._root = _merge(_merge(left, _build(value._piece_list())), right)
+                self.version += 1
+            else:
+                for offset, item in enumerate(value):
+                    self.insert(start + offset, item)
+            return
+        index = self._normalize_index(index)
+        del self[index]
+        self.insert(index, value)
+
+    def pieces(self):
+        """
+        Yields (buffer, start, end) for each piece, in order. A piece whose buffer is `original` is a run of
+        original items (for a lines_backed table, the same range of the layer's original_lines); other
+        buffers hold items inserted by edits.
+        """
+        return iter(self._piece_list())
+
+
 class GCodeLayer:
-    def __init__(self, layer_index_in_document, original_lines=None):
+    def __init__(self, layer_index_in_document, original_lines=None, layer_parser=None, source=None, byte_range=None):
         self.layer_index_in_document = layer_index_in_document # The 0-based index in the GCodeDocument's list of layers
-        self.original_lines = original_lines if original_lines is not None else [] # Raw lines for this layer as parsed
 
-        # `items` will store the sequence of operations for this layer.
-        # Each item can be a Move object or a string (for non-move G-code lines).
-        # This list represents the editable, final sequence for the layer.
-        self.items = []
-        # self.moves = [] # List of Move objects, derived from items or used to build items.
-        # self.non_move_lines = {} # map of original_line_index (in original_lines) : line_text
+        # Layers of a memory-mapped document are created without original_lines: `source` is the
+        # document's MappedGCodeSource and `byte_range` the (start, end) offsets of this layer in it.
+        # The layer's text is only decoded the first time original_lines is accessed.
+        self.source = source
+        self.byte_range = byte_range
+        if original_lines is None and source is None:
+            original_lines = []
+        self._original_lines = original_lines # Raw lines for this layer as parsed (None until decoded)
+
+        # Parsed content exists in one of two forms:
+        # - `columns`: a LayerMoveColumns struct-of-arrays, which is what the parser produces.
+        # - `items`: the editable sequence of operations for this layer, where each item is a Move object
+        #   or a string (for non-move G-code lines). It is built from `columns` on first access and
+        #   from then on is the source of truth for the layer (it may have been edited).
+        # When a `layer_parser` callable is given, the layer is "lazy": nothing is parsed until
+        # `columns` or `items` is first needed, at which point layer_parser(self) sets `columns`.
+        self._layer_parser = layer_parser
+        self._columns = None
+        self._items = None if layer_parser is not None else []
+        self._items_columns = None # (items version, LayerMoveColumns built from the items at that version)
+
+    @property
+    def original_lines(self):
+        if self._original_lines is None:
+            self._original_lines = self.source.read_lines(*self.byte_range)
+        return self._original_lines
+
+    @original_lines.setter
+    def original_lines(self, value):
+        self._original_lines = value
+
+    def read_original_lines(self):
+        """
+        Returns the layer's lines without keeping decoded text on the layer, so a background thread can
+        read a layer the GUI thread owns without modifying it.
+        """
+        if self._original_lines is not None:
+            return self._original_lines
+        return self.source.read_lines(*self.byte_range)
+
+    def _ensure_parsed(self):
+        if self._columns is None and self._layer_parser is not None:
+            layer_parser = self._layer_parser
+            layer_parser(self) # Sets self.columns
+            self._layer_parser = None
+
+    @property
+    def columns(self):
+        """
+        The layer's moves as LayerMoveColumns. Once `items` exist, the columns are built from them, and kept
+        until the items are edited if they are an ItemPieceTable (plain lists have no version to check).
+        """
+        if self._items is not None:
+            version = getattr(self._items, 'version', None)
+            if version is None:
+                return LayerMoveColumns.from_items(self._items)
+            if self._items_columns is None or self._items_columns[0] != version:
+                self._items_columns = (version, LayerMoveColumns.from_items(self._items))
+            return self._items_columns[1]
+        self._ensure_parsed()
+        return self._columns
+
+    @columns.setter
+    def columns(self, value):
+        self._columns = value
+        self._items = None
+        self._items_columns = None
+        self._layer_parser = None
+
+    @property
+    def items(self):
+        if self._items is None:
+            self._ensure_parsed()
+            if self._columns is not None:
+                # A piece table over the parsed items, so edits can keep unchanged runs as original text
+                self._items = ItemPieceTable(self._columns.to_items(self.original_lines), lines_backed=True)
+            else:
+                self._items = []
+            self._columns = None # `items` is the source of truth from here on
+        return self._items
+
+    @items.setter
+    def items(self, value):
+        self._items = value
+        self._columns = None
+        self._items_columns = None
+        self._layer_parser = None # Explicitly assigned items replace any pending lazy parse
+
+    @property
+    def is_parsed(self):
+        """True once the layer's lines have been parsed (always True for non-lazy layers)."""
+        return self._items is not None or self._columns is not None
+
+    @property
+    def has_items(self):
+        """True once `items` has been built (from then on `columns` is derived from it)."""
+        return self._items is not None
 
     def add_item(self, item):
         self.items.append(item)
 
-    def get_moves(self):
-        """Returns a list of Move objects from self.items."""
+    def get_moves(self, as_columns=False):
+        """
+        Returns a list of Move objects from self.items.
+        With as_columns=True, returns the moves as LayerMoveColumns arrays instead, without building Move objects.
+        """
+        if as_columns:
+            return self.columns
         return [item for item in self.items if isinstance(item, Move)]
 
     def get_non_move_line_strings(self):
@@ -58,8 +801,12 @@ class GCodeLayer:
 class GCodeDocument:
     def __init__(self, file_path=None):
         self.file_path = file_path
-        self.raw_lines = [] # All lines as read from the file
-        self.cleaned_lines = [] # Lines after initial processing like thumbnail removal
+        self.raw_lines = [] # All lines as read from the file (left empty when the file is streamed)
+        self.header_lines = [] # Lines before the first layer, thumbnails removed
+        # Lines are kept with '\n' endings; `newline` is what the file used ('\r\n' if it used CRLF throughout)
+        # and what saving writes
+        self.newline = '\n'
+        self._cleaned_lines = None # Explicitly assigned cleaned_lines, if any
 
         # `layers` stores GCodeLayer objects.
         self.layers = [] # List of GCodeLayer objects, ordered as they appear in the file.
@@ -69,6 +816,46 @@ class GCodeDocument:
         # This helps in reconstructing the file, especially parts between layers or header/footer.
         self.layer_indices_in_cleaned_lines = []
 
+        # Memory-mapped documents leave raw_lines/cleaned_lines empty and index the file by byte offset instead.
+        # `source` is the MappedGCodeSource the offsets refer to (None for documents loaded as line lists).
+        self.source = None
+        self.layer_byte_ranges = [] # (start, end) byte offsets of each layer, starting at its ;LAYER_CHANGE line
+        self.thumbnail_byte_ranges = [] # (start, end) byte offsets of each thumbnail block (skipped when decoding)
+        # (size, mtime_ns, content digest) of the file when the byte offsets were computed; see ParseCache
+        self.cache_key = None
+
+    @property
+    def cleaned_lines(self):
+        """
+        Lines after initial processing like thumbnail removal. Files loaded as line lists are streamed into
+        header_lines and the layers' original_lines, so unless assigned explicitly this is an iterator over
+        those, which copies nothing; use list() for a list. Memory-mapped documents have no cleaned lines.
+        """
+        if self._cleaned_lines is not None:
+            return self._cleaned_lines
+        if self.source is not None:
+            return iter(())
+        return chain(self.header_lines, chain.from_iterable(layer.original_lines for layer in self.layers))
+
+    @cleaned_lines.setter
+    def cleaned_lines(self, value):
+        self._cleaned_lines = value
+
+    @property
+    def header_byte_range(self):
+        """Byte range of the content before the first layer in a memory-mapped document, or None."""
+        if self.source is None:
+            return None
+        if self.layer_byte_ranges:
+            return (0, self.layer_byte_ranges[0][0])
+        return (0, self.source.size)
+
+    def close(self):
+        """Releases the memory-mapped source, if any. Undecoded layers cannot be read afterwards."""
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+
     def add_layer(self, layer):
         self.layers.append(layer)
 
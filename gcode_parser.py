@@ -1,98 +1,447 @@
-from gcode_models import Move, GCodeLayer
+import numpy as np
+
+from gcode_models import Move, GCodeLayer, LayerMoveColumns, ItemPieceTable, MOVE_TYPES
+
+# Parameter letters extracted by the batch tokenizer. Only X/Y/Z/E affect the parsed columns.
+MOVE_PARAM_LETTERS = 'XYZEFIJ'
+
+# Threshold for "significant" extrusion. Helps classify moves with tiny E changes due to float precision as travel.
+SIGNIFICANT_EXTRUSION_THRESHOLD = 1e-5 # 0.00001 mm
+
+
+# Byte lookup tables for the batch tokenizer: the ASCII characters str.split() treats as whitespace,
+# and the parameter letters (either case)
+_WHITESPACE_BYTES = np.zeros(256, dtype=bool)
+_WHITESPACE_BYTES[[0x09, 0x0a, 0x0b, 0x0c, 0x0d, 0x1c, 0x1d, 0x1e, 0x1f, 0x20]] = True
+_PARAM_LETTER_BYTES = np.zeros(256, dtype=bool)
+_PARAM_LETTER_BYTES[list((MOVE_PARAM_LETTERS + MOVE_PARAM_LETTERS.lower()).encode())] = True
+_POWERS_OF_TEN = 10 ** np.arange(16, dtype=np.int64)
+_MAX_FAST_PATH_DIGITS = 15 # Integers up to 15 digits are exact in a float64, so digits / 10**k rounds correctly
+
+# G-code line formats for the batch serializer, indexed by which parameters a move writes:
+# bit 0 = X, bit 1 = Y, bit 2 = Z, bit 3 = E. Index 0 (nothing to write) is never emitted.
+_MOVE_LINE_FORMATS = np.array(['G1' + (' X%.3f' if bits & 1 else '') + (' Y%.3f' if bits & 2 else '') +
+                               (' Z%.3f' if bits & 4 else '') + (' E%.5f' if bits & 8 else '') + '\n'
+                               for bits in range(16)])
+
+# Commands whose E parameter sets the extruder position, which the piece-table serializer tracks across its pieces
+_E_SETTING_COMMANDS = frozenset(['G0', 'G1', 'G2', 'G3', 'G00', 'G01', 'G02', 'G03', 'G92'])
+
+# Line kinds assigned by _tokenize_layer
+LINE_OTHER, LINE_TYPE_COMMENT, LINE_EMPTY, LINE_MOVE_CANDIDATE = 0, 1, 2, 3
+
+
+def _thumbnail_marker(line):
+    """Returns 'begin' or 'end' if the line opens or closes a thumbnail block, else None."""
+    if 'thumbnail' not in line: # One search rules out almost every line
+        return None
+    if 'thumbnail_QOI begin' in line or 'thumbnail begin' in line:
+        return 'begin'
+    if 'thumbnail_QOI end' in line or 'thumbnail end' in line:
+        return 'end'
+    return None
+
+
+def _tokenize_layer(stripped_lines):
+    """
+    Batch tokenizer for a layer's stripped lines. Works on the layer's bytes as NumPy arrays:
+    classifies every line by its first characters (same prefix rules as the line-by-line parser), finds every
+    whitespace-separated parameter token after the command of G0-G3 lines, and parses the plain decimal ones
+    ("12", "-3.25", ".5") as mantissa / 10**fraction_digits, which gives the same float as float().
+    Anything else (exponents, very long numbers, malformed values) is handed to float() individually.
+    Returns (kinds, command_kinds, params, present), or None if a G0-G3 line is not pure ASCII:
+    - kinds: int8 LINE_* kind per line
+    - command_kinds: int8 per line, 1 = G0/G00, 0 = G1/G01, -1 = any other command
+    - params: letter -> float64 array per line (NaN if not given; the last valid token for a letter wins)
+    - present: letter -> bool array per line
+    """
+    line_count = len(stripped_lines)
+    params = {letter: np.full(line_count, np.nan) for letter in MOVE_PARAM_LETTERS}
+    present = {letter: np.zeros(line_count, dtype=bool) for letter in MOVE_PARAM_LETTERS}
+
+    data = '\n'.join(stripped_lines).encode('utf-8', 'surrogateescape')
+    buf = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == 0x0a)
+    line_starts = np.concatenate(([0], newlines + 1))
+    line_lengths = np.concatenate((newlines, [len(buf)])) - line_starts
+
+    # Leading characters of every line. Reads past a line's end hit its '\n' (or the padding), which never matches.
+    padded = np.concatenate((buf, np.full(6, 0x20, dtype=np.uint8)))
+    c0, c1, c2, c3 = (padded[line_starts + k] for k in range(4))
+    is_type_comment = c0 == ord(';')
+    for offset, char in enumerate(b'TYPE:', start=1):
+        is_type_comment &= padded[line_starts + offset] == char
+    is_candidate = (c0 == ord('G')) & (c1 >= ord('0')) & (c1 <= ord('3')) & ~((c1 == ord('2')) & (c2 == ord('8')))
+    kinds = np.full(line_count, LINE_OTHER, dtype=np.int8)
+    kinds[is_candidate] = LINE_MOVE_CANDIDATE
+    kinds[is_type_comment] = LINE_TYPE_COMMENT
+    kinds[line_lengths == 0] = LINE_EMPTY
+
+    # Command kind from the first token: 'G' + '0'/'1' (or '00'/'01') followed by whitespace or the end of the line
+    ends_at_2, ends_at_3 = _WHITESPACE_BYTES[c2], _WHITESPACE_BYTES[c3]
+    is_g0 = (c1 == ord('0')) & (ends_at_2 | ((c2 == ord('0')) & ends_at_3))
+    is_g1 = ((c1 == ord('1')) & ends_at_2) | ((c1 == ord('0')) & (c2 == ord('1')) & ends_at_3)
+    command_kinds = np.where(is_g0, 1, np.where(is_g1, 0, -1)).astype(np.int8)
+
+    non_ascii = np.flatnonzero(buf >= 0x80)
+    if len(non_ascii) and is_candidate[np.searchsorted(line_starts, non_ascii, side='right') - 1].any():
+        return None
+
+    # Parameter tokens: tokens of candidate lines that are not the command, with a recognized letter
+    is_space = _WHITESPACE_BYTES[buf]
+    not_space = ~is_space
+    token_start = np.flatnonzero(not_space & np.concatenate(([True], is_space[:-1])))
+    token_end = np.flatnonzero(not_space & np.concatenate((is_space[1:], [True]))) + 1
+    token_line = np.searchsorted(line_starts, token_start, side='right') - 1
+    is_param = (token_start != line_starts[token_line]) & is_candidate[token_line] & \
+               _PARAM_LETTER_BYTES[buf[token_start]] & (token_end - token_start > 1)
+    token_start, token_end, token_line = token_start[is_param], token_end[is_param], token_line[is_param]
+    letter = buf[token_start] & np.uint8(0xDF) # ASCII uppercase
+
+    # Value bytes of all tokens (everything after the letter) as a token x column matrix
+    value_len = token_end - token_start - 1
+    width = min(int(value_len.max()) if len(value_len) else 0, _MAX_FAST_PATH_DIGITS + 2) # Digits, sign and dot
+    padded = np.concatenate((buf, np.full(width + 1, 0x20, dtype=np.uint8)))
+    columns = np.arange(width)
+    value_bytes = padded[token_start[:, None] + 1 + columns]
+    in_token = columns < value_len[:, None]
+
+    is_digit = in_token & ((value_bytes - np.uint8(ord('0'))) <= 9) # uint8 wraps below '0'
+    is_dot = in_token & (value_bytes == ord('.'))
+    is_sign = (columns == 0) & ((value_bytes == ord('-')) | (value_bytes == ord('+')))
+    digit_count = is_digit.sum(axis=1)
+    fast_path = ~(in_token & ~(is_digit | is_dot | is_sign)).any(axis=1) & (is_dot.sum(axis=1) <= 1) & \
+                (digit_count >= 1) & (digit_count <= _MAX_FAST_PATH_DIGITS) & (value_len <= width)
+
+    # Horner's scheme column by column; digits after the dot count towards the fraction length
+    digit_values = (value_bytes - np.uint8(ord('0'))).astype(np.float64)
+    mantissa = np.zeros(len(value_len))
+    fraction_digits = np.zeros(len(value_len), dtype=np.intp)
+    seen_dot = np.zeros(len(value_len), dtype=bool)
+    for column in range(width):
+        column_is_digit = is_digit[:, column]
+        mantissa = np.where(column_is_digit, mantissa * 10.0 + digit_values[:, column], mantissa)
+        fraction_digits += column_is_digit & seen_dot
+        seen_dot |= is_dot[:, column]
+    fraction_digits = fraction_digits.clip(0, _MAX_FAST_PATH_DIGITS)
+
+    values = mantissa / _POWERS_OF_TEN[fraction_digits] # Both exact, so the division is correctly rounded
+    negative = value_bytes[:, 0] == ord('-') if width else np.zeros(len(values), dtype=bool)
+    values[negative] = -values[negative]
+
+    valid = fast_path.copy()
+    for token_idx in np.flatnonzero(~fast_path).tolist(): # Rare: defer to float() for exact semantics
+        try:
+            values[token_idx] = float(data[token_start[token_idx] + 1:token_end[token_idx]])
+            valid[token_idx] = True
+        except ValueError:
+            pass
+
+    token_line, letter, values = token_line[valid], letter[valid], values[valid]
+    for param_letter in MOVE_PARAM_LETTERS:
+        selected = letter == ord(param_letter)
+        lines_for_letter = token_line[selected]
+        if len(lines_for_letter) == 0:
+            continue
+        last_in_line = np.append(lines_for_letter[1:] != lines_for_letter[:-1], True)
+        params[param_letter][lines_for_letter[last_in_line]] = values[selected][last_in_line]
+        present[param_letter][lines_for_letter] = True
+
+    return kinds, command_kinds, params, present
+
+
+def _forward_fill(values, present):
+    """For each position, the value at the latest position <= it where `present` is True (NaN if none)."""
+    source_idx = np.where(present, np.arange(len(values)), -1)
+    np.maximum.accumulate(source_idx, out=source_idx)
+    filled = values[np.maximum(source_idx, 0)]
+    filled[source_idx < 0] = np.nan
+    return filled
+
 
 class GCodeParser:
-    def __init__(self):
-        pass
+    def __init__(self, batch_tokenizer=True, batch_serializer=True):
+        """
+        :param batch_tokenizer: If True, layers are parsed with the vectorized batch tokenizer
+                                (_parse_lines_to_columns_batch) instead of the line-by-line loop.
+        :param batch_serializer: If True, layers are written back to G-code from their move columns in one
+                                 vectorized step (_gcode_layer_to_lines_batch) instead of move by move.
+        """
+        self.batch_tokenizer = batch_tokenizer
+        self.batch_serializer = batch_serializer
 
     def remove_thumbnails(self, lines):
         """Removes thumbnail sections from G-code lines."""
         cleaned = []
         skip = False
         for line in lines:
-            line_stripped = line.strip()
-            if 'thumbnail_QOI begin' in line_stripped or 'thumbnail begin' in line_stripped:
-                skip = True
-                continue
-            if 'thumbnail_QOI end' in line_stripped or 'thumbnail end' in line_stripped:
-                skip = False
+            marker = _thumbnail_marker(line)
+            if marker is not None:
+                skip = marker == 'begin'
                 continue
             if not skip:
                 cleaned.append(line)
         return cleaned
 
-    def parse_document_to_layers(self, cleaned_gcode_lines, gcode_document):
+    def iter_gcode_segments(self, lines):
         """
-        Parses cleaned G-code lines, populates the GCodeDocument with GCodeLayer objects,
-        and stores the start indices of these layers.
-        Non-layer lines (header, footer, lines between layers) remain in GCodeDocument.cleaned_lines.
+        Single pass over G-code lines (any iterable, e.g. an open text file) that drops thumbnail blocks and
+        splits the remaining lines at ';LAYER_CHANGE' lines, yielding each segment as soon as it is complete:
+        ('header', lines) for the lines before the first layer, then ('layer', lines) for every layer, each
+        starting with its ';LAYER_CHANGE' line. The footer is part of the last layer. Without any ';LAYER_CHANGE',
+        all lines form a single layer (and nothing is yielded for an empty file).
         """
+        skip = False
+        segment = []
+        in_layers = False
+        for line in lines:
+            marker = _thumbnail_marker(line)
+            if marker is not None:
+                skip = marker == 'begin'
+                continue
+            if skip:
+                continue
+            if ';LAYER_CHANGE' in line and line.strip() == ';LAYER_CHANGE':
+                yield ('layer' if in_layers else 'header'), segment
+                segment = []
+                in_layers = True
+            segment.append(line)
+        if in_layers or segment:
+            yield 'layer', segment
+
+    def index_gcode_bytes(self, buffer):
+        """
+        Scans raw G-code bytes (e.g. an mmap) for thumbnail blocks and ';LAYER_CHANGE' lines without
+        decoding or splitting the file into lines.
+        Follows the same rules as remove_thumbnails and parse_document_to_layers.
+        Returns (thumbnail_byte_ranges, layer_start_offsets): thumbnail ranges are (start, end) byte offsets
+        covering whole lines, layer starts are the offsets of each ';LAYER_CHANGE' line outside a thumbnail.
+        """
+        size = len(buffer)
+
+        def line_bounds(pos):
+            line_start = buffer.rfind(b'\n', 0, pos) + 1
+            line_end = buffer.find(b'\n', pos)
+            return line_start, (size if line_end == -1 else line_end + 1)
+
+        thumbnail_ranges = []
+        block_start = None # Start offset of the thumbnail block currently being skipped
+        pos = buffer.find(b'thumbnail')
+        while pos != -1:
+            line_start, line_end = line_bounds(pos)
+            line = buffer[line_start:line_end]
+            if b'thumbnail_QOI begin' in line or b'thumbnail begin' in line:
+                if block_start is None:
+                    block_start = line_start
+            elif b'thumbnail_QOI end' in line or b'thumbnail end' in line:
+                # An end marker outside a block is dropped on its own, like in remove_thumbnails
+                thumbnail_ranges.append((line_start if block_start is None else block_start, line_end))
+                block_start = None
+            pos = buffer.find(b'thumbnail', line_end)
+        if block_start is not None: # Unterminated thumbnail block runs to the end of the file
+            thumbnail_ranges.append((block_start, size))
+
+        layer_starts = []
+        thumbnail_idx = 0
+        pos = buffer.find(b';LAYER_CHANGE')
+        while pos != -1:
+            line_start, line_end = line_bounds(pos)
+            while thumbnail_idx < len(thumbnail_ranges) and thumbnail_ranges[thumbnail_idx][1] <= line_start:
+                thumbnail_idx += 1
+            in_thumbnail = thumbnail_idx < len(thumbnail_ranges) and thumbnail_ranges[thumbnail_idx][0] <= line_start
+            if not in_thumbnail and buffer[line_start:line_end].strip() == b';LAYER_CHANGE':
+                layer_starts.append(line_start)
+            pos = buffer.find(b';LAYER_CHANGE', line_end)
+
+        return thumbnail_ranges, layer_starts
+
+    def parse_mapped_document_to_layers(self, gcode_document, lazy=False):
+        """
+        Memory-mapped counterpart of parse_document_to_layers.
+        Indexes gcode_document.source by byte offset and populates the document's layers,
+        layer_byte_ranges and thumbnail_byte_ranges. Layer text is decoded from the source only
+        when a layer's original_lines are first accessed.
+        """
+        source = gcode_document.source
+        thumbnail_ranges, layer_starts = self.index_gcode_bytes(source.buffer)
+        source.excluded_byte_ranges = thumbnail_ranges
+
+        gcode_document.thumbnail_byte_ranges = thumbnail_ranges
+        if layer_starts:
+            layer_ends = layer_starts[1:] + [source.size]
+            gcode_document.layer_byte_ranges = list(zip(layer_starts, layer_ends))
+        elif sum(end - start for start, end in thumbnail_ranges) < source.size:
+            # No ';LAYER_CHANGE' found, treat entire file as one layer
+            gcode_document.layer_byte_ranges = [(0, source.size)]
+        else: # Nothing left once thumbnails are removed
+            gcode_document.layer_byte_ranges = []
+
+        self.build_mapped_layers(gcode_document, lazy=lazy)
+
+    def build_mapped_layers(self, gcode_document, lazy=False):
+        """
+        Creates the GCodeLayer objects of a memory-mapped document from its (already known) layer_byte_ranges,
+        e.g. ones computed by parse_mapped_document_to_layers or restored from a parse cache.
+        """
+        source = gcode_document.source
         gcode_document.layers = []
-        gcode_document.layer_indices_in_cleaned_lines = []
+        layer_parser = self._parse_layer_lines_to_columns if lazy else None
+        for layer_counter_in_doc, byte_range in enumerate(gcode_document.layer_byte_ranges):
+            layer_obj = GCodeLayer(layer_index_in_document=layer_counter_in_doc,
+                                   layer_parser=layer_parser, source=source, byte_range=byte_range)
+            if not lazy:
+                self._parse_layer_lines_to_columns(layer_obj)
+            gcode_document.add_layer(layer_obj)
 
-        current_layer_original_lines = []
-        layer_counter_in_doc = 0 # This will be the index in GCodeDocument.layers
+    def parse_document_to_layers(self, cleaned_gcode_lines, gcode_document, lazy=False):
+        """
+        Parses cleaned G-code lines, populates the GCodeDocument with GCodeLayer objects,
+        and stores the start indices of these layers.
+        The lines before the first layer are kept in GCodeDocument.header_lines.
 
-        # Initial pass to find all ;LAYER_CHANGE markers and segment the document
-        # This simplified approach assumes layers are contiguous blocks starting with ;LAYER_CHANGE
-        # or the whole file is one layer if no such markers.
+        If `lazy` is True, only the layer boundaries are recorded here; each GCodeLayer parses its
+        original_lines into items the first time its `items` are accessed.
+        """
+        self.parse_line_stream_to_layers(cleaned_gcode_lines, gcode_document, lazy=lazy)
 
-        last_layer_change_idx = -1
-        for i, line_text in enumerate(cleaned_gcode_lines):
-            line_strip = line_text.strip()
-            if line_strip == ';LAYER_CHANGE':
-                if last_layer_change_idx != -1: # Found a previous layer change, so current_layer_original_lines is for that layer
-                    # The lines from last_layer_change_idx up to i-1 form a layer's content.
-                    # The GCodeLayer object should store its lines *including* its initial ';LAYER_CHANGE'
-                    layer_obj = GCodeLayer(layer_index_in_document=layer_counter_in_doc,
-                                           original_lines=cleaned_gcode_lines[last_layer_change_idx:i])
-                    self._parse_layer_lines_to_items(layer_obj)
-                    gcode_document.add_layer(layer_obj)
-                    gcode_document.layer_indices_in_cleaned_lines.append(last_layer_change_idx)
-                    layer_counter_in_doc += 1
-                last_layer_change_idx = i # Current ';LAYER_CHANGE' is the start of a new layer segment
-
-        # Handle the last layer segment (after the final ';LAYER_CHANGE' or if no ';LAYER_CHANGE' at all)
-        if last_layer_change_idx != -1: # If there was at least one ';LAYER_CHANGE'
-            # Content from the last ';LAYER_CHANGE' to the end of the file
-            layer_obj = GCodeLayer(layer_index_in_document=layer_counter_in_doc,
-                                   original_lines=cleaned_gcode_lines[last_layer_change_idx:])
-            self._parse_layer_lines_to_items(layer_obj)
-            gcode_document.add_layer(layer_obj)
-            gcode_document.layer_indices_in_cleaned_lines.append(last_layer_change_idx)
-        elif cleaned_gcode_lines: # No ';LAYER_CHANGE' found, treat entire file as one layer
-            layer_obj = GCodeLayer(layer_index_in_document=0, original_lines=list(cleaned_gcode_lines))
-            self._parse_layer_lines_to_items(layer_obj)
-            gcode_document.add_layer(layer_obj)
-            gcode_document.layer_indices_in_cleaned_lines.append(0) # Starts at line 0
+    def parse_line_stream_to_layers(self, lines, gcode_document, lazy=False):
+        """
+        Builds the document's header_lines and layers in one streaming pass over `lines` (e.g. an open text file),
+        dropping thumbnail blocks on the way (see iter_gcode_segments). Only the current segment is buffered,
+        so no full-file list of lines is created.
+        """
+        gcode_document.layers = []
+        gcode_document.header_lines = []
+        gcode_document.layer_indices_in_cleaned_lines = []
 
-        # `gcode_document.cleaned_lines` remains the full list of lines.
-        # `gcode_document.layers` contains GCodeLayer objects, each with their `original_lines` subset.
-        # `gcode_document.layer_indices_in_cleaned_lines` marks where each layer starts in `cleaned_lines`.
+        layer_parser = self._parse_layer_lines_to_columns if lazy else None
+        line_count = 0 # Lines seen so far, i.e. each layer's start index in the cleaned lines
+        for kind, segment in self.iter_gcode_segments(lines):
+            if kind == 'header':
+                gcode_document.header_lines = segment
+            else:
+                layer_obj = GCodeLayer(layer_index_in_document=gcode_document.layer_count,
+                                       original_lines=segment, layer_parser=layer_parser)
+                if not lazy:
+                    self._parse_layer_lines_to_columns(layer_obj)
+                gcode_document.add_layer(layer_obj)
+                gcode_document.layer_indices_in_cleaned_lines.append(line_count)
+            line_count += len(segment)
 
     def _parse_layer_lines_to_items(self, gcode_layer):
         """
         Parses the original_lines of a GCodeLayer into a list of items (Move objects or string lines).
         Populates gcode_layer.items.
         """
-        gcode_layer.items = []
+        self._parse_layer_lines_to_columns(gcode_layer)
+        gcode_layer.items # Materializes Move objects from the parsed columns
+
+    def _parse_layer_lines_to_columns(self, gcode_layer):
+        """Parses the original_lines of a GCodeLayer and sets gcode_layer.columns."""
+        gcode_layer.columns = self.parse_lines_to_columns(gcode_layer.original_lines)
+
+    def parse_lines_to_columns(self, layer_lines):
+        """
+        Parses a layer's lines into a LayerMoveColumns: moves (G0-G3 lines with a known X/Y) go into the
+        move arrays, every other line into the non-move table with its position in the item sequence.
+        """
+        if self.batch_tokenizer:
+            return self._parse_lines_to_columns_batch(layer_lines)
+        return self._parse_lines_to_columns_loop(layer_lines)
+
+    def _parse_lines_to_columns_batch(self, layer_lines):
+        """
+        Vectorized equivalent of _parse_lines_to_columns_loop for all of a layer's lines at once.
+        Lines are classified and the X/Y/Z/E/F/I/J parameters of every move line extracted in one pass
+        over the layer's bytes, and the carried-over coordinates, extrusion amounts and ';TYPE:' state
+        are computed with forward-fills over NumPy arrays (see _tokenize_layer).
+        Falls back to the loop for layers with non-ASCII move lines.
+        """
+        line_count = len(layer_lines)
+        if line_count == 0:
+            return self._parse_lines_to_columns_loop(layer_lines)
+        tokenized = _tokenize_layer([line.strip() for line in layer_lines])
+        if tokenized is None:
+            return self._parse_lines_to_columns_loop(layer_lines)
+        kinds, command_kinds, params, present = tokenized
+
+        # Work on the G0-G3 move candidates only
+        candidate_line_idx = np.flatnonzero(kinds == LINE_MOVE_CANDIDATE)
+        candidate_count = len(candidate_line_idx)
+        command_kinds = command_kinds[candidate_line_idx]
+        params = {letter: values[candidate_line_idx] for letter, values in params.items()}
+        present = {letter: flags[candidate_line_idx] for letter, flags in present.items()}
+
+        has_xyz = present['X'] | present['Y'] | present['Z']
+        has_e = present['E']
+
+        # G0/G1 lines without X/Y/Z/E are plain lines. The first move is the first remaining line with both
+        # X and Y; from then on every remaining candidate is a move (X and Y are always known).
+        eligible = ~((command_kinds >= 0) & ~has_xyz & ~has_e)
+        first_move = np.flatnonzero(eligible & present['X'] & present['Y'])
+        is_move = eligible.copy()
+        is_move[:first_move[0] if len(first_move) else candidate_count] = False
+        move_candidates = np.flatnonzero(is_move)
+
+        # Absolute coordinates carried over from the previous move for axes a line does not specify
+        move_x = _forward_fill(params['X'][move_candidates], present['X'][move_candidates])
+        move_y = _forward_fill(params['Y'][move_candidates], present['Y'][move_candidates])
+        move_z = _forward_fill(params['Z'][move_candidates], present['Z'][move_candidates])
+        move_has_e = has_e[move_candidates]
+        move_e = _forward_fill(params['E'][move_candidates], move_has_e)
+
+        previous_e = np.concatenate(([np.nan], move_e[:-1]))
+        extrusion = np.where(move_has_e, np.where(np.isnan(previous_e), move_e, move_e - previous_e), 0.0)
+        is_travel = (command_kinds[move_candidates] == 1) | \
+                    (has_xyz[move_candidates] & (np.abs(extrusion) < SIGNIFICANT_EXTRUSION_THRESHOLD))
+
+        # ';TYPE:' state: a type comment applies to the next move unless any other non-empty line comes first
+        type_line_idx = np.flatnonzero(kinds == LINE_TYPE_COMMENT)
+        type_events = np.full(line_count, MOVE_TYPES.NO_TYPE, dtype=np.int16)
+        type_events[type_line_idx] = [MOVE_TYPES.code_for_type_comment(layer_lines[i]) for i in type_line_idx.tolist()]
+        has_event = kinds != LINE_EMPTY
+        active_type = _forward_fill(type_events.astype(np.float64), has_event)
+        move_line_idx = candidate_line_idx[move_candidates]
+        type_before_move = np.nan_to_num(active_type[move_line_idx - 1], nan=MOVE_TYPES.NO_TYPE)
+        type_before_move[move_line_idx == 0] = MOVE_TYPES.NO_TYPE
+        move_type_codes = np.where(is_travel, MOVE_TYPES.code('travel'), type_before_move).astype(np.int16)
+
+        # Every line is one item, so a non-move line's item position is its line index
+        is_text_line = np.ones(line_count, dtype=bool)
+        is_text_line[move_line_idx] = False
+        text_line_idx = np.flatnonzero(is_text_line)
+        return LayerMoveColumns(move_x, move_y, move_z, move_e, move_type_codes, move_line_idx,
+                                text_line_idx, text_line_idx)
+
+    def _parse_lines_to_columns_loop(self, layer_lines):
+        """Line-by-line tokenizer, kept as the reference implementation for the batch tokenizer."""
+        move_x, move_y, move_z, move_e, move_type_codes, move_line_indices = [], [], [], [], [], []
+        text_positions, text_line_indices = [], []
+        nan = float('nan')
+        travel_code = MOVE_TYPES.code('travel')
+
+        def add_text_item(line_idx):
+            text_positions.append(len(text_positions) + len(move_x))
+            text_line_indices.append(line_idx)
+
         x = y = z = e = None  # Current absolute coordinates
         last_x = last_y = last_z = last_e = None # Last coordinates *on a move line*
 
         # Relative extrusion state (G91 E) is not handled here, assuming absolute (G90 E)
         # PrusaSlicer uses absolute E by default.
 
-        current_type_comment_line = None # Stores the most recent ';TYPE:...' line encountered
+        current_type_code = MOVE_TYPES.NO_TYPE # Type code of the most recent ';TYPE:...' line encountered
 
-        for line_idx, line_text in enumerate(gcode_layer.original_lines):
+        for line_idx, line_text in enumerate(layer_lines):
             line_strip = line_text.strip()
 
             if not line_strip: # Empty line
-                gcode_layer.add_item(line_text) # Preserve empty lines
+                add_text_item(line_idx) # Preserve empty lines
                 continue
 
             if line_strip.startswith(';TYPE:'):
-                current_type_comment_line = line_text # Store it, will be added before the next G1 move
-                gcode_layer.add_item(line_text) # Add ;TYPE comment as a string item itself
+                current_type_code = MOVE_TYPES.code_for_type_comment(line_text) # Interned once, applies to the next G1 move
+                add_text_item(line_idx) # Add ;TYPE comment as a string item itself
                 continue
 
             # For other comments or M-codes, G-codes not G0-G3: add as string item
@@ -102,8 +451,8 @@ class GCodeParser:
                line_strip.startswith('G28') or \
                line_strip.startswith('G90') or line_strip.startswith('G91') or \
                line_strip.startswith('G92'): # Add more non-move G-codes as needed
-                gcode_layer.add_item(line_text)
-                current_type_comment_line = None # Reset type comment if a non-G1/G0 command appears
+                add_text_item(line_idx)
+                current_type_code = MOVE_TYPES.NO_TYPE # Reset type comment if a non-G1/G0 command appears
                 continue
 
             # Attempt to parse G0, G1, G2, G3 as moves
@@ -140,8 +489,8 @@ class GCodeParser:
 
                 # If it's just G0/G1 without parameters, or only F/S, it's not a spatial move.
                 if not has_xyz_change and not has_e_change and cmd in ('G0','G1','G00','G01'):
-                    gcode_layer.add_item(line_text) # Add as a string item
-                    current_type_comment_line = None
+                    add_text_item(line_idx) # Add as a string item
+                    current_type_code = MOVE_TYPES.NO_TYPE
                     continue
 
                 # Determine current absolute coordinates for the move
@@ -153,11 +502,8 @@ class GCodeParser:
 
                 # Determine move type (e.g., 'travel' or from ';TYPE:' comment)
                 # This logic is from the original GCodeEditor.parse_moves and Layer3DViewer.parse_moves
-                move_type_str = None
-                if current_type_comment_line:
-                    # Extract type from comment like ";TYPE:External perimeter"
-                    type_from_comment = current_type_comment_line.strip()[6:].lower() # Get "external perimeter"
-                    move_type_str = type_from_comment
+                # The type from a comment like ";TYPE:External perimeter" ("external perimeter") is already interned
+                move_type_code = current_type_code
 
                 # Override with 'travel' if it's a non-extruding move (G0 or G1 with no E change or E reset)
                 # A G0 command is typically always travel, regardless of E.
@@ -176,24 +522,23 @@ class GCodeParser:
                 significant_extrusion_threshold = 1e-5 # 0.00001 mm
 
                 if is_explicit_travel_cmd:
-                    move_type_str = 'travel'
+                    move_type_code = travel_code
                 elif abs(extrusion_this_move) < significant_extrusion_threshold and has_xyz_change : # G1, E not changed much or not present, but XYZ changed
-                    move_type_str = 'travel'
+                    move_type_code = travel_code
                 elif not has_e_change and last_e is None and has_xyz_change: # No E ever seen, G1 with XYZ change
-                    move_type_str = 'travel'
+                    move_type_code = travel_code
 
 
                 # Create Move object
                 # A "move" for visualization typically requires X or Y to change.
                 # Z-only or E-only moves are also valid G-code but might be treated differently by visualizers.
                 if current_x is not None and current_y is not None: # Requires at least X and Y to be defined
-                    move_obj = Move(
-                        x=current_x, y=current_y, z=current_z, e=current_e,
-                        move_type=move_type_str,
-                        original_line_index=line_idx,
-                        preceding_comment=current_type_comment_line if move_type_str and move_type_str != 'travel' else None
-                    )
-                    gcode_layer.add_item(move_obj)
+                    move_x.append(current_x)
+                    move_y.append(current_y)
+                    move_z.append(nan if current_z is None else current_z)
+                    move_e.append(nan if current_e is None else current_e)
+                    move_type_codes.append(move_type_code)
+                    move_line_indices.append(line_idx)
 
                     # Update last known absolute coordinates for next iteration
                     if move_params['x'] is not None: last_x = current_x
@@ -201,88 +546,242 @@ class GCodeParser:
                     if move_params['z'] is not None: last_z = current_z
                     if move_params['e'] is not None: last_e = current_e
 
-                    current_type_comment_line = None # Consume the type comment
+                    current_type_code = MOVE_TYPES.NO_TYPE # Consume the type comment
                 else:
                     # Not considered a plottable XY move (e.g., G1 Z5 only, or G1 E10 only without prior X,Y)
                     # Add as a string item. This might need refinement.
-                    gcode_layer.add_item(line_text)
-                    current_type_comment_line = None
+                    add_text_item(line_idx)
+                    current_type_code = MOVE_TYPES.NO_TYPE
 
             else: # Line is not a G0-G3, comment, M-code, etc. (should be rare for valid G-code)
-                gcode_layer.add_item(line_text) # Treat as a non-move line
-                current_type_comment_line = None
+                add_text_item(line_idx) # Treat as a non-move line
+                current_type_code = MOVE_TYPES.NO_TYPE
 
-        # After parsing all lines, gcode_layer.items is populated.
+        return LayerMoveColumns(move_x, move_y, move_z, move_e, move_type_codes, move_line_indices,
+                                text_positions, text_line_indices)
 
     def gcode_layer_to_lines(self, gcode_layer):
         """
         Converts a GCodeLayer object's items (Move objects and strings) back into a list of G-code line strings.
+        When the items are a piece table over the layer's original lines, the unchanged runs are copied from
+        original_lines as they are and only the items inserted by edits are formatted.
+        """
+        if gcode_layer.has_items and isinstance(gcode_layer.items, ItemPieceTable) and gcode_layer.items.lines_backed:
+            return self._piece_table_to_lines(gcode_layer)
+        if self.batch_serializer:
+            return self._gcode_layer_to_lines_batch(gcode_layer)
+        return self._gcode_layer_to_lines_loop(gcode_layer)
+
+    def _piece_table_to_lines(self, gcode_layer):
+        """
+        gcode_layer_to_lines for a layer whose items are a lines-backed ItemPieceTable. Original lines are copied
+        as they are, except the first move after added or deleted items: its line may leave out axes that an
+        edited line set, so it is written from its Move, with every axis. The E value formatted moves compare
+        against is the last one set, whether by a formatted move, an original line or a G92.
+        """
+        table = gcode_layer.items
+        original_lines = gcode_layer.read_original_lines()
+        output_lines = []
+        last_e_written = None
+        next_original = 0 # The original item the output has reached without an edit in between
+        for buffer, start, end in table.pieces():
+            if buffer is table.original:
+                if start != next_original:
+                    lines = self._resumed_original_lines(table.original, original_lines, start, end, last_e_written)
+                else:
+                    lines = original_lines[start:end]
+                next_original = end
+                last_e_written = self._last_e_set_by_lines(lines, last_e_written)
+            else:
+                added_items = buffer[start:end]
+                if self.batch_serializer:
+                    lines, last_e_written = self._columns_to_lines(LayerMoveColumns.from_items(added_items), None,
+                                                                   last_e_written)
+                else:
+                    lines, last_e_written = self._items_to_lines_loop(added_items, last_e_written)
+                last_e_written = self._last_e_set_by_lines(lines, last_e_written) # For added G92 lines
+                next_original = -1
+            output_lines.extend(lines)
+        return output_lines
+
+    def _resumed_original_lines(self, original_items, original_lines, start, end, last_e_written):
+        """
+        original_lines[start:end] after an edit, with the first move written from its Move (which carries every
+        axis forward) instead of copied. Its feedrate is kept, since the lines after it rely on it.
+        """
+        lines = []
+        for i in range(start, end):
+            item = original_items[i]
+            if not isinstance(item, Move):
+                lines.append(original_lines[i])
+                continue
+            move_dict = item.to_dict()
+            move_line = self._format_move_as_gcode_line(
+                move_dict, self._last_e_set_by_lines(lines, last_e_written))
+            if move_line is not None:
+                code = original_lines[i].split(';', 1)[0]
+                feedrate = [word for word in code.split() if word[:1] in ('F', 'f')]
+                if feedrate:
+                    move_line = '%s F%s\n' % (move_line[:-1], feedrate[-1][1:])
+                if original_lines[i].endswith('\r\n'):
+                    move_line = move_line[:-1] + '\r\n'
+                lines.append(move_line)
+            lines.extend(original_lines[i + 1:end])
+            break
+        return lines
+
+    @staticmethod
+    def _last_e_set_by_lines(lines, last_e_written):
+        """
+        The E position after `lines`: the E of the last move line or G92 that sets it (else last_e_written).
+        The parser carries raw E values and leaves G92 lines as text, so after a "G92 E0" the next E written is
+        compared against 0.
         """
+        for line in reversed(lines):
+            words = line.split(';', 1)[0].split()
+            if not words or words[0].upper() not in _E_SETTING_COMMANDS:
+                continue
+            for word in words[1:]:
+                if word[:1] in ('E', 'e'):
+                    try:
+                        return float(word[1:])
+                    except ValueError:
+                        break
+        return last_e_written
+
+    @staticmethod
+    def start_z_of_lines(lines):
+        """
+        The Z height set by a layer's lines before its first move (which the parser keeps as text lines):
+        the last Z of a G0/G1 line, else the slicer's ';Z:' comment. None if neither is there.
+        """
+        comment_z = None
+        for line in reversed(lines):
+            line_strip = line.strip()
+            if line_strip.startswith(('G0', 'G1')):
+                for word in line_strip.split(';', 1)[0].split()[1:]:
+                    if word[:1] in ('Z', 'z'):
+                        try:
+                            return float(word[1:])
+                        except ValueError:
+                            break
+            elif comment_z is None and line_strip.startswith(';Z:'):
+                try:
+                    comment_z = float(line_strip[3:])
+                except ValueError:
+                    pass
+        return comment_z
+
+    def _gcode_layer_to_lines_batch(self, gcode_layer):
+        """
+        Vectorized gcode_layer_to_lines: works on the layer's LayerMoveColumns (built from its items, or the parsed
+        columns if no items were built), decides which moves write E with array masks, and formats all move lines
+        of the layer with a single %-format call, which gives the same text as formatting each value separately.
+        """
+        return self._columns_to_lines(gcode_layer.columns, gcode_layer, None)[0]
+
+    def _columns_to_lines(self, columns, gcode_layer, last_e_written):
+        """
+        Formats LayerMoveColumns as G-code lines, starting from `last_e_written` (None at the start of a layer).
+        Returns (lines, last E value written). Text read from the file is looked up in gcode_layer.original_lines.
+        """
+        if columns is None or columns.item_count == 0:
+            return [], last_e_written
+
+        has_x, has_y, has_z, has_e = (~np.isnan(v) for v in (columns.x, columns.y, columns.z, columns.e))
+        writes_e = np.zeros(columns.move_count, dtype=bool)
+        e_candidates = np.flatnonzero(has_e & (columns.type_code != MOVE_TYPES.code('travel')))
+        e_values = columns.e[e_candidates]
+        if last_e_written is None:
+            writes_e[e_candidates] = self._e_write_mask(e_values)
+        else: # The mask always writes its first value, so start it with the value already written
+            writes_e[e_candidates] = self._e_write_mask(np.concatenate(([last_e_written], e_values)))[1:]
+        written_e = np.flatnonzero(writes_e)
+        if len(written_e):
+            last_e_written = float(columns.e[written_e[-1]])
+
+        line_format = has_x * 1 + has_y * 2 + has_z * 4 + writes_e * 8
+        emitted = line_format > 0 # A bare "G1" is left out
+        values = np.column_stack((columns.x, columns.y, columns.z, columns.e))[emitted]
+        written = np.column_stack((has_x, has_y, has_z, writes_e))[emitted]
+        move_text = ''.join(_MOVE_LINE_FORMATS[line_format[emitted]].tolist()) % tuple(values[written].tolist())
+
+        if columns.text_lines is not None:
+            text_lines = columns.text_lines
+        else:
+            original_lines = gcode_layer.original_lines
+            text_lines = [original_lines[i] for i in columns.text_line_indices.tolist()]
+
+        output_lines = np.empty(columns.item_count, dtype=object)
+        output_lines[columns.text_positions] = text_lines
+        move_positions = columns.move_item_positions()
+        output_lines[move_positions[emitted]] = move_text.splitlines(True)
+        keep = np.ones(columns.item_count, dtype=bool)
+        keep[move_positions[~emitted]] = False
+        return output_lines[keep].tolist(), last_e_written
+
+    @staticmethod
+    def _e_write_mask(e_values):
+        """
+        For the E values of consecutive non-travel moves, returns which ones get written: an E is written unless
+        it is within 1e-5 of the last E that was written. Comparing each value with its predecessor is exact as
+        long as the predecessor was written, so only the stretches after a skipped value are walked in Python.
+        """
+        writes = np.ones(len(e_values), dtype=bool)
+        writes[1:] = np.abs(np.diff(e_values)) > 1e-5
+        walked_to = 0
+        for skipped in np.flatnonzero(~writes).tolist():
+            if skipped < walked_to:
+                continue
+            last_written = e_values[skipped - 1]
+            pos = skipped
+            while pos < len(e_values) and abs(e_values[pos] - last_written) <= 1e-5:
+                writes[pos] = False
+                pos += 1
+            if pos < len(e_values):
+                writes[pos] = True
+            walked_to = pos + 1
+        return writes
+
+    def _gcode_layer_to_lines_loop(self, gcode_layer):
+        """Move-by-move gcode_layer_to_lines, the reference for the batch serializer."""
+        return self._items_to_lines_loop(gcode_layer.items, None)[0]
+
+    def _items_to_lines_loop(self, items, last_e_val_written_to_gcode):
+        """Formats items one by one, starting from the last E value written (None at the start of a layer)."""
         output_lines = []
-        last_e_val_written_to_gcode = None # Tracks the E value of the last G1 line that had an E parameter
 
-        for item in gcode_layer.items:
+        for item in items:
             if isinstance(item, str):
                 output_lines.append(item) # Assumes item includes newline if it's a full line
             elif isinstance(item, Move):
                 move_dict = item.to_dict() # Convert Move object to dictionary for processing
-
-                # Reconstruct the G-code line from the Move object
-                # This needs to handle whether to write X, Y, Z, E based on changes from a "previous" state.
-                # However, for saving, we usually write the explicit parameters stored in the Move object.
-                # The main complexity is the E value: only write if different from last written E.
-
-                # Prepend preceding comment if it was stored with the move and not already added as a string item.
-                # The current _parse_layer_lines_to_items adds ;TYPE as string, so this might be redundant
-                # if item.preceding_comment and item.preceding_comment not in output_lines[-1]: # Basic check
-                #    output_lines.append(item.preceding_comment)
-
-                x_str = f"X{move_dict['x']:.3f}" if move_dict['x'] is not None else ''
-                y_str = f"Y{move_dict['y']:.3f}" if move_dict['y'] is not None else ''
-                z_str = f"Z{move_dict['z']:.3f}" if move_dict['z'] is not None else ''
-                e_str = ''
-
-                # Logic for E value from original GCodeEditor.moves_to_gcode
-                if move_dict.get('type') == 'travel':
-                    # For travel moves, no E parameter is written.
-                    # The extruder holds its position from the last extrusion.
-                    # The move_dict['e'] should still reflect this logical extruder position.
-                    pass # e_str remains empty
-                else: # Non-travel (presumably extrusion)
-                    if move_dict['e'] is not None:
-                        current_move_logical_e = move_dict['e']
-                        # Write E only if it's different from the last *written* E value,
-                        # or if no E has been written yet in this sequence of moves.
-                        if last_e_val_written_to_gcode is None or \
-                           abs(current_move_logical_e - last_e_val_written_to_gcode) > 1e-5: # Use tolerance for float comparison
-                            e_str = f"E{current_move_logical_e:.5f}"
-                            last_e_val_written_to_gcode = current_move_logical_e
-                        # If E is same as last written, e_str remains empty (no redundant E parameter)
-                    # If a non-travel move has no 'e' in its dictionary (e.g., a G1 Z-only move without E change),
-                    # e_str remains empty, which is correct.
-
-                # Construct the G-code line. Assume G1 for all moves from Move objects for now.
-                # More sophisticated would be to store original command (G0/G1/G2/G3) in Move object.
-                gline_parts = ["G1"] # Default to G1
-                if x_str: gline_parts.append(x_str)
-                if y_str: gline_parts.append(y_str)
-                if z_str: gline_parts.append(z_str)
-                if e_str: gline_parts.append(e_str)
-
+                gcode_line = self._format_move_as_gcode_line(move_dict, last_e_val_written_to_gcode)
                 # Only add the line if it's more than just "G1" (i.e., it has parameters)
-                if len(gline_parts) > 1:
-                    output_lines.append(" ".join(gline_parts) + '\n')
-                # If the line was just "G1" but it was supposed to be an E-only move where E didn't change,
-                # it's correctly omitted. If it was a travel move with no X,Y,Z change, it's also omitted.
+                if gcode_line is not None:
+                    output_lines.append(gcode_line)
+                e_written = self._e_to_write(move_dict, last_e_val_written_to_gcode)
+                if e_written is not None:
+                    last_e_val_written_to_gcode = e_written
             else:
                 # Unknown item type in gcode_layer.items
                 pass # Or raise error
 
-        return output_lines
+        return output_lines, last_e_val_written_to_gcode
+
+    def _e_to_write(self, move_dict, last_e_written):
+        """
+        Returns the E value a move writes, or None: travel moves write no E (the extruder holds its position),
+        and an E within 1e-5 of the last *written* E value is redundant.
+        """
+        if move_dict.get('type') == 'travel' or move_dict.get('e') is None:
+            return None
+        if last_e_written is None or abs(move_dict['e'] - last_e_written) > 1e-5: # Use tolerance for float comparison
+            return move_dict['e']
+        return None
 
     def _format_move_as_gcode_line(self, move_dict, last_e_written):
         """
-        (This is a helper, similar to logic inside gcode_layer_to_lines, kept for potential direct use if needed)
         Formats a single move dictionary into a G-code line string.
         `move_dict` is like {'x': ..., 'y': ..., 'z': ..., 'e': ..., 'type': ...}
         `last_e_written` is the last E value that was actually written to a G-code line.
@@ -292,13 +791,8 @@ class GCodeParser:
         x_str = f"X{m['x']:.3f}" if 'x' in m and m['x'] is not None else ''
         y_str = f"Y{m['y']:.3f}" if 'y' in m and m['y'] is not None else ''
         z_str = f"Z{m['z']:.3f}" if 'z' in m and m['z'] is not None else ''
-        e_str = ''
-
-        if m.get('type') != 'travel':
-            if 'e' in m and m['e'] is not None:
-                current_move_e_val = m['e']
-                if last_e_written is None or abs(current_move_e_val - last_e_written) > 1e-5:
-                    e_str = f"E{current_move_e_val:.5f}"
+        e_value = self._e_to_write(m, last_e_written)
+        e_str = f"E{e_value:.5f}" if e_value is not None else ''
 
         # Assume G1, original command (G0/G1/G2/G3) could be stored in Move object for more fidelity
         gline_parts = ["G1"]
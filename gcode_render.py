@@ -0,0 +1,606 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from gcode_models import Move, MOVE_TYPES
+
+
+# Dotted segments are drawn as these fractions of the segment (every other tenth of it)
+DASH_STARTS = np.arange(0, 9, 2) / 10.0
+DASH_ENDS = DASH_STARTS + 0.1
+
+
+class SegmentBatch:
+    """
+    Vertices (pairs, for GL 'lines' mode) and per-vertex colors of all segments drawn with one line style,
+    in path order, so drawing only the first vertex_count(n) vertices shows the path up to segment n.
+    """
+    def __init__(self, positions, colors, width, antialias, translucent, segment_indices, lines_per_segment=1):
+        self.positions = positions # (2k, 3) float32
+        self.colors = colors # (2k, 4) float32
+        self.width = width
+        self.antialias = antialias
+        self.translucent = translucent
+        self.segment_indices = segment_indices # Path segment number of each of the batch's segments (ascending)
+        self.lines_per_segment = lines_per_segment # Lines drawn per path segment (dashes for dotted styles)
+
+    @property
+    def segment_count(self):
+        return len(self.positions) // 2
+
+    def vertex_count(self, path_segment_count):
+        """Number of vertices to draw to show the first `path_segment_count` segments of the path."""
+        segments = int(np.searchsorted(self.segment_indices, path_segment_count))
+        return 2 * self.lines_per_segment * segments
+
+
+def build_segment_batches(points, type_codes, style_for_type, segment_mask=None, include_dotted=True):
+    """
+    Groups the segments of a toolpath by line style, so the whole path can be drawn with one GL item per style
+    instead of one per segment. Segment i joins points[i - 1] to points[i] and is styled after type_codes[i].
+    `style_for_type(move type name)` returns (color, width, antialias, is_dotted), as
+    Layer3DViewerDialog._get_segment_style_for_type does; dotted segments become dashes in their batch's buffer.
+    `segment_mask` (one bool per segment, i.e. len(points) - 1) leaves out the segments where it is False,
+    and include_dotted=False leaves out the dotted styles (travel).
+    Returns a list of SegmentBatch.
+    """
+    if len(points) < 2:
+        return []
+    starts = np.asarray(points[:-1], dtype=np.float32)
+    ends = np.asarray(points[1:], dtype=np.float32)
+    # Styles per type code, looked up with code + 1 so NO_TYPE (-1) is entry 0
+    type_styles = [style_for_type(MOVE_TYPES.name(code)) for code in range(-1, len(MOVE_TYPES.names))]
+    style_keys = sorted({(width, antialias, is_dotted) for _, width, antialias, is_dotted in type_styles})
+    style_of_code = np.array([style_keys.index((w, a, d)) for _, w, a, d in type_styles], dtype=np.int16)
+    color_of_code = np.array([color for color, _, _, _ in type_styles], dtype=np.float32)
+    segment_codes = np.asarray(type_codes[1:], dtype=np.int16) + 1
+    segment_styles = style_of_code[segment_codes]
+    if segment_mask is not None:
+        segment_styles = np.where(segment_mask, segment_styles, -1)
+
+    batches = []
+    for style_no, (width, antialias, is_dotted) in enumerate(style_keys):
+        if is_dotted and not include_dotted:
+            continue
+        selected = np.flatnonzero(segment_styles == style_no)
+        if not len(selected):
+            continue
+        seg_starts, seg_ends = starts[selected], ends[selected]
+        seg_colors = color_of_code[segment_codes[selected]]
+        lines_per_segment = len(DASH_STARTS) if is_dotted else 1
+        if is_dotted:
+            deltas = (seg_ends - seg_starts)[:, None, :]
+            dash_starts = seg_starts[:, None, :] + deltas * DASH_STARTS[None, :, None].astype(np.float32)
+            dash_ends = seg_starts[:, None, :] + deltas * DASH_ENDS[None, :, None].astype(np.float32)
+            seg_starts, seg_ends = dash_starts.reshape(-1, 3), dash_ends.reshape(-1, 3)
+            seg_colors = np.repeat(seg_colors, len(DASH_STARTS), axis=0)
+        positions = np.empty((2 * len(seg_starts), 3), dtype=np.float32)
+        positions[0::2] = seg_starts
+        positions[1::2] = seg_ends
+        colors = np.repeat(seg_colors, 2, axis=0)
+        batches.append(SegmentBatch(positions, colors, width, antialias, is_dotted, selected, lines_per_segment))
+    return batches
+
+
+def splice_segment_batches(batches, first_segment, old_segment_stop, new_segment_stop, rebuilt):
+    """
+    The style batches of a path whose segments [first_segment, old_segment_stop) were replaced by the segments
+    numbered [first_segment, new_segment_stop) in the new path. `rebuilt` are the build_segment_batches of the
+    new segments, numbered from 0. A batch the edit does not touch keeps its vertex and color arrays (only its
+    segment numbers are shifted), so a viewer can tell which batches to upload again.
+    """
+    shift = new_segment_stop - old_segment_stop
+    rebuilt_by_style = {(b.width, b.antialias, b.translucent): b for b in rebuilt}
+    spliced = []
+    for batch in batches:
+        replacement = rebuilt_by_style.pop((batch.width, batch.antialias, batch.translucent), None)
+        low, high = np.searchsorted(batch.segment_indices, (first_segment, old_segment_stop)).tolist()
+        segment_indices = batch.segment_indices.copy()
+        segment_indices[high:] += shift
+        if replacement is None and low == high:
+            spliced.append(SegmentBatch(batch.positions, batch.colors, batch.width, batch.antialias, batch.translucent,
+                                        segment_indices, batch.lines_per_segment))
+            continue
+        vertices = 2 * batch.lines_per_segment
+        new_positions = replacement.positions if replacement is not None else batch.positions[:0]
+        new_colors = replacement.colors if replacement is not None else batch.colors[:0]
+        new_indices = replacement.segment_indices + first_segment if replacement is not None else segment_indices[:0]
+        segment_indices = np.concatenate((segment_indices[:low], new_indices, segment_indices[high:]))
+        if not len(segment_indices):
+            continue # Like build_segment_batches, no empty batches
+        spliced.append(SegmentBatch(
+            np.concatenate((batch.positions[:low * vertices], new_positions, batch.positions[high * vertices:])),
+            np.concatenate((batch.colors[:low * vertices], new_colors, batch.colors[high * vertices:])),
+            batch.width, batch.antialias, batch.translucent, segment_indices, batch.lines_per_segment))
+    for batch in rebuilt_by_style.values(): # Styles the path did not have before
+        batch.segment_indices = batch.segment_indices + first_segment
+        spliced.append(batch)
+    spliced.sort(key=lambda b: (b.width, b.antialias, b.translucent)) # The order build_segment_batches uses
+    return spliced
+
+
+# Stacked (multi-layer) previews
+
+def forward_filled_positions(positions, start_position=None):
+    """
+    The tool position after each move: coordinates a move does not set (NaN) are carried over from the
+    moves before it, or from `start_position` (e.g. where the previous layer ended). Coordinates never set
+    stay NaN.
+    """
+    filled = np.asarray(positions, dtype=np.float64)
+    if start_position is not None:
+        filled = np.vstack((np.asarray(start_position, dtype=np.float64)[None, :], filled))
+    # For every entry, the row of the last move (up to it) that set the coordinate
+    set_rows = np.where(np.isnan(filled), 0, np.arange(len(filled))[:, None])
+    np.maximum.accumulate(set_rows, axis=0, out=set_rows)
+    filled = filled[set_rows, np.arange(filled.shape[1])]
+    return filled[1:] if start_position is not None else filled
+
+
+def decimate_path(type_codes, max_points):
+    """
+    Indices of the points to keep to draw a path with about `max_points` points: every k-th point, the
+    last one, and the points on both sides of every move type change (so segments keep their styles).
+    """
+    count = len(type_codes)
+    if max_points is None or count <= max_points:
+        return np.arange(count)
+    keep = np.zeros(count, dtype=bool)
+    keep[::-(-count // max(max_points, 2))] = True
+    keep[-1] = True
+    changes = np.flatnonzero(type_codes[1:] != type_codes[:-1]) + 1
+    keep[changes] = True
+    keep[changes - 1] = True
+    return np.flatnonzero(keep)
+
+
+class StackLevelOfDetail:
+    """
+    Level of detail of a stacked preview: the layers within `detail_radius` of the focus layer (e.g. the
+    top of the range being inspected) are drawn in full, the others with at most an equal share of
+    `total_points` (and no fewer than `min_layer_points`), so dense or distant layers are decimated.
+    """
+    def __init__(self, focus_layer, layer_count, detail_radius=2, total_points=2000000, min_layer_points=200):
+        self.focus_layer = focus_layer
+        self.detail_radius = detail_radius
+        self.far_layer_points = max(min_layer_points, total_points // max(layer_count, 1))
+
+    def max_points(self, layer_idx):
+        """Point budget of a layer (None for full detail)."""
+        if abs(layer_idx - self.focus_layer) <= self.detail_radius:
+            return None
+        return self.far_layer_points
+
+
+def build_stack_chunk(layer_paths, style_for_type, include_dotted=False):
+    """
+    Combined style batches for a chunk of layers, `layer_paths` being each layer's (points, type codes).
+    Layers are not joined to each other, and travel is left out unless `include_dotted`.
+    """
+    layer_paths = [(points, codes) for points, codes in layer_paths if len(points)]
+    if not layer_paths:
+        return []
+    points = np.concatenate([points for points, _ in layer_paths])
+    type_codes = np.concatenate([codes for _, codes in layer_paths])
+    segment_mask = np.ones(max(len(points) - 1, 0), dtype=bool)
+    layer_starts = np.cumsum([len(p) for p, _ in layer_paths])[:-1]
+    segment_mask[layer_starts - 1] = False # The segments from one layer's last point to the next layer's first
+    return build_segment_batches(points, type_codes, style_for_type, segment_mask, include_dotted)
+
+
+# Levels of detail of the viewer's toolpath: the Douglas-Peucker tolerance of each level, in mm.
+# Level 0 is the full path; the viewer picks the coarsest level whose tolerance stays under half a pixel.
+LEVEL_TOLERANCES = (0.0, 0.02, 0.08, 0.3, 1.2)
+
+
+def level_for_pixel_size(pixel_size):
+    """The coarsest level of LEVEL_TOLERANCES that is not visible at `pixel_size` mm per pixel."""
+    level_no = 0
+    for i, tolerance in enumerate(LEVEL_TOLERANCES):
+        if tolerance <= pixel_size / 2:
+            level_no = i
+    return level_no
+
+
+MIDPOINT_SPLIT_MIN_POINTS = 64
+
+
+def simplify_path(points, type_codes, tolerance):
+    """
+    Indices of the points a Douglas-Peucker simplification of the path keeps, with every point within
+    `tolerance` of the simplified path. The path is simplified per move type run (points on both sides of
+    a type change are always kept), so each simplified segment keeps its style.
+    All ranges still to split are processed together, one recursion level per NumPy pass (so the result can
+    keep a few more points than the classic recursive algorithm, see MIDPOINT_SPLIT_MIN_POINTS).
+    """
+    count = len(points)
+    if count < 3 or tolerance <= 0:
+        return np.arange(count)
+    points = np.asarray(points, dtype=np.float64)
+    keep = np.zeros(count, dtype=bool)
+    keep[[0, -1]] = True
+    changes = np.flatnonzero(type_codes[1:] != type_codes[:-1]) + 1
+    keep[changes] = True
+    keep[changes - 1] = True
+    anchors = np.flatnonzero(keep)
+    starts, ends = anchors[:-1], anchors[1:]
+    max_distance_sq = tolerance * tolerance
+
+    while True:
+        has_interior = ends - starts > 1
+        starts, ends = starts[has_interior], ends[has_interior]
+        if not len(starts):
+            break
+        # The interior points of every range, flattened, with the range each belongs to
+        interior_counts = ends - starts - 1
+        range_offsets = np.cumsum(interior_counts) - interior_counts
+        range_of_point = np.repeat(np.arange(len(starts)), interior_counts)
+        point_idx = starts[range_of_point] + 1 + (np.arange(len(range_of_point)) - range_offsets[range_of_point])
+        # Squared distance of each interior point to its range's chord
+        chord_start = points[starts][range_of_point]
+        chord = points[ends][range_of_point] - chord_start
+        to_point = points[point_idx] - chord_start
+        chord_length_sq = (chord * chord).sum(axis=1)
+        along = np.clip((to_point * chord).sum(axis=1) / np.where(chord_length_sq > 0, chord_length_sq, 1.0), 0.0, 1.0)
+        offset = to_point - along[:, None] * chord
+        distance_sq = (offset * offset).sum(axis=1)
+        # Split each range whose farthest point is out of tolerance at that point
+        range_max = np.maximum.reduceat(distance_sq, range_offsets)
+        farthest = np.flatnonzero(distance_sq == range_max[range_of_point])
+        farthest = farthest[np.r_[True, range_of_point[farthest[1:]] != range_of_point[farthest[:-1]]]]
+        split = range_max > max_distance_sq
+        starts, ends, split_idx = starts[split], ends[split], point_idx[farthest[split]]
+        # Long ranges are also split in the middle, so there are about log(n) passes even where the farthest
+        # points fall near the ends (e.g. long smooth curves); this only adds points in ranges already split
+        mid_idx = np.where(ends - starts > MIDPOINT_SPLIT_MIN_POINTS, (starts + ends) // 2, split_idx)
+        low_idx, high_idx = np.minimum(split_idx, mid_idx), np.maximum(split_idx, mid_idx)
+        keep[low_idx] = True
+        keep[high_idx] = True
+        starts, ends = np.concatenate((starts, low_idx, high_idx)), np.concatenate((low_idx, high_idx, ends))
+    return np.flatnonzero(keep)
+
+
+class RenderLevel:
+    """One level of detail of a layer's toolpath: the plotted points it keeps (None for all) and their style batches."""
+    def __init__(self, tolerance, kept, batches):
+        self.tolerance = tolerance
+        self.kept = kept
+        self.batches = batches
+
+    def points_shown(self, point_count):
+        """Number of this level's points among the path's first `point_count` points."""
+        if self.kept is None:
+            return point_count
+        return int(np.searchsorted(self.kept, point_count))
+
+    @property
+    def nbytes(self):
+        total = 0 if self.kept is None else self.kept.nbytes
+        return total + sum(b.positions.nbytes + b.colors.nbytes + b.segment_indices.nbytes for b in self.batches)
+
+
+class LayerRenderData:
+    """
+    Everything the 3D viewer draws a layer from, prepared ahead of time: the layer's move columns (for the
+    viewer's MoveDisplayBuffer and ItemMoveIndex), the plotted points (moves that set X, Y and Z) and their
+    type codes, the number of plotted points among the first n moves, the style batches and the points' bounds.
+    Simplified levels of detail (see LEVEL_TOLERANCES) are built the first time they are asked for, and
+    kept with the data.
+    `items` can hold the layer's items built ahead of time for a layer that was not opened yet, until it is.
+    """
+    ITEM_BYTES = 200 # Rough size of one prefetched item (a Move with its slots), for the render cache's budget
+
+    def __init__(self, columns, points, valid_points_before, batches, type_codes=None, style_for_type=None,
+                 bounds=None, center=None):
+        self.columns = columns # May be None for data prepared from an edited display buffer
+        self.items = None
+        self.points = points
+        self.valid_points_before = valid_points_before
+        self.batches = batches
+        self.type_codes = type_codes
+        self.style_for_type = style_for_type
+        self._levels = {0: RenderLevel(0.0, None, batches)}
+        if not len(points):
+            self.bounds = self.center = None
+        elif bounds is not None: # Worked out by the caller (see spliced())
+            self.bounds, self.center = bounds, center
+        else:
+            self.bounds = (points.min(axis=0), points.max(axis=0))
+            self.center = points.mean(axis=0)
+
+    def level(self, level_no):
+        """
+        The RenderLevel for LEVEL_TOLERANCES[level_no], simplified on first use. Each level is simplified
+        from the points of the level below it, which is much faster than from the full path; as tolerances
+        grow fourfold per level, points stay within 1.34 times the level's tolerance of its path.
+        """
+        if level_no not in self._levels:
+            if self.type_codes is None:
+                return self._levels[0]
+            finer = self.level(level_no - 1)
+            finer_kept = np.arange(len(self.points)) if finer.kept is None else finer.kept
+            tolerance = LEVEL_TOLERANCES[level_no]
+            kept = finer_kept[simplify_path(self.points[finer_kept], self.type_codes[finer_kept], tolerance)]
+            batches = build_segment_batches(self.points[kept], self.type_codes[kept], self.style_for_type)
+            self._levels[level_no] = RenderLevel(tolerance, kept, batches)
+        return self._levels[level_no]
+
+    def build_levels(self):
+        """Builds every level of detail up front (e.g. on a background thread)."""
+        for level_no in range(1, len(LEVEL_TOLERANCES)):
+            self.level(level_no)
+
+    def spliced(self, start, old_stop, positions, type_codes):
+        """
+        The LayerRenderData of the layer after its moves [start, old_stop) were replaced by moves with `positions`
+        and `type_codes`, made by patching this data's points and style batches around the edit instead of
+        preparing the whole layer again (see splice_segment_batches). The levels of detail built so far are
+        patched too, by simplifying the path again only around the edit. This data is left as it is.
+        """
+        valid_mask = ~np.isnan(positions).any(axis=1)
+        first_point = int(self.valid_points_before[start])
+        old_point_stop = int(self.valid_points_before[old_stop])
+        new_point_stop = first_point + int(valid_mask.sum())
+        points = np.concatenate((self.points[:first_point], positions[valid_mask], self.points[old_point_stop:]))
+        point_type_codes = np.concatenate((self.type_codes[:first_point], type_codes[valid_mask],
+                                           self.type_codes[old_point_stop:]))
+        valid_points_before = np.concatenate((self.valid_points_before[:start + 1], first_point + np.cumsum(valid_mask),
+                                              self.valid_points_before[old_stop + 1:] + (new_point_stop - old_point_stop)))
+
+        # Segment j joins points j and j + 1, so the segments ending at or starting from a replaced point are rebuilt
+        first_segment = max(first_point - 1, 0)
+        old_segment_stop = max(min(old_point_stop, len(self.points) - 1), first_segment)
+        new_segment_stop = max(min(new_point_stop, len(points) - 1), first_segment)
+        rebuilt = build_segment_batches(points[first_segment:new_segment_stop + 1],
+                                        point_type_codes[first_segment:new_segment_stop + 1], self.style_for_type)
+        batches = splice_segment_batches(self.level(0).batches, first_segment, old_segment_stop, new_segment_stop, rebuilt)
+
+        # The bounds and center follow from the points removed and added, unless a removed point was on the bounds
+        bounds = center = None
+        removed, added = self.points[first_point:old_point_stop], points[first_point:new_point_stop]
+        if len(points) and self.bounds is not None and \
+                ((removed > self.bounds[0]).all() and (removed < self.bounds[1]).all()):
+            bounds = self.bounds
+            if len(added):
+                bounds = (np.minimum(bounds[0], added.min(axis=0)), np.maximum(bounds[1], added.max(axis=0)))
+            center = (self.center * len(self.points) - removed.sum(axis=0) + added.sum(axis=0)) / len(points)
+        data = LayerRenderData(None, points, valid_points_before, batches, point_type_codes, self.style_for_type,
+                               bounds, center)
+        if len(self.points) and len(points):
+            for level_no in range(1, len(LEVEL_TOLERANCES)):
+                if level_no not in self._levels:
+                    break # Levels are built coarser one at a time, so the next ones are not built either
+                data._levels[level_no] = data._spliced_level(self._levels[level_no], data._levels[level_no - 1],
+                                                             first_point, old_point_stop, new_point_stop)
+        return data
+
+    def _spliced_level(self, level, finer, first_point, old_point_stop, new_point_stop):
+        """
+        `level` (a level of detail of the data this one was spliced from) for this data's points, where the old
+        points [first_point, old_point_stop) are now [first_point, new_point_stop). The last kept point before
+        the edit and the first one after it stay kept, and the path between them is simplified again from
+        `finer` (this data's level below), as level() would.
+        """
+        kept = level.kept
+        before = int(np.searchsorted(kept, first_point)) # kept[:before] are before the edit
+        after = int(np.searchsorted(kept, old_point_stop)) # kept[after:] are after it
+        shift = new_point_stop - old_point_stop
+        window_first = max(before - 1, 0) # Position in `kept` of the window's first point
+        window_start = int(kept[window_first]) if before else 0
+        window_stop = int(kept[after]) + shift if after < len(kept) else len(self.points) - 1
+        old_window_last = min(after, len(kept) - 1)
+
+        finer_kept = np.arange(len(self.points)) if finer.kept is None else finer.kept
+        low, high = np.searchsorted(finer_kept, (window_start, window_stop + 1)).tolist()
+        window = finer_kept[low:high]
+        window_kept = window[simplify_path(self.points[window], self.type_codes[window], level.tolerance)]
+        new_kept = np.concatenate((kept[:window_first], window_kept, kept[old_window_last + 1:] + shift))
+
+        # Segment j of the level joins its kept points j and j + 1
+        rebuilt = build_segment_batches(self.points[window_kept], self.type_codes[window_kept], self.style_for_type)
+        batches = splice_segment_batches(level.batches, window_first, old_window_last,
+                                         window_first + len(window_kept) - 1, rebuilt)
+        return RenderLevel(level.tolerance, new_kept, batches)
+
+    @property
+    def nbytes(self):
+        total = self.points.nbytes + self.valid_points_before.nbytes + sum(l.nbytes for l in self._levels.values())
+        if self.type_codes is not None:
+            total += self.type_codes.nbytes
+        if self.columns is not None:
+            total += self.columns.nbytes
+        if self.items is not None:
+            total += len(self.items) * self.ITEM_BYTES
+        return total
+
+
+def prepare_layer_render(positions, type_codes, style_for_type, columns=None):
+    """
+    Builds LayerRenderData from move positions ((N, 3), NaN where a move does not set an axis) and type codes.
+    Pure NumPy, so it can run on a background thread.
+    """
+    valid_mask = ~np.isnan(positions).any(axis=1)
+    points = positions[valid_mask]
+    valid_points_before = np.concatenate(([0], np.cumsum(valid_mask)))
+    point_type_codes = type_codes[valid_mask]
+    batches = build_segment_batches(points, point_type_codes, style_for_type)
+    return LayerRenderData(columns, points, valid_points_before, batches, point_type_codes, style_for_type)
+
+
+def prepare_layer_render_from_columns(columns, style_for_type):
+    return prepare_layer_render(columns.positions(), columns.type_code, style_for_type, columns=columns)
+
+
+class LayerRenderCache:
+    """
+    LRU cache of LayerRenderData per document layer, within a memory budget (`max_bytes`); the least
+    recently used layers are dropped first, but the newest entry is always kept. Entries are measured
+    when the cache is added to, so levels of detail built in the meantime count from then on.
+    Each entry is stored with a `token` naming the content it was prepared from (the layer's pending
+    edited items, or None for the layer as parsed), and is only returned for the same token.
+    Not thread-safe: it is meant to be used from the GUI thread, with background threads handing
+    prepared data over to it.
+    """
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # Layer index -> (token, LayerRenderData), least recently used first
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, layer_idx):
+        return layer_idx in self._entries
+
+    @property
+    def total_bytes(self):
+        return sum(data.nbytes for _, data in self._entries.values())
+
+    def get(self, layer_idx, token=None):
+        entry = self._entries.get(layer_idx)
+        if entry is None or entry[0] is not token:
+            return None
+        self._entries.move_to_end(layer_idx)
+        return entry[1]
+
+    def put(self, layer_idx, data, token=None):
+        self._entries.pop(layer_idx, None)
+        self._entries[layer_idx] = (token, data)
+        total_bytes = self.total_bytes
+        while total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            total_bytes -= evicted.nbytes
+
+    def discard(self, layer_idx):
+        self._entries.pop(layer_idx, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class MoveDisplayBuffer:
+    """
+    The plotted moves of the layer being viewed: X/Y/Z positions (NaN where a move does not set an axis)
+    and MOVE_TYPES codes, in arrays with spare capacity that edits patch in place. Inserting or deleting
+    moves only writes the new entries and shifts the arrays' tail (a memmove), instead of rebuilding the
+    arrays from the items. `version` changes on every edit, for anything cached from the arrays; the moves
+    the last EDIT_HISTORY edits touched are recorded, so what is cached can be patched (see edited_range()).
+    """
+    EDIT_HISTORY = 256
+
+    def __init__(self, columns):
+        count = columns.move_count
+        self._positions = np.empty((self._capacity_for(count), 3), dtype=np.float64)
+        self._type_code = np.empty(len(self._positions), dtype=np.int16)
+        self._positions[:count] = columns.positions()
+        self._type_code[:count] = columns.type_code
+        self.move_count = count
+        self.version = 0
+        self._edits = [] # (version, start, old stop, new stop) of the recent edits
+
+    @staticmethod
+    def _capacity_for(count):
+        return max(64, count + count // 4)
+
+    def positions(self):
+        """(move_count, 3) view of the move positions."""
+        return self._positions[:self.move_count]
+
+    @property
+    def type_code(self):
+        return self._type_code[:self.move_count]
+
+    def _reserve(self, count):
+        if count <= len(self._positions):
+            return
+        capacity = self._capacity_for(count)
+        positions = np.empty((capacity, 3), dtype=np.float64)
+        type_code = np.empty(capacity, dtype=np.int16)
+        positions[:self.move_count] = self._positions[:self.move_count]
+        type_code[:self.move_count] = self._type_code[:self.move_count]
+        self._positions, self._type_code = positions, type_code
+
+    def insert_moves(self, move_idx, moves):
+        """Inserts Move objects so that the first one becomes move number `move_idx`."""
+        added = len(moves)
+        if not added:
+            return
+        self._reserve(self.move_count + added)
+        end = self.move_count
+        self._positions[move_idx + added:end + added] = self._positions[move_idx:end]
+        self._type_code[move_idx + added:end + added] = self._type_code[move_idx:end]
+        nan = float('nan')
+        self._positions[move_idx:move_idx + added] = [(nan if m.x is None else m.x,
+                                                       nan if m.y is None else m.y,
+                                                       nan if m.z is None else m.z) for m in moves]
+        self._type_code[move_idx:move_idx + added] = [m.type_code for m in moves]
+        self.move_count += added
+        self._record_edit(move_idx, move_idx, move_idx + added)
+
+    def delete_moves(self, move_idx, count=1):
+        """Removes `count` moves starting at move number `move_idx`."""
+        end = self.move_count
+        self._positions[move_idx:end - count] = self._positions[move_idx + count:end]
+        self._type_code[move_idx:end - count] = self._type_code[move_idx + count:end]
+        self.move_count -= count
+        self._record_edit(move_idx, move_idx + count, move_idx)
+
+    def set_move(self, move_idx, move):
+        """Overwrites move number `move_idx` with a Move object's position and type."""
+        nan = float('nan')
+        self._positions[move_idx] = (nan if move.x is None else move.x, nan if move.y is None else move.y,
+                                     nan if move.z is None else move.z)
+        self._type_code[move_idx] = move.type_code
+        self._record_edit(move_idx, move_idx + 1, move_idx + 1)
+
+    def _record_edit(self, start, old_stop, new_stop):
+        self.version += 1
+        self._edits.append((self.version, start, old_stop, new_stop))
+        if len(self._edits) > self.EDIT_HISTORY:
+            del self._edits[:-self.EDIT_HISTORY]
+
+    def edited_range(self, since_version):
+        """
+        (start, old stop, new stop) such that the moves [start, old stop) as of `since_version` are now the moves
+        [start, new stop), covering every edit made since then. None if there were no edits since, or if they
+        are no longer all recorded.
+        """
+        edits = [edit for edit in self._edits if edit[0] > since_version]
+        if not edits or len(edits) != self.version - since_version:
+            return None
+        _, start, _, stop = edits[0]
+        moved = edits[0][3] - edits[0][2]
+        for _, edit_start, edit_old_stop, edit_new_stop in edits[1:]:
+            shift = edit_new_stop - edit_old_stop
+            # Where the range's ends are after this edit: ends inside the replaced moves go to its edges
+            if start > edit_start:
+                start = start + shift if start >= edit_old_stop else edit_start
+            if stop > edit_start:
+                stop = stop + shift if stop >= edit_old_stop else edit_new_stop
+            start, stop = min(start, edit_start), max(stop, edit_new_stop)
+            moved += shift
+        return start, stop - moved, stop
+
+    def apply_item_changes(self, changes, move_index):
+        """
+        Patches the buffer (and `move_index`, the ItemMoveIndex of the same items) for the ('insert', item
+        index, item) / ('delete', item index, None) changes reported by an edit command, in order.
+        A move deleted and a move inserted at the same index (a replaced move) is overwritten in place.
+        """
+        i = 0
+        while i < len(changes):
+            op, item_idx, item = changes[i]
+            i += 1
+            move_idx = move_index.moves_before(item_idx)
+            if op == 'insert':
+                is_move = isinstance(item, Move)
+                move_index.insert(item_idx, is_move)
+                if is_move:
+                    self.insert_moves(move_idx, [item])
+            elif i < len(changes) and changes[i][:2] == ('insert', item_idx) and \
+                    isinstance(changes[i][2], Move) and move_index.is_move(item_idx):
+                self.set_move(move_idx, changes[i][2])
+                i += 1 # The insert is handled with this delete
+            elif move_index.delete(item_idx):
+                self.delete_moves(move_idx)
@@ -0,0 +1,159 @@
+from abc import ABC, abstractmethod
+
+from gcode_models import Move
+
+
+class EditCommand(ABC):
+    """
+    A reversible edit of a layer's items list (Move objects and strings).
+    Commands hold only the items they add, remove or replace (references, not copies), so an undo history
+    costs memory in proportion to the edits, not to the size of the layer.
+
+    apply() and revert() return the primitive changes they made, in order, as ('insert', index, item) and
+    ('delete', index, None) tuples, so they can be mirrored elsewhere (e.g. into the EditJournal).
+    `context` is free for the caller, e.g. to restore editor state on undo/redo.
+    """
+    def __init__(self):
+        self.context = None
+
+    @abstractmethod
+    def apply(self, items):
+        """Makes the edit on `items`. Returns the primitive changes."""
+
+    @abstractmethod
+    def revert(self, items):
+        """Undoes apply() on `items`. Returns the primitive changes."""
+
+
+class InsertItemsCommand(EditCommand):
+    """Inserts `new_items` before item `index`."""
+    def __init__(self, index, new_items):
+        super().__init__()
+        self.index = index
+        self.new_items = list(new_items)
+
+    def apply(self, items):
+        items[self.index:self.index] = self.new_items
+        return [('insert', self.index + i, item) for i, item in enumerate(self.new_items)]
+
+    def revert(self, items):
+        del items[self.index:self.index + len(self.new_items)]
+        return [('delete', self.index, None)] * len(self.new_items)
+
+
+class DeleteItemsCommand(EditCommand):
+    """Removes `count` items starting at item `index` (remembering them for undo)."""
+    def __init__(self, index, count=1):
+        super().__init__()
+        self.index = index
+        self.count = count
+        self.removed_items = None
+
+    def apply(self, items):
+        self.removed_items = items[self.index:self.index + self.count]
+        del items[self.index:self.index + self.count]
+        return [('delete', self.index, None)] * len(self.removed_items)
+
+    def revert(self, items):
+        items[self.index:self.index] = self.removed_items
+        return [('insert', self.index + i, item) for i, item in enumerate(self.removed_items)]
+
+
+class ReplaceItemsCommand(EditCommand):
+    """
+    Replaces items in place: `replacements` maps item indices to new items. Moves are never changed in place
+    (other lists, e.g. applied edits and older undo steps, may share them), so moving a point means replacing
+    its Move with a new one; see translate_moves().
+    """
+    def __init__(self, replacements):
+        super().__init__()
+        self.replacements = dict(replacements)
+        self.replaced_items = None
+
+    def apply(self, items):
+        self.replaced_items = {i: items[i] for i in self.replacements}
+        return self._put(items, self.replacements)
+
+    def revert(self, items):
+        return self._put(items, self.replaced_items)
+
+    @staticmethod
+    def _put(items, new_items_by_index):
+        changes = []
+        for i in sorted(new_items_by_index):
+            items[i] = new_items_by_index[i]
+            changes.append(('delete', i, None))
+            changes.append(('insert', i, items[i]))
+        return changes
+
+    @staticmethod
+    def _moved(move, x, y, z):
+        return Move.from_type_code(x, y, z, move.e, move.type_code, move.original_line_index, move.preceding_comment)
+
+    @classmethod
+    def translate_moves(cls, items, item_indices, dx=0.0, dy=0.0, dz=0.0):
+        """Command shifting the Moves at `item_indices` by (dx, dy, dz); coordinates a move does not set stay unset."""
+        replacements = {}
+        for i in item_indices:
+            move = items[i]
+            if isinstance(move, Move):
+                replacements[i] = cls._moved(move,
+                                             None if move.x is None else move.x + dx,
+                                             None if move.y is None else move.y + dy,
+                                             None if move.z is None else move.z + dz)
+        return cls(replacements)
+
+
+class UndoStack:
+    """
+    Linear undo/redo history of EditCommands for one items list. Pushing a command applies it and drops the
+    redo history. With `max_depth`, the oldest commands are forgotten once the history grows beyond it.
+    """
+    def __init__(self, max_depth=None):
+        self.max_depth = max_depth
+        self._done = []
+        self._undone = []
+
+    @property
+    def can_undo(self):
+        return bool(self._done)
+
+    @property
+    def can_redo(self):
+        return bool(self._undone)
+
+    @property
+    def last_command(self):
+        """The command the next undo() would revert, or None."""
+        return self._done[-1] if self._done else None
+
+    def push(self, command, items):
+        """Applies `command` to `items` and records it. Returns the changes it made."""
+        changes = command.apply(items)
+        self._done.append(command)
+        self._undone = []
+        if self.max_depth is not None and len(self._done) > self.max_depth:
+            del self._done[0]
+        return changes
+
+    def undo(self, items):
+        """Reverts the last command. Returns (command, changes), or (None, []) if there is nothing to undo."""
+        if not self._done:
+            return None, []
+        command = self._done.pop()
+        changes = command.revert(items)
+        self._undone.append(command)
+        return command, changes
+
+    def redo(self, items):
+        """Re-applies the last undone command. Returns (command, changes), or (None, []) if there is none."""
+        if not self._undone:
+            return None, []
+        command = self._undone.pop()
+        changes = command.apply(items)
+        self._done.append(command)
+        return command, changes
+
+    def clear(self):
+        self._done = []
+        self._undone = []
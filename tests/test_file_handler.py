@@ -0,0 +1,109 @@
+import gzip
+import lzma
+import os
+
+import numpy as np
+import pytest
+
+from gcode_file_handler import GCodeFileHandler
+from gcode_parser import GCodeParser
+
+from test_parser import COLUMN_NAMES, dump_items
+
+
+def write_layers(path, layer_count=12, moves_per_layer=40):
+    lines = ['; generated\n', 'G28\n', 'G90\n', 'M82\n']
+    e = 0.0
+    for layer_no in range(layer_count):
+        z = 0.2 * (layer_no + 1)
+        lines += [';LAYER_CHANGE\n', f';Z:{z:.1f}\n', f'G1 X0 Y0 Z{z:.3f} F9000\n']
+        for i in range(moves_per_layer):
+            if i % 10 == 0:
+                # A type only some layers have, so each worker process numbers the types differently
+                lines.append(';TYPE:Perimeter\n' if i % 20 or layer_no % 3 else f';TYPE:Layer {layer_no} type\n')
+            e += 0.05
+            lines.append(f'G1 X{10 + i:.3f} Y{10 + (i * 7) % 13:.3f} E{e:.5f}\n')
+    path.write_text(''.join(lines))
+    return path
+
+
+class PoolRecordingHandler(GCodeFileHandler):
+    PARALLEL_MIN_BYTES = 0 # Small test files go to the pool too
+    pool_layer_count = 0
+
+    def _parse_layers_in_pool(self, doc, layers, workers):
+        self.pool_layer_count += len(layers)
+        super()._parse_layers_in_pool(doc, layers, workers)
+
+
+def test_pool_parse_matches_serial_parse(tmp_path):
+    path = str(write_layers(tmp_path / 'part.gcode'))
+    serial = GCodeFileHandler(GCodeParser(), lazy_layers=False).load_gcode_file(path)
+    pooled_handler = PoolRecordingHandler(GCodeParser(), lazy_layers=False, parallel_workers=2)
+    pooled = pooled_handler.load_gcode_file(path)
+    assert pooled_handler.pool_layer_count == serial.layer_count
+    for serial_layer, pooled_layer in zip(serial.layers, pooled.layers):
+        assert pooled_layer.is_parsed
+        for name in COLUMN_NAMES:
+            if name != 'type_code': # Compared by type name through the items
+                np.testing.assert_array_equal(getattr(pooled_layer.columns, name),
+                                              getattr(serial_layer.columns, name), err_msg=name)
+        assert dump_items(pooled_layer.items) == dump_items(serial_layer.items)
+    serial.close()
+    pooled.close()
+
+
+def test_streamed_cleaned_lines_are_the_file(tmp_path):
+    path = write_layers(tmp_path / 'part.gcode', layer_count=3)
+    document = GCodeFileHandler(GCodeParser(), use_mmap=False).load_gcode_file(str(path))
+    assert ''.join(document.cleaned_lines) == path.read_text()
+    assert ''.join(document.cleaned_lines) == path.read_text() # A new iterator on every access
+
+
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.xz': lzma.open}
+
+
+def write_file(path, data):
+    with COMPRESSED_OPENERS.get(path.suffix, open)(path, 'wb') as file:
+        file.write(data)
+
+
+def read_file(path):
+    with COMPRESSED_OPENERS.get(path.suffix, open)(path, 'rb') as file:
+        return file.read()
+
+
+@pytest.mark.parametrize('suffix', ['', '.gz', '.xz'])
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+@pytest.mark.parametrize('use_mmap', [True, False])
+@pytest.mark.parametrize('lazy_layers', [True, False])
+@pytest.mark.parametrize('edited', [False, True])
+def test_save_round_trips_byte_identical(tmp_path, suffix, newline, use_mmap, lazy_layers, edited):
+    data = write_layers(tmp_path / 'base.gcode', layer_count=4).read_text().replace('\n', newline).encode()
+    path = tmp_path / ('part.gcode' + suffix)
+    write_file(path, data)
+    handler = GCodeFileHandler(GCodeParser(), lazy_layers=lazy_layers, use_mmap=use_mmap)
+    document = handler.load_gcode_file(str(path))
+    if edited: # Items built and written back through the serializer, with nothing changed
+        document.get_layer_by_document_index(1).items
+    saved_path = tmp_path / ('saved.gcode' + suffix)
+    handler.save_gcode_document(document, str(saved_path), edited_layer_indices={1} if edited else None)
+    document.close()
+    assert read_file(saved_path) == data
+
+
+def test_failed_write_keeps_the_original_file(tmp_path, monkeypatch):
+    path = write_layers(tmp_path / 'part.gcode')
+    data = path.read_bytes()
+    handler = GCodeFileHandler(GCodeParser())
+    document = handler.load_gcode_file(str(path))
+    document.get_layer_by_document_index(2).items
+
+    def fail(layer):
+        raise OSError('No space left on device')
+    monkeypatch.setattr(handler.parser, 'gcode_layer_to_lines', fail) # Fails after the first layers are written
+    with pytest.raises(IOError):
+        handler.save_gcode_document(document, str(path), edited_layer_indices={2})
+    document.close()
+    assert path.read_bytes() == data
+    assert os.listdir(tmp_path) == ['part.gcode'] # The temporary file was removed
@@ -0,0 +1,150 @@
+import json
+import os
+
+import pytest
+
+from gcode_file_handler import GCodeFileHandler
+from gcode_journal import EditJournal
+from gcode_models import Move
+from gcode_parser import GCodeParser
+
+
+def write_gcode(path, layer_count=4, moves_per_layer=30):
+    lines = ['; generated\n', 'G28\n', 'M83\n']
+    e = 0.0
+    for layer_no in range(layer_count):
+        z = 0.2 * (layer_no + 1)
+        lines += [';LAYER_CHANGE\n', f';Z:{z:.1f}\n', f'G1 Z{z:.3f} F720\n', ';TYPE:Perimeter\n']
+        for i in range(moves_per_layer):
+            e += 0.05
+            lines.append(f'G1 X{10 + i:.3f} Y{10 + (i * 7) % 13:.3f} Z{z:.3f} E{e:.5f}\n')
+            if i % 10 == 9:
+                lines.append('; a comment\n')
+    path.write_text(''.join(lines))
+    return path
+
+
+def load(path):
+    return GCodeFileHandler(GCodeParser()).load_gcode_file(str(path))
+
+
+def dump(items):
+    return [item.to_dict() if isinstance(item, Move) else item for item in items]
+
+
+def make_move(n):
+    return Move(x=100.0 + n, y=50.0, z=0.2, e=None, move_type='travel')
+
+
+@pytest.fixture
+def gcode_path(tmp_path):
+    return write_gcode(tmp_path / 'part.gcode')
+
+
+def test_no_journal_recovers_nothing(gcode_path, tmp_path):
+    assert EditJournal(str(tmp_path / 'journals')).open(load(gcode_path)) == {}
+
+
+def edit_draft(journal, layer_idx, edits, mirror):
+    """Records `edits` ('insert', index, item) / ('delete', index) on the open draft and on `mirror`."""
+    journal.record_open(layer_idx)
+    for edit in edits:
+        if edit[0] == 'insert':
+            journal.record_insert(edit[1], edit[2])
+            mirror.insert(edit[1], edit[2])
+        else:
+            journal.record_delete(edit[1])
+            del mirror[edit[1]]
+
+
+def crash_and_recover(journal_dir, gcode_path):
+    """Opens the file in a new journal without closing the old one, as after a crash."""
+    return EditJournal(journal_dir).open(load(gcode_path))
+
+
+def test_replays_commits_and_an_unapplied_draft(gcode_path, tmp_path):
+    journal_dir = str(tmp_path / 'journals')
+    document = load(gcode_path)
+    journal = EditJournal(journal_dir)
+    journal.open(document)
+
+    committed = list(document.get_layer_by_document_index(1).items)
+    edit_draft(journal, 1, [('insert', 3, make_move(0)), ('delete', 10), ('insert', 0, '; added\n')], committed)
+    journal.record_layer_items(1, journal.draft_items)
+
+    draft = list(document.get_layer_by_document_index(2).items)
+    edit_draft(journal, 2, [('delete', 0), ('insert', 5, make_move(1))], draft)
+
+    recovered = crash_and_recover(journal_dir, gcode_path)
+    assert sorted(recovered) == [1, 2]
+    assert dump(recovered[1]) == dump(committed)
+    assert dump(recovered[2]) == dump(draft)
+
+
+def test_draft_starts_from_committed_edits(gcode_path, tmp_path):
+    journal_dir = str(tmp_path / 'journals')
+    document = load(gcode_path)
+    journal = EditJournal(journal_dir)
+    journal.open(document)
+    expected = list(document.get_layer_by_document_index(0).items)
+    edit_draft(journal, 0, [('insert', 2, make_move(0))], expected)
+    journal.record_layer_items(0, journal.draft_items)
+    edit_draft(journal, 0, [('insert', 2, make_move(1)), ('delete', 4)], expected)
+    journal.record_layer_items(0, journal.draft_items)
+    assert dump(crash_and_recover(journal_dir, gcode_path)[0]) == dump(expected)
+
+
+def test_compaction_keeps_spans_and_later_records(gcode_path, tmp_path):
+    journal_dir = str(tmp_path / 'journals')
+    document = load(gcode_path)
+    journal = EditJournal(journal_dir, compact_after_records=4)
+    journal.open(document)
+    expected = list(document.get_layer_by_document_index(3).items)
+    edits = [('insert', 5 + 2 * n, make_move(n)) for n in range(6)] + [('delete', 1), ('delete', 20)]
+    edit_draft(journal, 3, edits, expected)
+    journal.record_layer_items(3, journal.draft_items)
+    edit_draft(journal, 3, [('insert', 0, make_move(99))], expected) # Left as a draft after the last compaction
+
+    with open(journal.journal_path, encoding='utf-8') as file:
+        records = [json.loads(line) for line in file]
+    assert records[0]['op'] == 'header'
+    compacted = [record for record in records if record['op'] in ('replace', 'draft')]
+    assert compacted, 'the journal should have been compacted'
+    # Unchanged runs of the parsed items are written as spans, split around the edits
+    assert sum('span' in entry for entry in compacted[0]['items']) >= 3
+    assert len(records) < 1 + len(edits) + 4
+
+    recovered = crash_and_recover(journal_dir, gcode_path)
+    assert dump(recovered[3]) == dump(expected)
+
+
+def test_torn_last_record_is_ignored(gcode_path, tmp_path):
+    journal_dir = str(tmp_path / 'journals')
+    document = load(gcode_path)
+    journal = EditJournal(journal_dir)
+    journal.open(document)
+    expected = list(document.get_layer_by_document_index(1).items)
+    edit_draft(journal, 1, [('insert', 1, make_move(0)), ('delete', 3)], expected)
+    with open(journal.journal_path, 'a', encoding='utf-8') as file:
+        file.write('{"op": "insert", "index": 0, "item": {"te')
+    assert dump(crash_and_recover(journal_dir, gcode_path)[1]) == dump(expected)
+
+
+def test_journal_of_other_file_contents_is_dropped(gcode_path, tmp_path):
+    journal_dir = str(tmp_path / 'journals')
+    journal = EditJournal(journal_dir)
+    journal.open(load(gcode_path))
+    edit_draft(journal, 1, [('delete', 0)], [None])
+    write_gcode(gcode_path, moves_per_layer=31) # The file changed on disk
+    assert crash_and_recover(journal_dir, gcode_path) == {}
+
+
+def test_close_drops_the_draft_and_removes_an_empty_journal(gcode_path, tmp_path):
+    journal_dir = str(tmp_path / 'journals')
+    journal = EditJournal(journal_dir)
+    journal.open(load(gcode_path))
+    edit_draft(journal, 2, [('delete', 0)], [None])
+    path = journal.journal_path
+    journal.close()
+    assert not os.path.exists(path)
+    assert EditJournal(journal_dir).open(load(gcode_path)) == {}
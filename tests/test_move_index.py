@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from gcode_models import ItemMoveIndex, LayerMoveColumns, Move
+
+
+def check_against_flags(index, flags):
+    move_positions = [i for i, flag in enumerate(flags) if flag]
+    assert index.item_count == len(flags) and index.move_count == len(move_positions)
+    assert [index.item_index_of_move(k) for k in range(len(move_positions))] == move_positions
+    assert index.item_index_of_move(len(move_positions)) == -1 and index.item_index_of_move(-1) == -1
+    for item_idx in range(len(flags) + 1):
+        assert index.moves_before(item_idx) == sum(flags[:item_idx])
+    assert [index.is_move(i) for i in range(len(flags))] == [bool(flag) for flag in flags]
+
+
+def test_empty_index():
+    index = ItemMoveIndex(b'')
+    check_against_flags(index, [])
+    index.insert(0, True)
+    check_against_flags(index, [1])
+    assert index.delete(0) is True
+    check_against_flags(index, [])
+
+
+def test_text_only_layer():
+    index = ItemMoveIndex.from_items([';LAYER_CHANGE\n', ';Z:0.2\n', '\n'])
+    check_against_flags(index, [0, 0, 0])
+    assert index.moves_before(3) == 0
+
+
+def test_from_columns_matches_from_items():
+    items = ['G92 E0\n', Move(x=1.0, y=1.0), ';TYPE:Perimeter\n', Move(x=2.0, y=2.0), Move(x=3.0, y=1.0), 'M106\n']
+    columns = LayerMoveColumns.from_items(items)
+    check_against_flags(ItemMoveIndex.from_columns(columns), [0, 1, 0, 1, 1, 0])
+    check_against_flags(ItemMoveIndex.from_items(items), [0, 1, 0, 1, 1, 0])
+
+
+def test_block_splits_and_removals():
+    size = ItemMoveIndex.BLOCK_SIZE
+    flags = [i % 3 != 0 for i in range(3 * size)]
+    index = ItemMoveIndex(bytes(flags))
+    for step in range(3 * size): # Grow one block past 2 * BLOCK_SIZE so it splits
+        index.insert(size + 1, step % 2 == 0)
+        flags.insert(size + 1, step % 2 == 0)
+    check_against_flags(index, flags)
+    while len(flags) > size // 2: # Empty whole blocks from the front
+        assert index.delete(0) == flags.pop(0)
+    check_against_flags(index, flags)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_edits_match_flags(seed):
+    rng = random.Random(seed)
+    flags = [rng.random() < 0.7 for _ in range(rng.randrange(0, 500))]
+    index = ItemMoveIndex(bytes(flags))
+    for step in range(1500):
+        if flags and rng.random() < 0.45:
+            item_idx = rng.randrange(len(flags))
+            assert index.delete(item_idx) == flags.pop(item_idx)
+        else:
+            item_idx = rng.randrange(len(flags) + 1)
+            is_move = rng.random() < 0.7
+            index.insert(item_idx, is_move)
+            flags.insert(item_idx, is_move)
+        if step % 100 == 0:
+            check_against_flags(index, flags)
+    check_against_flags(index, flags)
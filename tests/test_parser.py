@@ -0,0 +1,91 @@
+import random
+
+import numpy as np
+import pytest
+
+from gcode_models import Move
+from gcode_parser import GCodeParser
+
+
+COLUMN_NAMES = ('x', 'y', 'z', 'e', 'type_code', 'line_index', 'text_positions', 'text_line_indices')
+
+
+def dump_items(items):
+    return [item.to_dict() if isinstance(item, Move) else item for item in items]
+
+
+def assert_same_columns(lines):
+    batch = GCodeParser(batch_tokenizer=True).parse_lines_to_columns(lines)
+    loop = GCodeParser(batch_tokenizer=False).parse_lines_to_columns(lines)
+    for name in COLUMN_NAMES:
+        np.testing.assert_array_equal(getattr(batch, name), getattr(loop, name), err_msg=name)
+    assert dump_items(batch.to_items(lines)) == dump_items(loop.to_items(lines))
+    return batch
+
+
+def random_layer(rng, line_count):
+    lines = [';LAYER_CHANGE\n', f';Z:{rng.uniform(0, 50):.2f}\n']
+    e = 0.0
+    for _ in range(line_count):
+        choice = rng.random()
+        if choice < 0.05:
+            lines.append(rng.choice([';TYPE:Perimeter\n', ';TYPE:External perimeter\n', ';TYPE:Solid infill\n',
+                                     ';TYPE:Some new type\n']))
+        elif choice < 0.1:
+            lines.append(rng.choice(['\n', '   \n', '; just a comment\n', 'M106 S255\n', 'G92 E0\n',
+                                     'G1 F1800\n', 'G0\n', 'G1 ; nothing to do\n']))
+        elif choice < 0.2:
+            lines.append(f'G0 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} F9000\n')
+        elif choice < 0.25:
+            lines.append(f'G1 Z{rng.uniform(0, 50):.3f}\n')
+        elif choice < 0.3:
+            lines.append(f'G1 E{rng.uniform(-2, 0):.4f} F2100\n')
+        elif choice < 0.35:
+            lines.append(f'  g1 x{rng.uniform(0, 200):.2f} y{rng.uniform(0, 200):.2f} e{e:.5f}  ; lower case\r\n')
+        elif choice < 0.4:
+            lines.append(f'G2 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} I1.5 J-2 E{e:.5f}\n')
+        else:
+            e += rng.uniform(0, 0.1)
+            lines.append(f'G1 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} E{e:.5f}\n')
+    return lines
+
+
+def test_empty_layer():
+    columns = assert_same_columns([])
+    assert columns.move_count == 0 and columns.item_count == 0
+
+
+def test_comment_only_layer():
+    lines = [';LAYER_CHANGE\n', ';Z:0.4\n', '\n', ';TYPE:Perimeter\n', '; G1 X1 Y1\n']
+    columns = assert_same_columns(lines)
+    assert columns.move_count == 0
+    assert columns.text_line_indices.tolist() == list(range(len(lines)))
+
+
+def test_moves_before_first_xy_are_text():
+    lines = ['G1 Z0.3 F720\n', 'G1 E1.2\n', 'G1 X10 Y10\n', 'G1 Z0.5\n', 'G1 E2\n']
+    columns = assert_same_columns(lines)
+    assert columns.line_index.tolist() == [2, 3, 4]
+    assert columns.z.tolist()[1:] == [0.5, 0.5]
+
+
+def test_type_comment_applies_until_another_line():
+    lines = [';TYPE:Perimeter\n', '\n', 'G1 X1 Y1 E1\n', 'G1 X2 Y2 E2\n',
+             ';TYPE:Solid infill\n', 'M106 S255\n', 'G1 X3 Y3 E3\n']
+    assert_same_columns(lines)
+
+
+@pytest.mark.parametrize('token', ['X1e2', 'X-.5', 'X+3.', 'X12345678901234567.5', 'Xabc', 'X', 'X1.2.3',
+                                   'X--1', 'X0.000000000000000001'])
+def test_unusual_numbers_fall_back_to_float(token):
+    assert_same_columns(['G1 X0 Y0\n', f'G1 {token} Y5 E0.5\n', 'G1 X2 Y2 E1\n'])
+
+
+def test_non_ascii_move_line():
+    assert_same_columns(['G1 X1 Y1 ; ünïcode\n', 'G1 X2 Y2 E1 ; °\n'])
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_layers(seed):
+    rng = random.Random(seed)
+    assert_same_columns(random_layer(rng, rng.randrange(0, 400)))
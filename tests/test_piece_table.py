@@ -0,0 +1,146 @@
+import random
+
+import pytest
+
+from gcode_models import GCodeLayer, ItemPieceTable, LayerMoveColumns, Move
+
+
+def piece_spans(table):
+    return [(buffer is table.original, start, end) for buffer, start, end in table.pieces()]
+
+
+def test_fresh_table_is_one_original_piece():
+    table = ItemPieceTable(list('abcdef'), lines_backed=True)
+    assert list(table) == list('abcdef')
+    assert piece_spans(table) == [(True, 0, 6)]
+
+
+def test_empty_table():
+    table = ItemPieceTable([])
+    assert len(table) == 0 and list(table) == [] and list(table.pieces()) == []
+    table.insert(0, 'x')
+    del table[0]
+    assert list(table) == []
+    with pytest.raises(IndexError):
+        table[0]
+
+
+def test_insert_at_piece_boundary_keeps_original_pieces_whole():
+    table = ItemPieceTable(list('abcdef'))
+    table.insert(0, 'x')
+    table.insert(len(table), 'y')
+    assert list(table) == list('xabcdefy')
+    assert piece_spans(table) == [(False, 0, 1), (True, 0, 6), (False, 1, 2)]
+
+
+def test_insert_mid_piece_splits_it():
+    table = ItemPieceTable(list('abcdef'))
+    table.insert(3, 'x')
+    assert list(table) == list('abcxdef')
+    assert piece_spans(table) == [(True, 0, 3), (False, 0, 1), (True, 3, 6)]
+
+
+def test_typing_extends_the_inserted_run():
+    table = ItemPieceTable(list('abcdef'))
+    for offset, item in enumerate('xyz'):
+        table.insert(3 + offset, item)
+    assert list(table) == list('abcxyzdef')
+    assert piece_spans(table) == [(True, 0, 3), (False, 0, 3), (True, 3, 6)]
+
+
+def test_deletes_trim_or_cut_pieces():
+    table = ItemPieceTable(list('abcdefgh'))
+    del table[0]
+    del table[-1]
+    assert piece_spans(table) == [(True, 1, 7)]
+    del table[2]
+    assert list(table) == list('bcefg')
+    assert piece_spans(table) == [(True, 1, 3), (True, 4, 7)]
+    del table[1:4]
+    assert list(table) == list('bg')
+
+
+def test_copies_and_slices_are_independent():
+    table = ItemPieceTable(list('abcdef'))
+    table.insert(2, 'x')
+    copy = table.copy()
+    part = table[1:5]
+    copy.insert(3, 'c1')
+    table.insert(3, 't1')
+    part.insert(0, 'p1')
+    assert list(table) == list('abx') + ['t1'] + list('cdef')
+    assert list(copy) == list('abx') + ['c1'] + list('cdef')
+    assert list(part) == ['p1'] + list('bxcd')
+
+
+def test_setitem_splices_original_runs_back():
+    table = ItemPieceTable(list('abcdef'), lines_backed=True)
+    saved = table[1:4]
+    del table[1:4]
+    table.insert(1, 'x')
+    table[1:2] = saved
+    assert list(table) == list('abcdef')
+    assert all(is_original for is_original, _, _ in piece_spans(table))
+
+
+def test_every_edit_changes_the_version():
+    table = ItemPieceTable(list('abcdef'))
+    versions = [table.version]
+    edits = [lambda: table.insert(2, 'x'), lambda: table.append('y'), lambda: table.__delitem__(0),
+             lambda: table.__delitem__(slice(1, 3)), lambda: table.__setitem__(0, 'z'),
+             lambda: table.__setitem__(slice(0, 2), table[2:4]), lambda: table.append_original_span(0, 2)]
+    for edit in edits:
+        edit()
+        versions.append(table.version)
+    assert len(set(versions)) == len(versions)
+
+
+def test_layer_columns_are_rebuilt_only_after_edits():
+    layer = GCodeLayer(0)
+    layer.items = ItemPieceTable([';TYPE:Perimeter\n', Move(x=1.0, y=1.0, z=0.2), Move(x=2.0, y=1.0, z=0.2)])
+    columns = layer.columns
+    assert layer.columns is columns
+    layer.items.insert(1, Move(x=5.0, y=5.0, z=0.2, move_type='travel'))
+    edited = layer.columns
+    assert edited is not columns and edited.move_count == 3
+    assert edited.positions().tolist() == LayerMoveColumns.from_items(layer.items).positions().tolist()
+    layer.items = ItemPieceTable(['M106\n'])
+    assert layer.columns.move_count == 0
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_edits_match_list(seed):
+    rng = random.Random(seed)
+    original = list(range(300))
+    table = ItemPieceTable(original, lines_backed=True)
+    mirror = list(original)
+    for step in range(2000):
+        op = rng.random()
+        if op < 0.45 or not mirror:
+            index = rng.randint(-len(mirror) - 2, len(mirror) + 2)
+            table.insert(index, -step)
+            mirror.insert(index, -step)
+        elif op < 0.75:
+            index = rng.randrange(-len(mirror), len(mirror))
+            assert table.pop(index) == mirror.pop(index)
+        elif op < 0.85:
+            start = rng.randrange(len(mirror))
+            stop = rng.randrange(start, min(len(mirror), start + 20) + 1)
+            del table[start:stop]
+            del mirror[start:stop]
+        elif op < 0.95:
+            index = rng.randrange(len(mirror))
+            table[index] = ('set', step)
+            mirror[index] = ('set', step)
+        else:
+            start = rng.randrange(len(mirror) + 1)
+            stop = min(len(mirror), start + rng.randrange(10))
+            assert list(table[start:stop]) == mirror[start:stop]
+        assert len(table) == len(mirror)
+    assert list(table) == mirror
+    assert [table[i] for i in range(len(mirror))] == mirror
+    assert sum(end - start for _, start, end in table.pieces()) == len(mirror)
+    for buffer, start, end in table.pieces():
+        assert end > start
+        if buffer is table.original:
+            assert buffer[start:end] == list(range(start, end))
@@ -0,0 +1,158 @@
+import random
+
+import numpy as np
+import pytest
+
+from gcode_models import LayerMoveColumns, Move
+from gcode_render import LEVEL_TOLERANCES, MoveDisplayBuffer, build_segment_batches, prepare_layer_render
+
+
+def segment_style(move_type):
+    """Three line styles, one of them dotted, like Layer3DViewerDialog._get_segment_style_for_type."""
+    if move_type == 'travel':
+        return (0, 1, 0, 1), 2, False, True
+    if move_type == 'perimeter':
+        return (0, 0, 1, 1), 3, True, False
+    return (0.5, 0.5, 0.5, 1), 4, True, False
+
+
+def random_move(rng):
+    maybe = lambda value: value if rng.random() > 0.1 else None # Some moves are not plotted
+    return Move(x=maybe(rng.uniform(0, 100)), y=maybe(rng.uniform(0, 100)), z=0.2,
+                move_type=rng.choice(['travel', 'perimeter', 'solid_infill']))
+
+
+def make_buffer(rng, move_count):
+    return MoveDisplayBuffer(LayerMoveColumns.from_items([random_move(rng) for _ in range(move_count)]))
+
+
+def random_edit(rng, buffer):
+    choice = rng.random()
+    if choice < 0.4 or buffer.move_count < 2:
+        buffer.insert_moves(rng.randrange(buffer.move_count + 1), [random_move(rng) for _ in range(rng.randrange(1, 4))])
+    elif choice < 0.7:
+        start = rng.randrange(buffer.move_count)
+        buffer.delete_moves(start, rng.randrange(1, min(3, buffer.move_count - start) + 1))
+    else:
+        buffer.set_move(rng.randrange(buffer.move_count), random_move(rng))
+
+
+def assert_same_batches(batches, expected_batches):
+    assert len(batches) == len(expected_batches)
+    for batch, expected_batch in zip(batches, expected_batches):
+        assert (batch.width, batch.antialias, batch.translucent) == \
+            (expected_batch.width, expected_batch.antialias, expected_batch.translucent)
+        np.testing.assert_array_equal(batch.segment_indices, expected_batch.segment_indices)
+        np.testing.assert_array_equal(batch.positions, expected_batch.positions)
+        np.testing.assert_array_equal(batch.colors, expected_batch.colors)
+
+
+def assert_valid_level(data, level_no):
+    """A level keeps the path's ends and type changes, stays within its tolerance and is drawn from its points."""
+    level, finer = data.level(level_no), data.level(level_no - 1)
+    kept, count = level.kept, len(data.points)
+    assert kept[0] == 0 and kept[-1] == count - 1 and np.all(np.diff(kept) > 0)
+    assert np.isin(kept, np.arange(count) if finer.kept is None else finer.kept).all()
+    changes = np.flatnonzero(data.type_codes[1:] != data.type_codes[:-1]) + 1
+    assert np.isin(changes, kept).all() and np.isin(changes - 1, kept).all()
+    # Distance of every point to the segment between the kept points around it
+    bracket = np.searchsorted(kept, np.arange(count), side='right') - 1
+    bracket = np.minimum(bracket, len(kept) - 2)
+    start, end = data.points[kept[bracket]], data.points[kept[bracket + 1]]
+    chord, to_point = end - start, data.points - start
+    length_sq = (chord * chord).sum(axis=1)
+    along = np.clip((to_point * chord).sum(axis=1) / np.where(length_sq > 0, length_sq, 1.0), 0.0, 1.0)
+    distance = np.linalg.norm(to_point - along[:, None] * chord, axis=1)
+    assert distance.max() <= 1.34 * LEVEL_TOLERANCES[level_no] + 1e-9
+    assert_same_batches(level.batches, build_segment_batches(data.points[kept], data.type_codes[kept], segment_style))
+
+
+def assert_same_render(data, expected):
+    np.testing.assert_array_equal(data.points, expected.points)
+    if expected.bounds is None:
+        assert data.bounds is None and data.center is None
+    else:
+        np.testing.assert_array_equal(data.bounds[0], expected.bounds[0])
+        np.testing.assert_array_equal(data.bounds[1], expected.bounds[1])
+        np.testing.assert_allclose(data.center, expected.center)
+    np.testing.assert_array_equal(data.type_codes, expected.type_codes)
+    np.testing.assert_array_equal(data.valid_points_before, expected.valid_points_before)
+    assert_same_batches(data.batches, expected.batches)
+
+
+def test_edited_range_of_single_edits():
+    buffer = make_buffer(random.Random(0), 10)
+    assert buffer.edited_range(0) is None
+    buffer.insert_moves(3, [Move(x=1.0, y=1.0, z=0.2)] * 2)
+    assert buffer.edited_range(0) == (3, 3, 5)
+    buffer.delete_moves(8, 2)
+    assert buffer.edited_range(1) == (8, 10, 8)
+    assert buffer.edited_range(0) == (3, 8, 8) # Covers both edits: old moves [3, 8) are now 2 new ones and old [3, 6)
+    buffer.set_move(0, Move(x=2.0, y=2.0, z=0.2))
+    assert buffer.edited_range(2) == (0, 1, 1)
+    assert buffer.edited_range(0) == (0, 8, 8)
+
+
+def test_edited_range_is_forgotten_after_the_history():
+    buffer = make_buffer(random.Random(0), 10)
+    for _ in range(MoveDisplayBuffer.EDIT_HISTORY + 1):
+        buffer.set_move(5, Move(x=1.0, y=1.0, z=0.2))
+    assert buffer.edited_range(0) is None
+    assert buffer.edited_range(1) == (5, 6, 6)
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_spliced_render_matches_full_prepare(seed):
+    rng = random.Random(seed)
+    buffer = make_buffer(rng, rng.randrange(0, 60))
+    data = prepare_layer_render(buffer.positions(), buffer.type_code, segment_style)
+    for _ in range(20):
+        version = buffer.version
+        old_positions = buffer.positions().copy()
+        for _ in range(rng.randrange(1, 4)):
+            random_edit(rng, buffer)
+        start, old_stop, new_stop = buffer.edited_range(version)
+        # Outside the edited range, the moves are the ones from before
+        np.testing.assert_array_equal(buffer.positions()[:start], old_positions[:start])
+        np.testing.assert_array_equal(buffer.positions()[new_stop:], old_positions[old_stop:])
+        data = data.spliced(start, old_stop, buffer.positions()[start:new_stop], buffer.type_code[start:new_stop])
+        assert_same_render(data, prepare_layer_render(buffer.positions(), buffer.type_code, segment_style))
+
+
+def dense_buffer(rng, move_count):
+    """Points along a noisy circle, which the levels of detail simplify."""
+    items = []
+    for i in range(move_count):
+        angle = i * 0.01
+        items.append(Move(x=50 + 20 * np.cos(angle) + rng.uniform(-0.01, 0.01), y=50 + 20 * np.sin(angle), z=0.2,
+                          move_type='perimeter' if (i // 150) % 3 else 'solid_infill'))
+    return MoveDisplayBuffer(LayerMoveColumns.from_items(items))
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_spliced_levels_are_resimplified_around_the_edit(seed):
+    rng = random.Random(seed)
+    buffer = dense_buffer(rng, 2000)
+    data = prepare_layer_render(buffer.positions(), buffer.type_code, segment_style)
+    built_levels = rng.randrange(1, len(LEVEL_TOLERANCES))
+    data.level(built_levels)
+    for _ in range(15):
+        version = buffer.version
+        for _ in range(rng.randrange(1, 3)):
+            random_edit(rng, buffer)
+        start, old_stop, new_stop = buffer.edited_range(version)
+        data = data.spliced(start, old_stop, buffer.positions()[start:new_stop], buffer.type_code[start:new_stop])
+        if not len(data.points):
+            break
+        assert sorted(data._levels) == list(range(built_levels + 1)) # Only the levels built so far are patched
+        for level_no in range(1, built_levels + 1):
+            assert_valid_level(data, level_no)
+
+
+def test_prefetched_items_count_in_render_data_size():
+    items = [random_move(random.Random(0)) for _ in range(10)]
+    columns = LayerMoveColumns.from_items(items)
+    data = prepare_layer_render(columns.positions(), columns.type_code, segment_style, columns=columns)
+    size = data.nbytes
+    data.items = items
+    assert data.nbytes == size + 10 * data.ITEM_BYTES
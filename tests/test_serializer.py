@@ -0,0 +1,202 @@
+import random
+
+import pytest
+
+from gcode_models import GCodeLayer, Move
+from gcode_parser import GCodeParser
+from gcode_undo import DeleteItemsCommand, InsertItemsCommand, ReplaceItemsCommand
+
+from test_parser import random_layer
+
+
+BATCH = GCodeParser(batch_serializer=True)
+LOOP = GCodeParser(batch_serializer=False)
+
+
+def parsed_layer(lines, build_items=False):
+    layer = GCodeLayer(0, original_lines=lines)
+    layer.columns = BATCH.parse_lines_to_columns(lines)
+    if build_items:
+        layer.items
+    return layer
+
+
+def item_layer(items):
+    layer = GCodeLayer(0)
+    layer.items = list(items)
+    return layer
+
+
+def random_items(rng, count):
+    items = [';LAYER_CHANGE\n']
+    e = 0.0
+    for _ in range(count):
+        choice = rng.random()
+        if choice < 0.1:
+            items.append(rng.choice([';TYPE:Perimeter\n', 'M106 S255\n', '\n']))
+            continue
+        if choice < 0.3:
+            e += rng.choice([0.0, 1e-6, 2e-5, -0.5]) # Repeated and near-repeated E values
+        else:
+            e += rng.uniform(0, 0.2)
+        maybe = lambda value: value if rng.random() > 0.15 else None
+        move_type = rng.choice(['travel', 'perimeter', 'solid_infill', None])
+        items.append(Move(x=maybe(rng.uniform(-10, 250)), y=maybe(rng.uniform(-10, 250)),
+                          z=maybe(round(rng.uniform(0, 5), 2)), e=maybe(e), move_type=move_type))
+    return items
+
+
+def test_empty_layer():
+    assert BATCH._gcode_layer_to_lines_batch(parsed_layer([])) == []
+    assert BATCH._gcode_layer_to_lines_batch(item_layer([])) == [] == LOOP._gcode_layer_to_lines_loop(item_layer([]))
+
+
+def test_comment_only_layer():
+    lines = [';LAYER_CHANGE\n', ';Z:0.4\n', '\n', ';TYPE:Perimeter\n']
+    assert BATCH._gcode_layer_to_lines_batch(parsed_layer(lines)) == lines
+    assert LOOP._gcode_layer_to_lines_loop(parsed_layer(lines, build_items=True)) == lines
+
+
+def test_bare_moves_are_dropped():
+    items = ['M83\n', Move(), Move(x=1.0), Move(e=2.0, move_type='travel')]
+    assert BATCH._gcode_layer_to_lines_batch(item_layer(items)) == ['M83\n', 'G1 X1.000\n']
+    assert LOOP._gcode_layer_to_lines_loop(item_layer(items)) == ['M83\n', 'G1 X1.000\n']
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_items_match_loop(seed):
+    rng = random.Random(seed)
+    layer = item_layer(random_items(rng, rng.randrange(0, 300)))
+    assert BATCH._gcode_layer_to_lines_batch(layer) == LOOP._gcode_layer_to_lines_loop(layer)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_parsed_columns_match_loop(seed):
+    rng = random.Random(seed)
+    lines = random_layer(rng, rng.randrange(0, 300))
+    expected = LOOP._gcode_layer_to_lines_loop(parsed_layer(lines, build_items=True))
+    assert BATCH._gcode_layer_to_lines_batch(parsed_layer(lines)) == expected
+    assert BATCH._gcode_layer_to_lines_batch(parsed_layer(lines, build_items=True)) == expected
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_edited_piece_table_matches_loop(seed):
+    rng = random.Random(seed)
+    layer = parsed_layer(random_layer(rng, 200), build_items=True)
+    items = layer.items
+    for step, item in enumerate(random_items(rng, 30)[1:]):
+        if step % 4 == 3:
+            del items[rng.randrange(len(items))]
+        # Scattered inserts, and a run typed at one spot
+        items.insert(rng.randrange(len(items) + 1) if step % 3 == 0 else min(len(items), 40 + step), item)
+    assert BATCH.gcode_layer_to_lines(layer) == LOOP.gcode_layer_to_lines(layer)
+
+
+def printer_moves(lines):
+    """The X/Y/Z/E position after each move line of `lines`, as a printer in absolute mode runs them."""
+    position = {'X': None, 'Y': None, 'Z': None, 'E': None}
+    moves = []
+    for line in lines:
+        words = line.split(';', 1)[0].upper().split()
+        if not words or words[0] not in ('G0', 'G1', 'G2', 'G3', 'G92'):
+            continue
+        axes = {word[0]: float(word[1:]) for word in words[1:] if word[0] in position}
+        position.update(axes)
+        if axes and words[0] != 'G92':
+            moves.append(tuple(position.values()))
+    return moves
+
+
+def printable_layer(rng, line_count):
+    """Absolute-E layer lines: feedrates, retractions, comments and Z only set by some moves."""
+    lines = [';LAYER_CHANGE\n', 'G1 Z0.4 F720\n', ';TYPE:Perimeter\n']
+    e = 0.0
+    for _ in range(line_count):
+        choice = rng.random()
+        if choice < 0.1:
+            lines.append(rng.choice([';TYPE:Solid infill\n', '; a comment\n', 'M106 S255\n']))
+        elif choice < 0.25:
+            lines.append(f'G0 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} F9000\n')
+        elif choice < 0.3:
+            e -= 0.8
+            lines.append(f'G1 E{e:.5f} F2100\n')
+        elif choice < 0.35:
+            lines.append(f'G1 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} Z{rng.uniform(0.4, 0.6):.3f}\n')
+        else:
+            e += rng.uniform(0.01, 0.1)
+            lines.append(f'G1 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} E{e:.5f}\n')
+    return lines
+
+
+def assert_prints_like_loop(layer):
+    """The piece table's lines move the printer as the move-by-move serializer's lines of the same items do."""
+    expected = printer_moves(LOOP._items_to_lines_loop(list(layer.items), None)[0])
+    for parser in (BATCH, LOOP):
+        assert printer_moves(parser.gcode_layer_to_lines(layer)) == expected
+
+
+def test_travel_inserted_above_the_tip_does_not_lift_the_layer():
+    layer = parsed_layer(['G1 X0 Y0 Z0.2\n', 'G1 X2 Y0 E0.5\n', 'G1 X10 Y0 E1\n', 'G1 X10 Y10 E2\n'],
+                         build_items=True)
+    layer.items.insert(2, Move(x=2.0, y=0.0, z=1.2, move_type='travel'))
+    lines = BATCH.gcode_layer_to_lines(layer)
+    assert lines[2:4] == ['G1 X2.000 Y0.000 Z1.200\n', 'G1 X10.000 Y0.000 Z0.200 E1.00000\n']
+    assert printer_moves(lines)[-1] == (10.0, 10.0, 0.2, 2.0)
+    assert_prints_like_loop(layer)
+
+
+def test_translated_first_move_keeps_later_moves_in_place():
+    layer = parsed_layer([';TYPE:Perimeter\n', 'G1 X0 Y0 Z0.2 F1800\n', 'G1 X10 Y0 E1\n', 'G1 X10 Y10 E2\n'],
+                         build_items=True)
+    ReplaceItemsCommand.translate_moves(layer.items, [1], dz=0.5).apply(layer.items)
+    lines = BATCH.gcode_layer_to_lines(layer)
+    assert [move[2] for move in printer_moves(lines)] == [0.7, 0.2, 0.2]
+    assert_prints_like_loop(layer)
+
+
+def test_deleted_first_move_keeps_the_layer_height():
+    layer = parsed_layer(['G1 X0 Y0 Z0.2 F1800\n', 'G1 X10 Y0 E1\n', 'G1 X10 Y10 E2\n'], build_items=True)
+    del layer.items[0]
+    lines = BATCH.gcode_layer_to_lines(layer)
+    assert lines[0] == 'G1 X10.000 Y0.000 Z0.200 E1.00000\n'
+    assert printer_moves(lines) == [(10.0, 0.0, 0.2, 1.0), (10.0, 10.0, 0.2, 2.0)]
+
+
+def test_resumed_move_keeps_its_feedrate_and_line_ending():
+    layer = parsed_layer(['G1 X0 Y0 Z0.2\r\n', 'G1 X5 Y0 E0.5\r\n', 'G1 X10 Y0 F1200 E1\r\n', 'G1 X10 Y10 E2\r\n'],
+                         build_items=True)
+    del layer.items[1]
+    assert BATCH.gcode_layer_to_lines(layer)[1:] == ['G1 X10.000 Y0.000 Z0.200 E1.00000 F1200\r\n',
+                                                     'G1 X10 Y10 E2\r\n']
+
+
+def test_g92_is_tracked_across_pieces():
+    layer = parsed_layer(['G1 X0 Y0 Z0.2\n', 'G1 X5 Y0 E2\n', 'G92 E0\n', 'G1 X6 Y0 E2\n', 'G1 X7 Y0 E3\n'],
+                         build_items=True)
+    del layer.items[3]
+    # After the G92, E2 is a new position and is written again
+    assert BATCH.gcode_layer_to_lines(layer)[3] == 'G1 X7.000 Y0.000 Z0.200 E3.00000\n'
+    layer.items.insert(3, Move(x=6.0, y=0.0, z=0.2, e=2.0, move_type='perimeter'))
+    assert BATCH.gcode_layer_to_lines(layer)[3] == 'G1 X6.000 Y0.000 Z0.200 E2.00000\n'
+    assert printer_moves(BATCH.gcode_layer_to_lines(layer)) == printer_moves(layer.read_original_lines())
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_edited_piece_table_prints_like_loop(seed):
+    rng = random.Random(seed)
+    layer = parsed_layer(printable_layer(rng, 150), build_items=True)
+    items = layer.items
+    for _ in range(15):
+        choice = rng.random()
+        move_indices = [i for i, item in enumerate(items) if isinstance(item, Move)]
+        if choice < 0.3 and move_indices: # A point moved, as in the editor's point mode
+            ReplaceItemsCommand.translate_moves(items, [rng.choice(move_indices)], dx=1.0, dz=rng.choice([0, 0.5]))\
+                .apply(items)
+        elif choice < 0.6 and len(items) > 1:
+            start = rng.randrange(len(items))
+            DeleteItemsCommand(start, rng.randrange(1, min(4, len(items) - start) + 1)).apply(items)
+        else:
+            new_items = [Move(x=rng.uniform(0, 200), y=rng.uniform(0, 200), z=rng.uniform(0.2, 2),
+                              move_type='travel') for _ in range(rng.randrange(1, 3))]
+            InsertItemsCommand(rng.randrange(len(items) + 1), new_items).apply(items)
+        assert_prints_like_loop(layer)
@@ -0,0 +1,187 @@
+import numpy as np
+import pytest
+
+from gcode_file_handler import GCodeFileHandler
+from gcode_models import ItemMoveIndex, ItemPieceTable, LayerMoveColumns, Move
+from gcode_parser import GCodeParser
+from gcode_render import MoveDisplayBuffer
+from gcode_undo import DeleteItemsCommand, EditCommand, InsertItemsCommand, ReplaceItemsCommand, UndoStack
+
+from test_serializer import printer_moves
+
+
+def make_items(move_count=20):
+    items = [';LAYER_CHANGE\n', ';TYPE:Perimeter\n']
+    for i in range(move_count):
+        items.append(Move(x=float(i), y=float(i % 3), z=0.2, e=0.1 * i, move_type='perimeter',
+                          original_line_index=len(items)))
+        if i % 5 == 4:
+            items.append('M106 S255\n')
+    return items
+
+
+def apply_changes(mirror, changes):
+    """Replays the primitive changes a command reports onto another list."""
+    for op, index, item in changes:
+        if op == 'insert':
+            mirror.insert(index, item)
+        else:
+            del mirror[index]
+
+
+def round_trip(command, items):
+    """Pushes, undoes and redoes `command`, checking the items and a mirror fed with the reported changes."""
+    original = list(items)
+    mirror = list(items)
+    stack = UndoStack()
+    apply_changes(mirror, stack.push(command, items))
+    applied = list(items)
+    assert mirror == applied
+
+    undone, changes = stack.undo(items)
+    assert undone is command
+    apply_changes(mirror, changes)
+    assert list(items) == original and mirror == original
+    assert all(a is b for a, b in zip(items, original)) # Undo puts back the same objects
+
+    redone, changes = stack.redo(items)
+    assert redone is command
+    apply_changes(mirror, changes)
+    assert list(items) == applied and mirror == applied
+    return applied
+
+
+@pytest.fixture(params=[list, ItemPieceTable])
+def items(request):
+    return request.param(make_items())
+
+
+def test_insert_round_trip(items):
+    new_move = Move(x=1.0, y=2.0, z=1.2, move_type='travel_edit')
+    applied = round_trip(InsertItemsCommand(3, [new_move, 'G4 P0\n']), items)
+    assert applied[3] is new_move and applied[4] == 'G4 P0\n'
+
+
+@pytest.mark.parametrize('index, count', [(0, 1), (4, 3), (10, 1)])
+def test_delete_round_trip(items, index, count):
+    original = list(items)
+    applied = round_trip(DeleteItemsCommand(index, count), items)
+    assert applied == original[:index] + original[index + count:]
+
+
+def test_delete_at_end(items):
+    round_trip(DeleteItemsCommand(len(items) - 1), items)
+
+
+def test_translate_moves_round_trip(items):
+    move_indices = [i for i, item in enumerate(items) if isinstance(item, Move)][2:6]
+    before = [items[i] for i in move_indices]
+    command = ReplaceItemsCommand.translate_moves(items, move_indices + [0], dx=1.5, dy=-2.0)
+    assert sorted(command.replacements) == move_indices # Text lines are left alone
+    applied = round_trip(command, items)
+    for i, old in zip(move_indices, before):
+        new = applied[i]
+        assert new is not old # Moves are replaced, never changed in place
+        assert (new.x, new.y, new.z, new.e, new.type) == (old.x + 1.5, old.y - 2.0, old.z, old.e, old.type)
+
+
+def test_translate_keeps_unset_coordinates():
+    items = [Move(x=1.0, y=None, z=None, move_type='travel')]
+    command = ReplaceItemsCommand.translate_moves(items, [0], dx=1.0, dy=1.0, dz=1.0)
+    command.apply(items)
+    assert (items[0].x, items[0].y, items[0].z) == (2.0, None, None)
+
+
+def test_new_command_drops_redo_history():
+    items = make_items()
+    stack = UndoStack()
+    stack.push(DeleteItemsCommand(0), items)
+    stack.undo(items)
+    assert stack.can_redo
+    stack.push(InsertItemsCommand(0, ['; note\n']), items)
+    assert not stack.can_redo
+    assert stack.redo(items) == (None, [])
+
+
+def test_max_depth_forgets_oldest():
+    items = make_items()
+    stack = UndoStack(max_depth=2)
+    for i in range(3):
+        stack.push(InsertItemsCommand(0, [f'; {i}\n']), items)
+    assert stack.undo(items)[0] is not None
+    assert stack.undo(items)[0] is not None
+    assert stack.undo(items) == (None, [])
+    assert items[0] == '; 0\n'
+
+
+def test_display_buffer_follows_commands():
+    items = ItemPieceTable(make_items())
+    buffer = MoveDisplayBuffer(LayerMoveColumns.from_items(items))
+    move_index = ItemMoveIndex.from_items(items)
+    stack = UndoStack()
+
+    def check():
+        columns = LayerMoveColumns.from_items(items)
+        np.testing.assert_array_equal(buffer.positions(), columns.positions())
+        np.testing.assert_array_equal(buffer.type_code, columns.type_code)
+        assert move_index.move_count == columns.move_count
+
+    move_indices = [i for i, item in enumerate(items) if isinstance(item, Move)]
+    commands = [
+        InsertItemsCommand(5, [Move(x=9.0, y=9.0, z=1.0, move_type='travel_edit')]),
+        DeleteItemsCommand(2, 4),
+        ReplaceItemsCommand.translate_moves(items, move_indices[8:12], dx=1.0),
+    ]
+    for command in commands:
+        buffer.apply_item_changes(stack.push(command, items), move_index)
+        check()
+    version = buffer.version
+    for _ in commands:
+        buffer.apply_item_changes(stack.undo(items)[1], move_index)
+        check()
+    assert buffer.version > version
+    for _ in commands:
+        buffer.apply_item_changes(stack.redo(items)[1], move_index)
+        check()
+
+
+def write_layered_gcode(path):
+    """Three layers whose Z is set only by their first move. Returns the file's lines."""
+    lines = ['G28\n', 'G90\n', 'M82\n']
+    e = 0.0
+    for layer_no in range(3):
+        z = 0.2 * (layer_no + 1)
+        lines += [';LAYER_CHANGE\n', f';Z:{z:.1f}\n', f'G1 X0 Y0 Z{z:.3f} F9000\n', ';TYPE:Perimeter\n']
+        for i in range(12):
+            e += 0.05
+            lines.append(f'G1 X{10 + i} Y{(i * 7) % 13} E{e:.5f}' + (' F1800\n' if i == 0 else '\n'))
+    path.write_text(''.join(lines))
+    return lines
+
+
+@pytest.mark.parametrize('edit', ['point', 'lifted_point', 'delete'])
+def test_saved_edits_print_as_expected(tmp_path, edit):
+    lines = write_layered_gcode(tmp_path / 'part.gcode')
+    handler = GCodeFileHandler(GCodeParser())
+    document = handler.load_gcode_file(str(tmp_path / 'part.gcode'))
+    items = document.get_layer_by_document_index(1).items
+    first_move = next(i for i, item in enumerate(items) if isinstance(item, Move))
+    expected = printer_moves(lines)
+    moved = len(printer_moves(lines[:lines.index('G1 X0 Y0 Z0.400 F9000\n')])) # The layer's first move
+    if edit == 'delete':
+        command = DeleteItemsCommand(first_move)
+        del expected[moved]
+    else:
+        dz = 0.5 if edit == 'lifted_point' else 0.0
+        command = ReplaceItemsCommand.translate_moves(items, [first_move], dx=1.0, dy=2.0, dz=dz)
+        expected[moved] = (1.0, 2.0, 0.4 + dz, expected[moved][3])
+    UndoStack().push(command, items)
+
+    handler.save_gcode_document(document, str(tmp_path / 'saved.gcode'), edited_layer_indices={1})
+    saved = (tmp_path / 'saved.gcode').read_text().splitlines(True)
+    assert printer_moves(saved) == pytest.approx(expected)
+
+
+def test_edit_command_is_abstract():
+    with pytest.raises(TypeError):
+        EditCommand()